@@ -0,0 +1,67 @@
+"""
+Cold-start benchmark for the strain product loaders.
+
+Each execution mode ("serial", "thread") is timed in a fresh Python
+process with an empty product cache, so every run pays for reading the HDF5
+files, the bandpass filters, the Welch PSDs and the whitening, exactly like a
+cold container start or a product cache rebuild. GW_PARALLEL_MODE=process
+loads on threads too, see tools.data_caching.PIPELINE_MODE.
+
+Run from the repository root:
+
+    python -m benchmarks.cold_start [--repeat 3] [--modes serial thread]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+LOADERS = ["load_pure_data", "load_raw_data", "load_bandpass_data", "load_whitend_data",
+           "load_GW_data", "load_ASD_data", "load_PSD_data"]
+
+#--------------------------------------------
+def run_child():
+    """Load every product once and print the elapsed wall time as JSON."""
+    import tools.data_caching as data_caching
+
+    start = time.perf_counter()
+    for name in LOADERS:
+        getattr(data_caching, name)()
+    print(json.dumps({"seconds": time.perf_counter() - start}))
+#--------------------------------------------
+
+#--------------------------------------------
+def time_mode(mode: str)-> float:
+    """Time one cold load of every product with the given parallel mode."""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, GW_PARALLEL_MODE=mode, GW_PRODUCT_CACHE_DIR=cache_dir)
+        result = subprocess.run([sys.executable, "-m", "benchmarks.cold_start", "--child"],
+                                env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])["seconds"]
+#--------------------------------------------
+
+#--------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["serial", "thread"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child()
+        return
+
+    print(f"{os.cpu_count()} CPUs available")
+    timings = {mode: min(time_mode(mode) for _ in range(args.repeat)) for mode in args.modes}
+    baseline = timings.get("serial")
+    for mode, seconds in timings.items():
+        speedup = f"  ({baseline/seconds:.2f}x vs serial)" if baseline else ""
+        print(f"{mode:>8}: {seconds*1e3:8.1f} ms{speedup}")
+#--------------------------------------------
+
+if __name__ == "__main__":
+    main()
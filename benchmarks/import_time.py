@@ -0,0 +1,69 @@
+"""
+Import time benchmark for the template generation module.
+
+Each module is imported in a fresh Python process, so the numbers include
+everything a page pays for on a cold start. The time to the first template is
+measured separately, as that is where pycbc, gwpy and the strain data are now
+loaded.
+
+Run from the repository root:
+
+    python -m benchmarks.import_time [--repeat 5] [--modules tools.gen_template_function]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+FIRST_TEMPLATE_PARAMS = [135., .54, 1600., .027, .72, 2., -.95, .82, 1.01]
+
+#--------------------------------------------
+def run_child(module: str, first_template: bool):
+    """Import a module (and optionally generate one template) and print the elapsed wall time as JSON."""
+    import importlib
+
+    start = time.perf_counter()
+    mod = importlib.import_module(module)
+    imported = time.perf_counter()
+    result = {"import": imported - start}
+    if first_template:
+        mod.gen_template(FIRST_TEMPLATE_PARAMS)
+        result["first_template"] = time.perf_counter() - imported
+    print(json.dumps(result))
+#--------------------------------------------
+
+#--------------------------------------------
+def time_module(module: str, first_template: bool = False)-> dict:
+    """Time one cold import of a module in a subprocess."""
+    command = [sys.executable, "-m", "benchmarks.import_time", "--child", module]
+    if first_template:
+        command.append("--first-template")
+    result = subprocess.run(command, env=dict(os.environ), capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+#--------------------------------------------
+
+#--------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=["tools.gen_template_function"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--first-template", action="store_true", help="also time the first gen_template() call")
+    parser.add_argument("--child", metavar="MODULE", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.first_template)
+        return
+
+    for module in args.modules:
+        runs = [time_module(module, args.first_template) for _ in range(args.repeat)]
+        line = f"{module}: import {min(run['import'] for run in runs)*1e3:8.1f} ms"
+        if args.first_template:
+            line += f", first template {min(run['first_template'] for run in runs)*1e3:8.1f} ms"
+        print(line)
+#--------------------------------------------
+
+if __name__ == "__main__":
+    main()
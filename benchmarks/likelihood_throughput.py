@@ -0,0 +1,91 @@
+"""
+Throughput of tools.likelihood against the reference loglikelihood().
+
+The reference is the code shown on the Statistical Sampling page: gwpy
+FrequencySeries cropped on every call, a time domain template transformed
+with average_fft(), and astropy units carried through the sums. Both run at
+the same sample rate on the same data, with the waveform cache warm so the
+comparison is of everything but the waveform generator itself. The inner
+product kernel is also timed alone, on a precomputed template.
+
+Run from the repository root:
+
+    python -m benchmarks.likelihood_throughput [--seconds 2]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from astropy import units as u
+
+#--------------------------------------------
+def reference_loglikelihood(param, sf, psd, time_grid, ifos, f_lower=10.0):
+    """The loglikelihood() of the Statistical Sampling page, unchanged apart from its arguments."""
+    from tools.gen_template_function import gen_template
+
+    logl = 0.0 * u.Hz**2 # type: ignore
+    template = gen_template(param, f_lower=f_lower, **time_grid)
+    for ifo in ifos:
+        sf_hp = sf[ifo].crop(start=f_lower)
+        psd_hp = psd[ifo].crop(start=f_lower)
+        hf = template[ifo].average_fft(window=('tukey',1./4.))*template[ifo].duration.value/2
+        hf_hp = hf.crop(start=f_lower)
+        if len(hf_hp) == 0 or len(sf_hp) == 0 or len(psd_hp) == 0:
+            return -np.inf
+        h_dot_h  = 4 * np.real((hf_hp * hf_hp.conjugate() / psd_hp).sum() * hf_hp.df)
+        h_dot_s  = 4 * np.real((sf_hp * hf_hp.conjugate() / psd_hp).sum() * sf_hp.df)
+        logl += h_dot_s - h_dot_h/2
+    if not np.isfinite(logl):
+        return -np.inf
+    return float(logl.to_value('Hz2'))
+#--------------------------------------------
+
+#--------------------------------------------
+def rate_per_second(func, seconds: float)-> float:
+    """Call func repeatedly for about the given time and return the calls per second."""
+    func()
+    calls, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        func()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+#--------------------------------------------
+
+#--------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=2., help="time spent on each variant")
+    args = parser.parse_args()
+
+    from tools.data_caching import get_spectrum
+    from tools.likelihood import load_likelihood
+
+    likelihood = load_likelihood()
+    param = list(pd.read_parquet("MCMC_data/MAP_parameters.parquet")["MAP"].iloc[:9])
+
+    # the page's inputs: data FFTs and PSDs as gwpy series, at the same rate as the likelihood
+    from tools.data_caching import get_product, PROCESSING_PARAMS, EVENT_WINDOW, ANALYSIS_SAMPLE_RATE
+    sf, psd = {}, {}
+    for ifo in likelihood.ifos:
+        data = get_product(ifo, band=PROCESSING_PARAMS["bandpass"], crop=EVENT_WINDOW, rate=ANALYSIS_SAMPLE_RATE)
+        sf[ifo] = data.average_fft(window=('tukey',1./4.))*data.duration.value/2
+        psd[ifo] = get_spectrum(ifo, "psd", rate=ANALYSIS_SAMPLE_RATE)
+
+    reference = reference_loglikelihood(param, sf, psd, likelihood.time_grid, likelihood.ifos)
+    value = likelihood(param)
+    print(f"log likelihood: reference {reference:.6f}, tools.likelihood {value:.6f} (rel. difference {abs(value/reference - 1):.1e})\n")
+
+    h_f = likelihood.template(param)
+    rates = {
+        "reference loglikelihood()": rate_per_second(lambda: reference_loglikelihood(param, sf, psd, likelihood.time_grid, likelihood.ifos), args.seconds),
+        "FrequencyDomainLikelihood()": rate_per_second(lambda: likelihood(param), args.seconds),
+        "inner product kernel only": rate_per_second(lambda: likelihood.loglikelihood_from_templates(h_f), args.seconds),
+    }
+    baseline = rates["reference loglikelihood()"]
+    for name, rate in rates.items():
+        print(f"{name:>28}: {rate:10.0f} evaluations/s  ({rate/baseline:7.1f}x)")
+#--------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Throughput of logposterior_batch() against a per-walker multiprocessing pool.
+
+The per-walker variant is how the Statistical Sampling page runs emcee: a
+multiprocessing.Pool maps logposterior() over the walkers, pickling each
+walker and its result. The batched variant evaluates the whole ensemble with
+logposterior_batch(), as emcee does with vectorize=True. Every round draws a
+fresh ensemble around the MAP parameters (the same jitter as the page's
+starting positions), so each variant pays for new waveforms like a sampler
+does. One warm-up round per variant is not timed.
+
+Run from the repository root:
+
+    python -m benchmarks.posterior_throughput [--rounds 5] [--nwalkers 24] [--emcee-steps 0]
+"""
+import argparse
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from tools.posterior import logprior_batch, logposterior, logposterior_batch
+
+#--------------------------------------------
+def ensembles(opt, nwalkers: int, rounds: int, seed: int = 42)-> list:
+    """Draw rounds of walker positions scattered around opt and inside the prior, like the page's random_in_bounds()."""
+    rng = np.random.default_rng(seed)
+    scale = 1e-2 * np.maximum(np.abs(opt), .1)
+    draws = []
+    for _ in range(rounds):
+        walkers = opt + rng.standard_normal((nwalkers, len(opt))) * scale
+        outside = ~np.isfinite(logprior_batch(walkers))
+        while outside.any():
+            walkers[outside] = opt + rng.standard_normal((outside.sum(), len(opt))) * scale
+            outside = ~np.isfinite(logprior_batch(walkers))
+        draws.append(walkers)
+    return draws
+#--------------------------------------------
+
+#--------------------------------------------
+def time_rounds(evaluate, rounds: list)-> tuple:
+    """Evaluate every round after one warm-up and return (walker evaluations per second, values)."""
+    evaluate(rounds[0] * (1 + 1e-3))
+    values, start = [], time.perf_counter()
+    for walkers in rounds:
+        values.append(np.asarray(evaluate(walkers)))
+    seconds = time.perf_counter() - start
+    return sum(len(walkers) for walkers in rounds) / seconds, np.concatenate(values)
+#--------------------------------------------
+
+#--------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--nwalkers", type=int, default=24)
+    parser.add_argument("--emcee-steps", type=int, default=0, help="also run emcee with vectorize=True for this many steps")
+    args = parser.parse_args()
+
+    opt = pd.read_parquet("MCMC_data/MAP_parameters.parquet")["MAP"].iloc[:9].to_numpy()
+    rounds = ensembles(opt, args.nwalkers, args.rounds)
+    print(f"{os.cpu_count()} CPUs, {args.nwalkers} walkers, {args.rounds} rounds\n")
+
+    with mp.Pool() as pool:
+        pool_rate, pool_values = time_rounds(lambda walkers: pool.map(logposterior, walkers), rounds)
+    batch_rate, batch_values = time_rounds(logposterior_batch, rounds)
+    serial_rate, _ = time_rounds(lambda walkers: logposterior_batch(walkers, mode="serial"), rounds)
+
+    finite = np.isfinite(pool_values)
+    difference = np.abs(batch_values[finite] - pool_values[finite]).max() if finite.any() else 0.
+    print(f"max |difference| of the log posteriors: {difference:.2e} ({finite.sum()} finite)\n")
+    for name, rate in [("per-walker mp.Pool", pool_rate), ("logposterior_batch, process pool", batch_rate), ("logposterior_batch, serial", serial_rate)]:
+        print(f"{name:>34}: {rate:8.1f} walker evaluations/s  ({rate/pool_rate:5.2f}x)")
+
+    if args.emcee_steps:
+        import emcee
+        from emcee.moves import StretchMove, DEMove
+
+        p0 = ensembles(opt, args.nwalkers, 1, seed=7)[0]
+        sampler = emcee.EnsembleSampler(args.nwalkers, len(opt), logposterior_batch, vectorize=True,
+                                        moves=[(StretchMove(a=2.0), 0.8), (DEMove(), 0.2)])
+        start = time.perf_counter()
+        sampler.run_mcmc(p0, args.emcee_steps)
+        seconds = time.perf_counter() - start
+        print(f"\nemcee vectorize=True: {args.emcee_steps} steps in {seconds:.1f} s, acceptance {sampler.acceptance_fraction.mean():.2f}")
+#--------------------------------------------
+
+if __name__ == "__main__":
+    main()
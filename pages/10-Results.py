@@ -1,6 +1,6 @@
 import streamlit as st
 import numpy as np
-from gwosc.datasets import event_gps
+from tools.event_registry import event_gps
 from astropy.time import Time
 import plotly.express as px
 import plotly.graph_objects as go
@@ -8,6 +8,7 @@ from plotly_resampler import FigureResampler # type: ignore
 from tools.plotly_templates import *
 from tools.data_caching import *
 from tools.gen_template_function import *
+from tools.postprocess import load_results
 import pandas as pd
 from plotly.subplots import make_subplots
 
@@ -21,10 +22,11 @@ pure_data = load_pure_data()
 raw_data = load_raw_data()
 bandpass_data = load_bandpass_data()
 whitend_data = load_whitend_data()
-GW_data = load_GW_data()
+# the models are compared to data at the analysis sample rate, same time grid as gen_template()
+GW_data = load_analysis_GW_data()
 
 
-PSD_data = load_PSD_data()
+PSD_data = load_analysis_PSD_data()
 
 #code
 #gets the time of the event and prints it
@@ -38,36 +40,17 @@ datetime_center = Time(time_center, format='gps').utc.datetime  # type: ignore
 #burnin = 35426 
 #thin = 2
 
-MAP_df = pd.read_parquet("MCMC_data/MAP_parameters.parquet")
-MAP_df.rename(inplace=True,index={"TimeShift":"Time Shift","RA":"Right Ascension","Dec":"Declination","Incl":"Inclination","Pol":"Polarization","lp":"Log Posterior","chain":"Chain","draw":"Draw"})
+# MAP and credible intervals, already rounded and typeset by tools.postprocess
+@st.cache_data
+def load_results_artifact():
+    return load_results()
 
-results_df = MAP_df.copy()
+results = load_results_artifact()
 
-column_dec_value = {"Mass":1,"Ratio":2,"Distance":0,"Time Shift":5,"Phase":2,"Right Ascension":4,"Declination":3,"Inclination":2,"Polarization":3}
 
-column_titles = np.array(["Mass","Ratio","Distance","Time Shift","Phase","Right Ascension","Declination","Inclination","Polarization"])
-
-
-for i in column_titles:
-    temp = results_df["MAP"].loc[i]
-    temp = np.round(temp,column_dec_value[i])
-    results_df["MAP"].loc[i] = temp
-    temp1,temp2 = results_df["onestd"].loc[i]
-    temp1 =np.round(temp1,column_dec_value[i])
-    temp2 =np.round(temp2,column_dec_value[i])
-    results_df["onestd"].loc[i] = (temp1, temp2)
-    temp1,temp2 = results_df["twostd"].loc[i]
-    temp1 =np.round(temp1,column_dec_value[i])
-    temp2 =np.round(temp2,column_dec_value[i])
-    results_df["twostd"].loc[i] = (temp1, temp2)
-
-
-def get_results(index="Mass"):
-
-    MAP=results_df["MAP"].loc[index]
-    onesig_low,onesig_high = results_df["onestd"].loc[index]
-    twosig_low, twosig_high = results_df["twostd"].loc[index]
-    return MAP,onesig_low, onesig_high, twosig_low, twosig_high
+def show_result(title="Mass"):
+    entry = results["parameters"][title]
+    st.latex(entry["latex"],help=entry["help"])
 
 
 st.write("Here are my Maximum a posteriori estimates for each of the model parameters, shown with 95% confidence values.")
@@ -77,45 +60,22 @@ results_col1, results_col2 = st.columns([1,1],gap=None)
 
 
 with results_col1:
-        
-    MAP, onesig_low, onesig_high, twosig_low, twosig_high = get_results("Mass")
-    st.latex(rf"""M_1={MAP}^{{{twosig_high}}}_{{{twosig_low}}} \;""",help="Primary Mass")
-
-    MAP, onesig_low, onesig_high, twosig_low, twosig_high = get_results("Ratio")
-    st.latex(rf"""q={MAP}^{{{twosig_high}}}_{{{twosig_low}}} \; """,help="Mass Ratio")
-
-    MAP, onesig_low, onesig_high, twosig_low, twosig_high = get_results("Distance")
-    st.latex(rf"""D_L={int(MAP)}^{{{int(twosig_high)}}}_{{{int(twosig_low)}}} \; """,help="Luminosity Distance")
-
-    MAP, onesig_low, onesig_high, twosig_low, twosig_high = get_results("Phase")
-    st.latex(rf"""\phi_c={MAP}^{{{twosig_high}}}_{{{twosig_low}}} \; """,help="Coalesence Phase")
+    for title in ["Mass","Ratio","Distance","Phase"]:
+        show_result(title)
 
 with results_col2:
-    MAP, onesig_low, onesig_high, twosig_low, twosig_high = get_results("Right Ascension")
-    st.latex(rf"""\alpha={MAP}^{{{twosig_high}}}_{{{twosig_low}}} \; """,help="Right Ascension")
-
-    MAP, onesig_low, onesig_high, twosig_low, twosig_high = get_results("Declination")
-    st.latex(rf"""\delta={MAP}^{{{twosig_high}}}_{{{twosig_low}}} \; """,help="Declination")
-
-    MAP, onesig_low, onesig_high, twosig_low, twosig_high = get_results("Inclination")
-    st.latex(rf"""i={MAP}^{{{twosig_high}}}_{{{twosig_low}}} \; """,help="Inclination")
-
-    MAP, onesig_low, onesig_high, twosig_low, twosig_high = get_results("Polarization")
-    st.latex(rf"""P={MAP}^{{{twosig_high}}}_{{{twosig_low}}} \; """,help="Polarization")
+    for title in ["Right Ascension","Declination","Inclination","Polarization"]:
+        show_result(title)
 
 
-
-MAP, onesig_low, onesig_high, twosig_low, twosig_high = get_results("Time Shift")
-st.latex(rf"""TimeShift={MAP}^{{{twosig_high}}}_{{{twosig_low}}} \; """,help="Time from event_gps('GW190521')")
+show_result("Time Shift")
 #st.latex(rf"""TimeShift={MAP}^{{{onesig_high}}}_{{{onesig_low}}} \; (\text{{1$\sigma$}}),\quad{MAP}^{{{twosig_high}}}_{{{twosig_low}}} \; (\text{{2$\sigma$}})""")
 
 
 
 st.subheader("Plotting a MAP parameter model against data")
 
-MAP_params = []
-for i in range(9):
-    MAP_params.append(results_df["MAP"].iloc[i])
+MAP_params = results["map_params"]
 
 
 MAP_template = gen_template(MAP_params)
@@ -189,15 +149,20 @@ colours = load_colours_dict()
 
 labels = load_labels_dict()
 
+analysis_raw_data = load_analysis_raw_data()
+
+# The MAP template straight in the frequency domain, with the same normalisation as average_fft() below
+MAP_template_f = gen_template(MAP_params, domain="frequency")
+
 for ifo in ifos:
     template = MAP_template[ifo]
-    cropped_data = pure_data[ifo].crop(time_center - 2,time_center + 2)
+    cropped_data = analysis_raw_data[ifo]
 
     # FFT of the data, with the appropriate normalisation
     data_f=cropped_data.average_fft(window=('tukey',1./4.))*(cropped_data.duration/2)
 
     # FFT of the template, with the appropriate normalisation
-    template_f=template.average_fft(window=('tukey',1./4.))*(template.duration/2)
+    template_f=MAP_template_f[ifo]
 
     # We will need the PSD with the same frequency spacing as the data and template,
     # so we interpolate it to match:
@@ -271,7 +236,7 @@ The resulting Spectrogram shows how well the model captured the GW event, as it
 
 
 best_fit_template = gen_template(MAP_params)
-data = load_raw_data()
+data = load_analysis_raw_data()
 
 data_qspecgram = {}
 
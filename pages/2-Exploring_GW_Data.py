@@ -1,5 +1,5 @@
 import streamlit as st
-from gwosc.datasets import event_gps
+from tools.event_registry import event_gps
 from gwpy.time import from_gps
 from astropy.time import Time
 from tools.plotly_templates import *
@@ -38,15 +38,22 @@ st.markdown(blurb1)
 
 with st.expander("Importing GW190521 Data with gwosc", expanded=False, icon=None, width="stretch"):
 
-    with st.echo():
-        from gwosc.datasets import event_gps
-        from gwpy.time import from_gps
-
-        gps_time = event_gps('GW190521')
-        segment = ((gps)-16, (gps)+16)
-        st.write("Time of event:", gps_time, "(GPS Seconds)")
-        st.write("Time of event:",from_gps(gps_time))
-        st.write("The 32 second time period centered on the GW190521 event: ",segment)
+    # shown as code rather than st.echo, so the page uses the offline event registry instead of querying gwosc on every rerun
+    st.code("""
+    from gwosc.datasets import event_gps
+    from gwpy.time import from_gps
+
+    gps_time = event_gps('GW190521')
+    segment = ((gps)-16, (gps)+16)
+    st.write("Time of event:", gps_time, "(GPS Seconds)")
+    st.write("Time of event:",from_gps(gps_time))
+    st.write("The 32 second time period centered on the GW190521 event: ",segment)""")
+
+    gps_time = event_gps('GW190521')
+    segment = ((gps)-16, (gps)+16)
+    st.write("Time of event:", gps_time, "(GPS Seconds)")
+    st.write("Time of event:",from_gps(gps_time))
+    st.write("The 32 second time period centered on the GW190521 event: ",segment)
 
     st.divider()
 
@@ -1,6 +1,6 @@
 import streamlit as st
 import numpy as np
-from gwosc.datasets import event_gps
+from tools.event_registry import event_gps
 from astropy.time import Time
 from plotly_resampler import FigureResampler # type: ignore
 from tools.plotly_templates import *
@@ -57,12 +57,12 @@ low_bandpass, high_bandpass = st.slider("Select your bandpass frequency bounds:"
 slider_bandpass = {}
 slider_whiten = {}
 
-for ifo in ifos:
-    slider_bandpass[ifo] = pure_data[ifo].bandpass(low_bandpass, high_bandpass)
-    slider_whiten[ifo] = slider_bandpass[ifo].whiten(asd=np.sqrt(PSD_data[ifo]))
+# the engine applies the bandpass to cached spectra and only reconstructs the plotted ±0.2 s
+bandpass_engine = load_bandpass_engine()
 
-    slider_bandpass[ifo] = slider_bandpass[ifo].crop(gps-.2,gps+.2)
-    slider_whiten[ifo] = slider_whiten[ifo].crop(gps-.2,gps+.2)
+for ifo in ifos:
+    slider_bandpass[ifo] = bandpass_engine.view(ifo, low_bandpass, high_bandpass, gps-.2, gps+.2)
+    slider_whiten[ifo] = bandpass_engine.view(ifo, low_bandpass, high_bandpass, gps-.2, gps+.2, whiten=True)
 
 
 
@@ -1,5 +1,5 @@
 import streamlit as st
-from gwosc.datasets import event_gps
+from tools.event_registry import event_gps
 from astropy.time import Time
 from tools.plotly_templates import *
 from tools.data_caching import *
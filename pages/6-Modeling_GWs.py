@@ -1,5 +1,5 @@
 import streamlit as st
-from gwosc.datasets import event_gps
+from tools.event_registry import event_gps
 from pycbc.waveform import get_td_waveform
 from astropy.time import Time
 import plotly.graph_objects as go
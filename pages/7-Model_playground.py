@@ -1,6 +1,6 @@
 import streamlit as st
 import numpy as np
-from gwosc.datasets import event_gps
+from tools.event_registry import event_gps
 from astropy.time import Time
 from plotly_resampler import FigureResampler # type: ignore
 from datetime import timedelta
@@ -15,10 +15,11 @@ pure_data = load_pure_data()
 raw_data = load_raw_data()
 bandpass_data = load_bandpass_data()
 whitend_data = load_whitend_data()
-GW_data = load_GW_data()
+# the models are compared to data at the analysis sample rate, same time grid as gen_template()
+GW_data = load_analysis_GW_data()
 
 
-PSD_data = load_PSD_data()
+PSD_data = load_analysis_PSD_data()
 
 #code
 #gets the time of the event and prints it
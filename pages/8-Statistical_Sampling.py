@@ -1,5 +1,5 @@
 import streamlit as st
-from gwosc.datasets import event_gps
+from tools.event_registry import event_gps
 from astropy.time import Time
 from tools.plotly_templates import *
 from tools.data_caching import *
@@ -163,6 +163,8 @@ def loglikelihood(param, sf=sf, f_lower=10.0):
 """
 
 )
+    st.caption("The shipped version of this function is tools/likelihood.py: the data FFT, the PSD weights and df are computed once as plain arrays, "
+               "and the inner products of all detectors are one vectorized sum.")
     
 
 st.markdown(
@@ -309,6 +311,8 @@ with mp.Pool() as pool:
     nsteps = 100000              # total iterations
     sampler.run_mcmc(p0, nsteps, progress=True)
 """)
+    st.caption("tools/posterior.py ships these functions, with a logposterior_batch() that evaluates all walkers at once "
+               "for emcee.EnsembleSampler(..., vectorize=True) instead of one pool task per walker.")
 
 st.markdown(
 r"""
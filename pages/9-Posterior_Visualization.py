@@ -1,12 +1,17 @@
+import os
 import streamlit as st
 import numpy as np
-from gwosc.datasets import event_gps
+from tools.event_registry import event_gps
 from astropy.time import Time
 import plotly.express as px
 import plotly.graph_objects as go
 from tools.plotly_templates import *
 from tools.data_caching import *
 from tools.gen_template_function import *
+from tools.histograms import load_histogram_cube, load_histogram_pyramid, HistogramPyramid, bin_labels, HISTOGRAM_FILE, PYRAMID_FILE, CHAIN_FILE
+from tools.samples import load_posterior_samples, SAMPLES_FILE
+from tools.corner import load_corner_figure
+from tools.kde import pair_kde
 import pandas as pd
 
 st.set_page_config(page_title="Posterior_Visualization", page_icon="📈",layout="wide")
@@ -33,9 +38,41 @@ ifos = ['L1','H1']
 #burnin = 35426 
 # #thin = 2
 
-mcmc_df = pd.read_parquet("MCMC_data/mcmc_df_with_log_post.parquet")
-
-mcmc_df.rename(inplace=True,columns={"TimeShift":"Time Shift","RA":"Right Ascension","Dec":"Declination","Incl":"Inclination","Pol":"Polarization","lp":"Log Posterior","chain":"Chain","draw":"Draw"})
+# the artifacts below are built offline, or on first load from the chain if it is deployed
+def can_build():
+    return os.path.exists(SAMPLES_FILE) or os.path.exists(CHAIN_FILE)
+
+def require_artifact(path, command):
+    if not os.path.exists(path) and not can_build():
+        st.error(f"{path} is missing and there is no chain ({CHAIN_FILE}) to build it from. "
+                 f"Build it with `{command}` and commit it with the app.")
+        st.stop()
+
+# counts of every parameter pair of mcmc_df_with_log_post.parquet, built once by tools.histograms
+@st.cache_resource
+def load_histograms():
+    return load_histogram_cube()
+
+require_artifact(HISTOGRAM_FILE,"python -m tools.histograms")
+histograms = load_histograms()
+n_samples = int(histograms.marginals[0].sum())
+
+# memory-mapped chain, one reader shared by all sessions, only opened for full scans
+@st.cache_resource
+def load_samples():
+    return load_posterior_samples()
+
+# the same counts at up to 8 times finer bins, for zooming
+@st.cache_resource
+def load_pyramid():
+    if not os.path.exists(PYRAMID_FILE) and not can_build():
+        return HistogramPyramid(load_histograms(),1)   # no finer bins to zoom into, slice the 50 bins
+    return load_histogram_pyramid()
+
+# all pairs at once, laid out offline by tools.corner, or from the histogram cube on first load
+@st.cache_resource
+def load_corner():
+    return load_corner_figure()
 
 column_titles = np.array(["Mass","Ratio","Distance","Time Shift","Phase","Right Ascension","Declination","Inclination","Polarization"])
 options = column_titles
@@ -44,6 +81,7 @@ col1, col2 = st.columns([3,1],gap=None)
 
 with col2:
     st.header("Parameter Selection")
+    view = st.radio("View:",["Parameter pair","Corner plot"],horizontal=True,key="view_selector")
     top_column_picker = st.selectbox(
         "Select a parameter for the x axis:",
         options,
@@ -93,29 +131,45 @@ column_dec_value = {"Mass":0,"Ratio":2,"Distance":0,"Time Shift":5,"Phase":2,"Ri
 
 #def make_corner_plot(df = mcmc_df,top_column_picker = top_column_picker,right_column_picker=right_column_picker,columns_labels=columns_labels,column_dec_value=column_dec_value):
 
-x_data = np.array(mcmc_df[top_column_picker])
-y_data = np.array(mcmc_df[right_column_picker])
+x_column = list(column_titles).index(top_column_picker)
+y_column = list(column_titles).index(right_column_picker)
+
+
+def zoom_slider(column,title):
+    edges = histograms.edges[column]
+    low, high = float(edges[0]), float(edges[-1])
+    decimals = column_dec_value[title] + 1
+    return st.slider(title+" range", low, high, (low, high), step=float(edges[1]-edges[0])/8, format=f"%.{decimals}f", key=f"zoom_{column}")
 
-hist_data,xedges,yedges  = np.histogram2d(x_data,y_data,bins=[50,50])
+with col2:
+    st.subheader("Zoom")
+    x_range = zoom_slider(x_column,top_column_picker)
+    y_range = zoom_slider(y_column,right_column_picker)
+
+    st.subheader("Contours")
+    show_kde = st.checkbox("Show 50% and 90% credible regions",key="kde_selector")
+    kde_bandwidth = st.slider("Smoothing (times Scott's rule)",0.25,3.0,1.0,step=0.25,key="kde_bandwidth",disabled=not show_kde)
+
+zoomed = x_range != (histograms.edges[x_column][0], histograms.edges[x_column][-1]) or \
+         y_range != (histograms.edges[y_column][0], histograms.edges[y_column][-1])
+
+if zoomed:
+    hist_data,xedges,yedges,x_hist_data,y_hist_data = load_pyramid().region(x_column,y_column,x_range,y_range)
+else:
+    hist_data,xedges,yedges  = histograms.pair(x_column,y_column)
+    x_hist_data = histograms.marginal(x_column)[0]
+    y_hist_data = histograms.marginal(y_column)[0]
 hist_data = hist_data.T
 #hist_data = np.flip(hist_data,0)
 
-x_hist_data, trash = np.histogram(x_data,bins=list(xedges))
-y_hist_data, trash = np.histogram(y_data,bins=list(yedges))
-del trash
-
 
-x_bin_ticks = np.round(xedges,decimals=column_dec_value[top_column_picker])
-x_bin_ticks = x_bin_ticks.astype(str)
-for i in range(len(x_bin_ticks)-1):
-    x_bin_ticks[i] =  x_bin_ticks[i] + " - " + x_bin_ticks[i+1]
-x_bin_ticks = x_bin_ticks[0:-1]
+def axis_bin_labels(column,edges,title):
+    # one more decimal for every factor of ten the bins are finer than the full view
+    finer = (histograms.edges[column][1]-histograms.edges[column][0])/(edges[1]-edges[0])
+    return bin_labels(edges,column_dec_value[title]+int(np.ceil(np.log10(finer)-1e-9)))
 
-y_bin_ticks = np.round(yedges,decimals=column_dec_value[right_column_picker]) # type: ignore
-y_bin_ticks = y_bin_ticks.astype(str)
-for i in range(len(y_bin_ticks)-1):
-    y_bin_ticks[i] =  y_bin_ticks[i] + " - " + y_bin_ticks[i+1]
-y_bin_ticks = y_bin_ticks[0:-1]
+x_bin_ticks = axis_bin_labels(x_column,xedges,top_column_picker)
+y_bin_ticks = axis_bin_labels(y_column,yedges,right_column_picker)
 
 
 X_bin_var, Y_bin_var = np.meshgrid(x_bin_ticks,y_bin_ticks)
@@ -167,6 +221,24 @@ fig.add_trace(heatmap)
 fig.add_trace(x_hist)
 fig.add_trace(y_hist)
 
+if show_kde:
+    # binned FFT KDE of the whole chain, cached per pair and bandwidth, cut to the visible range
+    require_artifact(SAMPLES_FILE,"python -m tools.samples")
+    density, x_grid, y_grid, kde_levels = pair_kde(x_column,y_column,kde_bandwidth,samples=load_samples().path)
+    x_visible = (x_grid >= xedges[0]) & (x_grid <= xedges[-1])
+    y_visible = (y_grid >= yedges[0]) & (y_grid <= yedges[-1])
+    fig.add_trace(go.Contour(
+        x = x_grid[x_visible],
+        y = y_grid[y_visible],
+        z = density[np.ix_(x_visible,y_visible)].T,
+        contours=dict(coloring="none",start=kde_levels[1],end=kde_levels[0],size=kde_levels[0]-kde_levels[1]),
+        line=dict(color="white",width=2),
+        showscale=False,
+        hoverinfo="skip",
+        yaxis='y',
+        xaxis='x',
+    ))
+
 fig.update_layout(
     xaxis=dict(domain=[0, 0.85], 
             title=columns_labels[top_column_picker],
@@ -190,18 +262,31 @@ fig.update_layout(
 
 heatmap_help = """
 Click on the dropdowns on the side to choose two parameters.
+Narrow the zoom ranges on the side to see the region at a finer binning.
+Tick "Show 50% and 90% credible regions" to draw the smoothed highest density contours.
 Click and drag on the plot to zoom in.
 Double-click to reset axis to full graph.
 """
 
+corner_help = """
+Every pair of parameters, with the 1D distributions on the diagonal.
+White contours enclose the densest 68% and 95% (1σ and 2σ) of the samples.
+Click and drag on a panel to zoom in.
+Double-click to reset axis to full graph.
+"""
+
 with col1:
-    st.plotly_chart(fig,use_container_width=False)
-    st.caption("A 2D heatmap showing the relationship between parameter posterior distributions, colored by count.",help=heatmap_help)
+    if view == "Corner plot":
+        st.plotly_chart(load_corner(),use_container_width=True)
+        st.caption("A corner plot of all parameter posterior distributions, colored by count.",help=corner_help)
+    else:
+        st.plotly_chart(fig,use_container_width=False)
+        st.caption("A 2D heatmap showing the relationship between parameter posterior distributions, colored by count.",help=heatmap_help)
 
 
 st.markdown(
-r"""
-Above is the MCMC sample of 774,888 parameter combinations mentioned in the :blue-background[Statistical Sampling] tab.
+rf"""
+Above is the MCMC sample of {n_samples:,} parameter combinations mentioned in the :blue-background[Statistical Sampling] tab.
 
 Two parameters are plotted at at time, one on the x-axis and one on the y-axis.
 
@@ -0,0 +1,77 @@
+"""
+Behaviour checks of tools.diagnostics against emcee and full-chain computations.
+
+Run from the repository root with python -m pytest tests.
+"""
+import numpy as np
+import pytest
+
+emcee = pytest.importorskip("emcee")
+
+from tools.diagnostics import StreamingDiagnostics
+
+#--------------------------------------------
+def ar1_chain(nsteps, nwalkers, ndim, rho=.9, seed=0):
+    """Independent AR(1) walkers, integrated autocorrelation time (1 + rho)/(1 - rho)."""
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(size=(nsteps, nwalkers, ndim))
+    chain = np.empty_like(noise)
+    chain[0] = noise[0]
+    for t in range(1, nsteps):
+        chain[t] = rho * chain[t - 1] + np.sqrt(1 - rho**2) * noise[t]
+    return chain + np.arange(ndim) * 10.
+#--------------------------------------------
+
+#--------------------------------------------
+def full_split_rhat(chain):
+    """Split R-hat of the second half of a chain, computed on all samples at once."""
+    second = chain[len(chain) // 2:]
+    n = len(second) // 2
+    parts = np.concatenate([second[:n], second[n:2 * n]], axis=1)   # (n, 2 * nwalkers, ndim)
+    within = parts.var(axis=0, ddof=1).mean(axis=0)
+    between = n * parts.mean(axis=0).var(axis=0, ddof=1)
+    return np.sqrt(((n - 1) / n * within + between / n) / within)
+#--------------------------------------------
+
+#--------------------------------------------
+def feed(diagnostics, chain, step=100):
+    for start in range(0, len(chain), step):
+        diagnostics.update(chain[start:start + step])
+    return diagnostics
+#--------------------------------------------
+
+#--------------------------------------------
+def test_autocorr_time_matches_emcee_without_batching():
+    chain = ar1_chain(3000, 8, 2)
+    diagnostics = feed(StreamingDiagnostics(8, 2, max_length=4096), chain)
+    expected = emcee.autocorr.integrated_time(chain, c=5, tol=0)
+    np.testing.assert_allclose(diagnostics.summary()["tau"], expected, rtol=1e-10)
+#--------------------------------------------
+
+#--------------------------------------------
+def test_autocorr_time_with_batch_means():
+    chain = ar1_chain(20000, 8, 2)
+    diagnostics = feed(StreamingDiagnostics(8, 2, max_length=512), chain)
+    assert diagnostics._batch > 1
+    expected = emcee.autocorr.integrated_time(chain, c=5, tol=0)
+    np.testing.assert_allclose(diagnostics.summary()["tau"], expected, rtol=.15)
+#--------------------------------------------
+
+#--------------------------------------------
+@pytest.mark.parametrize("max_updates", [256, 8])
+def test_split_rhat_matches_full_chain(max_updates):
+    chain = ar1_chain(6400, 6, 3)
+    chain[:, 0] += 3.   # one walker offset, so R-hat is well above 1
+    diagnostics = feed(StreamingDiagnostics(6, 3, max_updates=max_updates), chain)
+    np.testing.assert_allclose(diagnostics.split_rhat(), full_split_rhat(chain), rtol=1e-8)
+    assert diagnostics._kept <= diagnostics.max_updates
+#--------------------------------------------
+
+#--------------------------------------------
+def test_state_round_trip():
+    chain = ar1_chain(3000, 4, 2)
+    whole = feed(StreamingDiagnostics(4, 2, max_length=64, max_updates=8), chain)
+    first = feed(StreamingDiagnostics(4, 2, max_length=64, max_updates=8), chain[:1500])
+    resumed = feed(StreamingDiagnostics.from_state(first.state()), chain[1500:])
+    assert resumed.summary() == whole.summary()
+#--------------------------------------------
@@ -0,0 +1,39 @@
+"""
+Behaviour checks of the binned FFT kernel density estimate of tools.kde.
+
+Run from the repository root with python -m pytest tests.
+"""
+import numpy as np
+import pytest
+
+stats = pytest.importorskip("scipy.stats")
+
+from tools.kde import fft_kde
+
+#--------------------------------------------
+# linear binning is accurate to about (grid step / kernel width)^2, 0.14 and 0.28 of the widths here
+@pytest.mark.parametrize("bandwidth, tolerance", [(1., 1e-3), (.5, 4e-3)])
+def test_fft_kde_matches_gaussian_kde(bandwidth, tolerance):
+    rng = np.random.default_rng(0)
+    x, y = rng.normal(size=(2, 2000))
+    y -= x * np.dot(x - x.mean(), y) / np.dot(x - x.mean(), x)   # no sample correlation, so both kernels are axis aligned
+    x, y = 3. + 2. * x, -1. + .5 * y / y.std()
+    xlim, ylim = (3. - 10., 3. + 10.), (-1. - 2.5, -1. + 2.5)   # five standard deviations
+    density, xgrid, ygrid = fft_kde(x, y, bandwidth=bandwidth, grid=256, xlim=xlim, ylim=ylim)
+
+    # the same kernel as fft_kde, whose widths use the population standard deviation
+    factor = bandwidth * len(x)**(-1 / 6) * np.sqrt((len(x) - 1) / len(x))
+    kde = stats.gaussian_kde(np.stack([x, y]), bw_method=factor)
+    kde.set_bandwidth(bw_method=factor)
+    X, Y = np.meshgrid(xgrid, ygrid, indexing="ij")
+    expected = kde(np.stack([X.ravel(), Y.ravel()])).reshape(X.shape)
+    np.testing.assert_allclose(density, expected, atol=tolerance * expected.max())
+#--------------------------------------------
+
+#--------------------------------------------
+def test_fft_kde_integrates_to_one():
+    rng = np.random.default_rng(1)
+    x, y = rng.normal(size=5000), rng.normal(size=5000)
+    density, xgrid, ygrid = fft_kde(x, y, grid=128, xlim=(-6., 6.), ylim=(-6., 6.))
+    assert density.sum() * (xgrid[1] - xgrid[0]) * (ygrid[1] - ygrid[0]) == pytest.approx(1., rel=1e-3)
+#--------------------------------------------
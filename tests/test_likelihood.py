@@ -0,0 +1,146 @@
+"""
+Behaviour checks of tools.likelihood against the reference implementations.
+
+Run from the repository root with python -m pytest tests.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("pycbc")
+gwpy_timeseries = pytest.importorskip("gwpy.timeseries")
+from gwpy.frequencyseries import FrequencySeries
+
+from tools.gen_template_function import gen_template, default_time_grid
+from tools.likelihood import FrequencyDomainLikelihood, MarginalizedLikelihood
+
+PARAMS = [150., .8, 3000., .03, 1., 2.2, -1.2, .5, .1]
+IFOS = ('L1', 'H1')
+
+#--------------------------------------------
+def page_loglikelihood(param, sf, psd, f_lower=10.):
+    """The Statistical Sampling page's loglikelihood(), on gwpy series."""
+    template = gen_template(param, f_lower=f_lower)
+    logl = 0.
+    for ifo in IFOS:
+        sf_hp = sf[ifo].crop(start=f_lower)
+        psd_hp = psd[ifo].crop(start=f_lower)
+        hf = template[ifo].average_fft(window=('tukey', 1./4.)) * template[ifo].duration.value / 2
+        hf_hp = hf.crop(start=f_lower)
+        h_dot_h = 4 * np.real((hf_hp * hf_hp.conjugate() / psd_hp).sum() * hf_hp.df)
+        h_dot_s = 4 * np.real((sf_hp * hf_hp.conjugate() / psd_hp).sum() * sf_hp.df)
+        logl += (h_dot_s - h_dot_h / 2).value
+    return logl
+#--------------------------------------------
+
+#--------------------------------------------
+@pytest.fixture(scope="module")
+def synthetic_data():
+    """A signal at PARAMS in coloured Gaussian noise, on the default template time grid."""
+    grid = default_time_grid()
+    signal = gen_template(PARAMS)
+    rng = np.random.default_rng(1)
+    sf, psd = {}, {}
+    for ifo in IFOS:
+        data = signal[ifo] + rng.normal(scale=2e-22, size=len(signal[ifo])) * signal[ifo].unit
+        sf[ifo] = data.average_fft(window=('tukey', 1./4.)) * data.duration.value / 2
+        f = np.maximum(sf[ifo].frequencies.value, 1.)
+        psd[ifo] = FrequencySeries(1e-46 * (1 + (40. / f)**4), f0=0, df=sf[ifo].df.value)
+    time_grid = {"delta_t": grid["delta_t"], "duration": grid["duration"], "start_time": grid["start_time"]}
+    return sf, psd, time_grid
+#--------------------------------------------
+
+#--------------------------------------------
+def test_frequency_domain_likelihood_matches_page(synthetic_data):
+    sf, psd, time_grid = synthetic_data
+    likelihood = FrequencyDomainLikelihood(sf, psd, time_grid, ifos=IFOS)
+    for param in (PARAMS, [140., .7, 2500., .031, 2., 2.0, -1.0, .8, .3]):
+        expected = page_loglikelihood(param, sf, psd)
+        assert likelihood(param) == pytest.approx(expected, rel=1e-3, abs=1e-2)
+#--------------------------------------------
+
+#--------------------------------------------
+def test_batched_templates_match_single(synthetic_data):
+    sf, psd, time_grid = synthetic_data
+    likelihood = FrequencyDomainLikelihood(sf, psd, time_grid, ifos=IFOS)
+    params = np.array([PARAMS, [140., .7, 2500., .031, 2., 2.0, -1.0, .8, .3]])
+    batch = likelihood.loglikelihood_from_templates(likelihood.templates(params, mode="serial"))
+    np.testing.assert_allclose(batch, [likelihood(p) for p in params], rtol=1e-6)
+#--------------------------------------------
+
+#--------------------------------------------
+@pytest.fixture(scope="module")
+def toy_likelihood():
+    """
+    A FrequencyDomainLikelihood of a chirp-like reference template h0 on
+    white noise, with h0 at phase 0, the reference distance and the first
+    time, and the data h0 at 1000 Mpc, phase .7 and a shift of 21 ms.
+    """
+    df, n_freq, f_lower = .25, 1025, 20.
+    f = df * np.arange(n_freq)
+    f_safe = np.maximum(f, 1.)
+    amplitude = np.where(f >= f_lower, f_safe**(-7. / 6.) * np.exp(-(f / 150.)**2), 0.)
+    h0 = np.stack([amplitude * np.exp(1j * (300. * (f_safe / 100.)**(-2. / 3.) + shift)) for shift in (0., 1.)])
+    h0 *= 1.5 / np.sqrt(np.sum(np.abs(h0)**2 * 4 * df))     # optimal SNR 1.5 at D_ref
+
+    rng = np.random.default_rng(2)
+    signal = h0 * 10. * np.exp(2j * .7) * np.exp(-2j * np.pi * f * .021)
+    noise = (rng.normal(size=h0.shape) + 1j * rng.normal(size=h0.shape)) / np.sqrt(8 * df)
+    data = signal + noise
+    sf = {ifo: FrequencySeries(data[d], f0=0, df=df) for d, ifo in enumerate(IFOS)}
+    psd = {ifo: FrequencySeries(np.ones(n_freq), f0=0, df=df) for ifo in IFOS}
+    likelihood = FrequencyDomainLikelihood(sf, psd, {}, ifos=IFOS, f_lower=f_lower)
+    return likelihood, h0
+#--------------------------------------------
+
+#--------------------------------------------
+def brute_force_marginal(likelihood, h0, times, distance_bounds, marginalize):
+    """
+    Marginal log likelihood by direct sums: every shift of the time grid
+    applied as exp(-2i pi f dt), a uniform phase grid, and the trapezoid rule 
+    over the D^2 prior.
+    """
+    from scipy.special import logsumexp
+    f = likelihood.frequencies
+    reference = distance_bounds[1]
+    h = h0[:, likelihood.kmin:]
+    hh = np.sum(np.abs(h)**2 * likelihood.weights)
+    shifts = times - times[0] if "time" in marginalize else np.zeros(1)
+    z = np.array([np.sum(likelihood.weighted_data * np.conj(h * np.exp(-2j * np.pi * f * dt))) for dt in shifts])
+
+    phases = np.linspace(0., 2 * np.pi, 512, endpoint=False) if "phase" in marginalize else np.zeros(1)
+    if "distance" in marginalize:
+        distances = np.geomspace(*distance_bounds, 5000)
+        log_prior = np.log(3 * distances**2 / (distance_bounds[1]**3 - distance_bounds[0]**3))
+    else:
+        distances, log_prior = np.array([reference]), np.zeros(1)
+    u = reference / distances
+
+    per_time = []
+    for z_t in z:
+        logl = np.real(z_t * np.exp(-2j * phases))[:, None] * u - hh * u**2 / 2 + log_prior    # (n_phases, n_distances)
+        if "distance" in marginalize:
+            peak = logl.max()
+            logl = np.log(np.trapz(np.exp(logl - peak), distances, axis=-1)) + peak
+        per_time.append(logsumexp(logl) - np.log(len(phases)))
+    return logsumexp(per_time) - np.log(len(per_time))
+#--------------------------------------------
+
+#--------------------------------------------
+@pytest.mark.parametrize("marginalize", [("time",), ("phase", "time"), ("phase", "distance"), ("phase", "distance", "time")])
+def test_marginalized_likelihood_matches_quadrature(toy_likelihood, marginalize):
+    likelihood, h0 = toy_likelihood
+    marginal = MarginalizedLikelihood(likelihood, marginalize=marginalize, distance_bounds=(100., 10000.))
+    times = marginal.times if marginal.time else np.array(marginal.time_bounds[:1])
+    expected = brute_force_marginal(likelihood, h0, times, marginal.distance_bounds, marginalize)
+    exact = 1e-8 if "distance" not in marginalize else 1e-4
+    assert float(marginal.loglikelihood_from_templates(h0[None])[0]) == pytest.approx(expected, abs=exact)
+#--------------------------------------------
+
+#--------------------------------------------
+def test_time_marginal_peaks_at_the_injected_shift(toy_likelihood):
+    likelihood, h0 = toy_likelihood
+    marginal = MarginalizedLikelihood(likelihood, marginalize=("phase", "time"), time_mode="maximize")
+    hh, z = marginal._statistics(h0[None])
+    logl = marginal._loglikelihood_per_time(hh, z)[0]
+    assert marginal.times[np.argmax(logl)] == pytest.approx(.021, abs=marginal.time_step)
+#--------------------------------------------
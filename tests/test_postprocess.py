@@ -0,0 +1,44 @@
+"""
+Behaviour checks of the streaming summaries of tools.postprocess.
+
+Run from the repository root with python -m pytest tests.
+"""
+import numpy as np
+import pytest
+
+from tools.postprocess import QuantileSketch
+
+QUANTILES = [0., .01, .05, .16, .5, .84, .95, .99, 1.]
+
+#--------------------------------------------
+@pytest.mark.parametrize("n_bins", [2**10, 2**14])
+def test_quantiles_within_a_bin_of_numpy(n_bins):
+    values = np.random.default_rng(0).standard_t(5, size=200_000)
+    sketch = QuantileSketch(n_bins)
+    for chunk in np.array_split(values, 40):
+        sketch.update(chunk)
+    bound = 2 * np.ptp(values) / n_bins
+    np.testing.assert_allclose(sketch.quantile(QUANTILES), np.quantile(values, QUANTILES), atol=bound)
+#--------------------------------------------
+
+#--------------------------------------------
+def test_quantiles_after_the_range_grows():
+    rng = np.random.default_rng(1)
+    # a narrow first chunk, then wider ones on both sides, so the range doubles several times each way
+    chunks = [rng.normal(0., 1e-3, 1000), rng.normal(5., 1., 50_000), rng.normal(-20., 3., 50_000), [1e3, np.nan, np.inf]]
+    sketch = QuantileSketch(2**12)
+    for chunk in chunks:
+        sketch.update(chunk)
+    values = np.concatenate(chunks[:-1] + [[1e3]])
+    assert sketch.total == len(values)
+    assert sketch.counts.sum() == len(values)
+    np.testing.assert_allclose(sketch.quantile(QUANTILES), np.quantile(values, QUANTILES), atol=sketch.width)
+    assert sketch.width <= 2 * np.ptp(values) / sketch.n_bins
+#--------------------------------------------
+
+#--------------------------------------------
+def test_empty_sketch_returns_nan():
+    sketch = QuantileSketch()
+    sketch.update([np.nan])
+    assert np.isnan(sketch.quantile([.5])).all()
+#--------------------------------------------
@@ -0,0 +1,132 @@
+"""
+Corner plot of the posterior samples: every parameter pair with its 1 and 2 sigma contours.
+
+The counts come from the histogram cube of tools.histograms (every column
+digitized once with np.searchsorted, every pair filled with one np.bincount,
+the pairs counted in parallel), the contours are the highest density levels
+holding 68.3% and 95.4% of the samples. The 9x9 figure takes seconds to lay
+out, so it is built once and stored as plotly JSON,
+
+    MCMC_data/posterior_corner.json
+
+which the Posterior Visualization page reads as is:
+
+    python -m tools.corner [--output MCMC_data/posterior_corner.json]
+"""
+import argparse
+import functools
+import os
+
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.subplots import make_subplots
+
+from tools.histograms import HISTOGRAM_FILE, CHAIN_FILE, HistogramCube, credible_levels, load_histogram_cube
+from tools.postprocess import RESULTS_FORMAT
+
+CORNER_FILE = "MCMC_data/posterior_corner.json"
+CORNER_TITLES = [title for _, title, *_ in RESULTS_FORMAT]   # display name of every parameter, in the order of the cube
+
+#--------------------------------------------
+def corner_figure(cube: HistogramCube, titles=CORNER_TITLES, size: int = 1000)-> go.Figure:
+    """
+    Lay out the corner plot of a histogram cube.
+
+    Parameters
+    ----------
+    cube : HistogramCube
+        Counts of every parameter pair.
+    titles : list, optional
+        Axis title of every parameter (default: the Results page names).
+    size : int, optional
+        Width and height of the figure in pixels (default: 1000).
+
+    Returns
+    -------
+    plotly.graph_objects.Figure
+        Marginal histograms on the diagonal, the heatmap and 1 and 2 sigma
+        contours of every pair below it.
+    """
+    n = len(cube.names)
+    centers = 0.5 * (cube.edges[:, :-1] + cube.edges[:, 1:])
+    fig = make_subplots(rows=n, cols=n, horizontal_spacing=.008, vertical_spacing=.008)
+
+    for row in range(n):
+        for col in range(row + 1):
+            if row == col:
+                fig.add_trace(go.Bar(
+                    x=centers[col],
+                    y=cube.marginals[col],
+                    marker_color=px.colors.sequential.Purples[-1],
+                    hovertemplate='<b>'+titles[col]+'</b>: %{x}<br><b>Count</b>: %{y}<extra></extra>',
+                    showlegend=False,
+                ), row=row + 1, col=col + 1)
+                continue
+
+            counts = cube.pair(col, row)[0].T     # y along the rows of the heatmap
+            one, two = credible_levels(counts)
+            fig.add_trace(go.Heatmap(
+                x=centers[col],
+                y=centers[row],
+                z=counts,
+                colorscale=px.colors.sequential.Viridis,
+                zmin=0,
+                showscale=False,
+                hovertemplate='<b>'+titles[col]+'</b>: %{x}<br><b>'+titles[row]+'</b>: %{y}<br><b>Count</b>: %{z}<extra></extra>',
+            ), row=row + 1, col=col + 1)
+            fig.add_trace(go.Contour(
+                x=centers[col],
+                y=centers[row],
+                z=counts,
+                contours=dict(coloring="none", start=two, end=one, size=max(one - two, 1)),
+                line=dict(color="white", width=1),
+                showscale=False,
+                hoverinfo="skip",
+            ), row=row + 1, col=col + 1)
+
+    for row in range(n):
+        for col in range(n):
+            visible = col <= row
+            fig.update_xaxes(row=row + 1, col=col + 1, visible=visible, range=[cube.edges[col][0], cube.edges[col][-1]],
+                             showticklabels=row == n - 1, title=titles[col] if row == n - 1 else None)
+            fig.update_yaxes(row=row + 1, col=col + 1, visible=visible, showticklabels=col == 0 and row > 0,
+                             title=titles[row] if col == 0 and row > 0 else None,
+                             range=None if row == col else [cube.edges[row][0], cube.edges[row][-1]])
+
+    fig.update_layout(
+        width=size,
+        height=size,
+        bargap=0.05,
+        hovermode='closest',
+        margin=dict(l=60, r=20, t=40, b=60),
+    )
+    return fig
+#--------------------------------------------
+
+#--------------------------------------------
+@functools.lru_cache(maxsize=None)
+def load_corner_figure(path: str = CORNER_FILE, histograms: str = HISTOGRAM_FILE, chain: str = CHAIN_FILE)-> go.Figure:
+    """Read the corner plot once per process, laying it out from the histogram cube and writing it if it is missing."""
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        corner_figure(load_histogram_cube(histograms, chain)).write_json(path)
+    return pio.read_json(path)
+#--------------------------------------------
+
+#--------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--histograms", default=HISTOGRAM_FILE, help="histogram cube of tools.histograms")
+    parser.add_argument("--chain", default=CHAIN_FILE, help="parquet chain, to build a missing histogram cube")
+    parser.add_argument("--size", type=int, default=1000, help="width and height in pixels")
+    parser.add_argument("--output", default=CORNER_FILE)
+    args = parser.parse_args()
+
+    corner_figure(load_histogram_cube(args.histograms, args.chain), size=args.size).write_json(args.output)
+    print(f"written {args.output} ({os.path.getsize(args.output) / 1024:.0f} kB)")
+#--------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,294 @@
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
 import streamlit as st
 import numpy as np
 from gwpy.timeseries import TimeSeries
+from gwpy.frequencyseries import FrequencySeries
+from tools.parallel import parallel_map, PARALLEL_MODE
+from tools.fd_filtering import FrequencyBandpassEngine
+from tools.event_registry import event_gps, event_data_files
+
+EVENT_NAME = "GW190521"
+DATA_FILES = event_data_files(EVENT_NAME)
+
+# Every parameter that shapes the derived products. Changing any of these (or the 
+# data files above) changes the product cache key, so stale products are never used.
+PROCESSING_PARAMS = {
+    "bandpass": [25., 90.],        # Hz
+    "fftlength": 4.,               # seconds, Welch segment length
+    "overlap": 2.,                 # seconds, Welch segment overlap
+    "window": ["tukey", 1./4.],    # Welch window
+    "crop": 2.,                    # seconds either side of the event
+    "analysis_rate": float(os.environ.get("GW_ANALYSIS_SAMPLE_RATE", 1024.)),  # Hz, see below
+}
+
+# Sample rate of the analysis products (load_analysis_*() and gen_template()). 
+# The science band is 25-90 Hz, so anything above ~4x the upper band edge only 
+# costs memory, FFT time and plot payload. The native rate is 4096 Hz.
+ANALYSIS_SAMPLE_RATE = PROCESSING_PARAMS["analysis_rate"]
+
+EVENT_GPS = event_gps(EVENT_NAME)
+EVENT_WINDOW = (EVENT_GPS - PROCESSING_PARAMS["crop"], EVENT_GPS + PROCESSING_PARAMS["crop"])
+
+PRODUCT_CACHE_DIR = os.environ.get("GW_PRODUCT_CACHE_DIR", ".product_cache")
+PRODUCT_CACHE_VERSION = 1
 
 #--------------------------------------------
-@st.cache_data
+def shared_store(builder):
+    """
+    Turn a product builder into a loader backed by one shared, read-only store.
+
+    The builder runs once per server process and its dictionary of series is 
+    kept by st.cache_resource, so every session and every rerun is handed the 
+    same underlying buffers instead of an unpickled copy (which is what 
+    st.cache_data did on every call).
+
+    Parameters
+    ----------
+    builder : callable
+        Function with no arguments returning a dictionary of gwpy series.
+
+    Returns
+    -------
+    callable
+        Loader returning a fresh dictionary of read-only views of the shared 
+        series. Re-assigning keys of that dictionary (e.g. replacing 
+        data[ifo] with a cropped view) and setting the metadata of a view 
+        (.name, .t0, .unit, ...) are private to the caller. Writing into 
+        the data or the index arrays raises a ValueError; take a .copy() 
+        of a series to modify it.
+    """
+    store = st.cache_resource(show_spinner=False)(builder)
+
+    @functools.wraps(builder)
+    def loader() -> dict:
+        views = {}
+        for ifo, series in store().items():
+            series.flags.writeable = False
+            series.xindex.flags.writeable = False   # in case a view shares the index
+            views[ifo] = series.view()   # shares the buffer, not the metadata
+        return views
+
+    loader.clear = store.clear # type: ignore
+    return loader
+#--------------------------------------------
+
+#--------------------------------------------
+@functools.lru_cache(maxsize=None)
+def product_cache_key()-> str:
+    """
+    Return the content hash that identifies the current set of derived products.
+
+    The hash covers the bytes of every file in DATA_FILES, PROCESSING_PARAMS, the 
+    event time and PRODUCT_CACHE_VERSION, so the on-disk products are rebuilt exactly when the 
+    inputs or the processing parameters change.
+    """
+    digest = hashlib.sha256()
+    digest.update(str(PRODUCT_CACHE_VERSION).encode())
+    digest.update(json.dumps(PROCESSING_PARAMS, sort_keys=True).encode())
+    digest.update(repr(EVENT_GPS).encode())
+    for ifo in sorted(DATA_FILES):
+        with open(DATA_FILES[ifo], "rb") as f:
+            digest.update(ifo.encode())
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()[:16]
+#--------------------------------------------
+
+#--------------------------------------------
+def _save_product(path: str, data: dict):
+    """Write a dictionary of gwpy series to a product directory (one .npy per detector)."""
+    meta = {}
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=parent)
+    for ifo, series in data.items():
+        np.save(os.path.join(staging, f"{ifo}.npy"), np.asarray(series.value))
+        meta[ifo] = {"kind": "frequency" if isinstance(series, FrequencySeries) else "time",
+                     "x0": float(series.x0.value),
+                     "dx": float(series.dx.value),
+                     "unit": str(series.unit),
+                     "name": None if series.name is None else str(series.name),
+                     "channel": None if series.channel is None else str(series.channel)}
+    with open(os.path.join(staging, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    try:
+        os.rename(staging, path) # atomic, so a half written product is never read
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True) # another process won the race
+#--------------------------------------------
+
+#--------------------------------------------
+def _read_product(path: str)-> dict:
+    """Read a product directory written by _save_product() as memory-mapped gwpy series."""
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    data = {}
+    for ifo, info in meta.items():
+        values = np.load(os.path.join(path, f"{ifo}.npy"), mmap_mode="r")
+        if info["kind"] == "frequency":
+            data[ifo] = FrequencySeries(values, f0=info["x0"], df=info["dx"], unit=info["unit"],
+                                        name=info["name"], channel=info["channel"])
+        else:
+            data[ifo] = TimeSeries(values, t0=info["x0"], dt=info["dx"], unit=info["unit"],
+                                   name=info["name"], channel=info["channel"])
+    return data
+#--------------------------------------------
+
+#--------------------------------------------
+def persistent_product(builder):
+    """
+    Persist the output of a product builder in the on-disk product cache.
+
+    On a cold start the product is read (memory-mapped) from 
+    PRODUCT_CACHE_DIR/<builder name>-<product_cache_key()> instead of being 
+    recomputed. If it is missing it is built and written there, and products 
+    built from older inputs or parameters are removed. A read-only or full 
+    disk only costs the speed-up, the freshly built product is still returned.
+    """
+    @functools.wraps(builder)
+    def wrapper() -> dict:
+        path = os.path.join(PRODUCT_CACHE_DIR, f"{builder.__name__}-{product_cache_key()}")
+        if os.path.isdir(path):
+            try:
+                return _read_product(path)
+            except (OSError, ValueError, KeyError):
+                shutil.rmtree(path, ignore_errors=True)
+
+        data = builder()
+        try:
+            _save_product(path, data)
+            for entry in os.listdir(PRODUCT_CACHE_DIR):
+                if entry.startswith(f"{builder.__name__}-") and entry != os.path.basename(path):
+                    shutil.rmtree(os.path.join(PRODUCT_CACHE_DIR, entry), ignore_errors=True)
+        except OSError:
+            pass
+        return data
+
+    return wrapper
+#--------------------------------------------
+
+#--------------------------------------------
+# Processing pipeline
+#
+# Every product is a node of a small DAG of memoized stages, so an intermediate 
+# is computed once per configuration and shared by every loader that needs it:
+#
+#   read -> [resample(rate)] -> bandpass(band) -> whiten(band) -> crop(band, whiten, window)
+#                  |                                ^
+#                  +-> psd (Welch) -> asd ----------+
+#
+# Each node is keyed on its own parameters only (e.g. the 25-90 Hz bandpass 
+# node is the same object for load_bandpass_data() and load_GW_data()). The 
+# rate is None for the native sample rate, every stage after the resample 
+# then runs at the lower rate.
+#--------------------------------------------
+
+# The stages are memoized in this process, so the loaders run the detectors on
+# threads even with GW_PARALLEL_MODE=process: a worker process would start from
+# empty memos, recompute the upstream stages and keep its results to itself.
+PIPELINE_MODE = "serial" if PARALLEL_MODE == "serial" else "thread"
+
+#--------------------------------------------
+def pipeline_stage(stage):
+    """Register a stage of the processing DAG as a memoized, read-only node."""
+    @functools.lru_cache(maxsize=32)
+    @functools.wraps(stage)
+    def node(*args):
+        product = stage(*args)
+        product.flags.writeable = False
+        return product
+
+    return node
+#--------------------------------------------
+
+#--------------------------------------------
+@pipeline_stage
+def _read_stage(ifo: str, rate: float | None)-> TimeSeries:
+    if rate is None:
+        return TimeSeries.read(DATA_FILES[ifo])
+    return _read_stage(ifo, None).resample(rate) # anti-aliased FIR decimation
+
+@pipeline_stage
+def _bandpass_stage(ifo: str, band: tuple, rate: float | None)-> TimeSeries:
+    return _read_stage(ifo, rate).bandpass(*band)
+
+@pipeline_stage
+def _psd_stage(ifo: str, rate: float | None)-> FrequencySeries:
+    return _read_stage(ifo, rate).psd(fftlength=PROCESSING_PARAMS["fftlength"],window=tuple(PROCESSING_PARAMS["window"]),method='welch',overlap=PROCESSING_PARAMS["overlap"]) # type: ignore
+
+@pipeline_stage
+def _asd_stage(ifo: str, rate: float | None)-> FrequencySeries:
+    return np.sqrt(_psd_stage(ifo, rate))
+
+@pipeline_stage
+def _whiten_stage(ifo: str, band: tuple | None, rate: float | None)-> TimeSeries:
+    source = _read_stage(ifo, rate) if band is None else _bandpass_stage(ifo, band, rate)
+    return source.whiten(asd=_asd_stage(ifo, rate))
+
+@pipeline_stage
+def _crop_stage(ifo: str, band: tuple | None, whiten: bool, crop: tuple, rate: float | None)-> TimeSeries:
+    return get_product(ifo, band=band, whiten=whiten, rate=rate).crop(*crop)
+#--------------------------------------------
+
+#--------------------------------------------
+def get_product(ifo: str, band=None, whiten: bool = False, crop=None, rate=None)-> TimeSeries:
+    """
+    Return a processed strain TimeSeries from the shared processing pipeline.
+
+    Parameters
+    ----------
+    ifo : str
+        Interferometer key ('L1', 'V1' or 'H1').
+    band : tuple of float, optional
+        (low, high) bandpass frequencies in Hz (default: no bandpass).
+    whiten : bool, optional
+        Whiten with the detector ASD after the bandpass (default: False).
+    crop : tuple of float, optional
+        (start, end) GPS times to crop to (default: the full 32 seconds).
+    rate : float, optional
+        Sample rate in Hz to resample to before any other processing, e.g. 
+        ANALYSIS_SAMPLE_RATE (default: the native sample rate).
+
+    Returns
+    -------
+    TimeSeries
+        Read-only TimeSeries shared with every other caller asking for the same 
+        configuration. Use .copy() before modifying it.
+    """
+    band = None if band is None else (float(band[0]), float(band[1]))
+    rate = None if rate is None else float(rate)
+    if crop is not None:
+        return _crop_stage(ifo, band, bool(whiten), (float(crop[0]), float(crop[1])), rate)
+    if whiten:
+        return _whiten_stage(ifo, band, rate)
+    if band is not None:
+        return _bandpass_stage(ifo, band, rate)
+    return _read_stage(ifo, rate)
+#--------------------------------------------
+
+#--------------------------------------------
+def get_spectrum(ifo: str, kind: str = "psd", rate=None)-> FrequencySeries:
+    """
+    Return the Welch PSD (kind='psd') or ASD (kind='asd') of a detector's 32 s of data.
+
+    The ASD is the square root of the shared PSD node, so the Welch estimate 
+    is only computed once per detector. With a rate (Hz) the spectrum is 
+    estimated from the resampled data and ends at its Nyquist frequency.
+    """
+    rate = None if rate is None else float(rate)
+    if kind == "psd":
+        return _psd_stage(ifo, rate)
+    if kind == "asd":
+        return _asd_stage(ifo, rate)
+    raise ValueError(f"Unknown spectrum kind {kind!r}, expected 'psd' or 'asd'")
+#--------------------------------------------
+
+#--------------------------------------------
+@shared_store
 def load_pure_data()-> dict:
     """
     Load unprocessed TimeSeries strain data for gravitational wave interferometers.
@@ -23,18 +308,16 @@ def load_pure_data()-> dict:
     This function loads data from GW190521 event files located in the 
     'GW190521_data/' directory. Each file contains 32 seconds of strain data.
     """
-    pure_data = {}
     ifos = ['L1', 'V1', 'H1']
 
-    for ifo in ifos:
-        filename = f"GW190521_data/{ifo}_data_32s.hdf5"
-        pure_data[ifo] = TimeSeries.read(filename)
+    # the detectors are independent, so they are processed concurrently (see tools.parallel)
+    pure_data = dict(zip(ifos, parallel_map(get_product, ifos, mode=PIPELINE_MODE)))
 
     return pure_data
 #--------------------------------------------
 
 #--------------------------------------------
-@st.cache_data
+@shared_store
 def load_raw_data()-> dict:
     """
     Load cropped TimeSeries strain data around the GW190521 gravitational wave event.
@@ -58,19 +341,16 @@ def load_raw_data()-> dict:
     data is obtained by calling load_pure_data() and then cropping each 
     interferometer's data to the 4-second window of interest.
     """
-    raw_data = {}
     ifos = ['L1', 'V1', 'H1']
-    pure_data = load_pure_data()
-    gps =1242442967.4 #gps time of GW190521 event
 
-    for ifo in ifos:
-        raw_data[ifo] = pure_data[ifo].crop(gps-2,gps+2)
+    raw_data = dict(zip(ifos, parallel_map(functools.partial(get_product, crop=EVENT_WINDOW), ifos, mode=PIPELINE_MODE)))
 
     return raw_data
 #--------------------------------------------
 
 #--------------------------------------------
-@st.cache_data
+@shared_store
+@persistent_product
 def load_bandpass_data()-> dict: 
     """
     Load bandpass-filtered TimeSeries strain data for gravitational wave interferometers.
@@ -92,18 +372,16 @@ def load_bandpass_data()-> dict:
     This function applies a bandpass filter with a frequency range of 25-90 Hz 
     to the unprocessed data obtained from load_pure_data().
     """
-    bandpass_data = {}
     ifos = ['L1', 'V1', 'H1']
-    pure_data = load_pure_data()
 
-    for ifo in ifos:
-        bandpass_data[ifo] = pure_data[ifo].bandpass(25,90)
+    bandpass_data = dict(zip(ifos, parallel_map(functools.partial(get_product, band=PROCESSING_PARAMS["bandpass"]), ifos, mode=PIPELINE_MODE)))
 
     return bandpass_data
 #--------------------------------------------
 
 #--------------------------------------------
-@st.cache_data
+@shared_store
+@persistent_product
 def load_whitend_data()-> dict:
     """
     Load whitened TimeSeries strain data for gravitational wave interferometers.
@@ -127,20 +405,17 @@ def load_whitend_data()-> dict:
     amplitude spectral density (ASD), which is calculated as the square 
     root of the power spectral density (PSD) obtained from load_PSD_data().
     """
-    whitend_data = {}
     ifos = ['L1', 'V1', 'H1']
-    pure_data = load_pure_data()
-    PSD_data = load_PSD_data()
 
-    for ifo in ifos:
-        whitend_data[ifo] = pure_data[ifo].whiten(asd=np.sqrt(PSD_data[ifo]))
+    whitend_data = dict(zip(ifos, parallel_map(functools.partial(get_product, whiten=True), ifos, mode=PIPELINE_MODE)))
 
     return whitend_data
 #--------------------------------------------
 
 
 #--------------------------------------------
-@st.cache_data
+@shared_store
+@persistent_product
 def load_GW_data()-> dict:
     """
     Load fully processed gravitational wave strain data ready for analysis.
@@ -159,27 +434,19 @@ def load_GW_data()-> dict:
     Notes
     -----
     This function combines the complete gravitational wave data processing pipeline.
-    Unprocessed data is obtained from load_pure_data() and the ASD for whitening is
-    calculated using the square root of the PSD, obtained from load_PSD_data().
+    The 25-90 Hz bandpassed data is shared with load_bandpass_data() and the ASD for 
+    whitening is the square root of the PSD shared with load_PSD_data(), see get_product().
     """
-    whitend_data = {}
-    bandpass_data = {}
-    GW_data = {}
     ifos = ['L1', 'V1', 'H1']
-    pure_data = load_pure_data()
-    gps =1242442967.4
-    PSD_data = load_PSD_data()
 
-    for ifo in ifos:
-        bandpass_data[ifo] = pure_data[ifo].bandpass(25,90)
-        whitend_data[ifo] = bandpass_data[ifo].whiten(asd=np.sqrt(PSD_data[ifo]))
-        GW_data[ifo] = whitend_data[ifo].crop(gps-2,gps+2)
+    GW_data = dict(zip(ifos, parallel_map(functools.partial(get_product, band=PROCESSING_PARAMS["bandpass"], whiten=True, crop=EVENT_WINDOW), ifos, mode=PIPELINE_MODE)))
 
     return GW_data
 #--------------------------------------------
 
 #--------------------------------------------
-@st.cache_data
+@shared_store
+@persistent_product
 def load_ASD_data()-> dict:
     """
     Load amplitude spectral density (ASD) data for gravitational wave interferometers.
@@ -204,12 +471,9 @@ def load_ASD_data()-> dict:
     - Method: Welch's method
     - Overlap: 2 seconds (50% overlap)
     """
-    ASD_data = {}
     ifos = ['L1', 'V1', 'H1']
-    pure_data = load_pure_data()
 
-    for ifo in ifos:
-        ASD_data[ifo] = pure_data[ifo].asd(fftlength=4.,window=('tukey',1./4.),method='welch',overlap=2.) # type: ignore
+    ASD_data = dict(zip(ifos, parallel_map(functools.partial(get_spectrum, kind="asd"), ifos, mode=PIPELINE_MODE)))
 
     return ASD_data
 #--------------------------------------------
@@ -220,7 +484,8 @@ def load_ASD_data()-> dict:
 
 
 #--------------------------------------------
-@st.cache_data
+@shared_store
+@persistent_product
 def load_PSD_data()-> dict:
     """
     Load power spectral density (PSD) data for gravitational wave interferometers.
@@ -247,16 +512,94 @@ def load_PSD_data()-> dict:
     - Method: Welch's method
     - Overlap: 2 seconds (50% overlap)
     """
-    PSD_data = {}
     ifos = ['L1', 'V1', 'H1']
-    pure_data = load_pure_data()
 
-    for ifo in ifos:
-        PSD_data[ifo] = pure_data[ifo].psd(fftlength=4.,window=('tukey',1./4.),method='welch',overlap=2.) # type: ignore
+    PSD_data = dict(zip(ifos, parallel_map(functools.partial(get_spectrum, kind="psd"), ifos, mode=PIPELINE_MODE)))
 
     return PSD_data
 #--------------------------------------------
 
+#--------------------------------------------
+@shared_store
+def load_analysis_raw_data()-> dict:
+    """
+    Load cropped strain data around the GW190521 event at ANALYSIS_SAMPLE_RATE.
+
+    Same as load_raw_data(), but resampled to the analysis rate before 
+    cropping. Used with gen_template(), whose default time grid is this data.
+
+    Returns
+    -------
+    dict
+        Dictionary with keys ['L1', 'V1', 'H1'] containing cropped 
+        interferometer TimeSeries strain data at ANALYSIS_SAMPLE_RATE.
+    """
+    ifos = ['L1', 'V1', 'H1']
+
+    analysis_raw_data = dict(zip(ifos, parallel_map(functools.partial(get_product, crop=EVENT_WINDOW, rate=ANALYSIS_SAMPLE_RATE), ifos, mode=PIPELINE_MODE)))
+
+    return analysis_raw_data
+#--------------------------------------------
+
+#--------------------------------------------
+@shared_store
+@persistent_product
+def load_analysis_GW_data()-> dict:
+    """
+    Load fully processed strain data at ANALYSIS_SAMPLE_RATE.
+
+    Same pipeline as load_GW_data() (25-90 Hz bandpass, whitening, crop), run 
+    on data resampled to the analysis rate, with the ASD of the resampled data.
+
+    Returns
+    -------
+    dict
+        Dictionary with keys ['L1', 'V1', 'H1'] containing fully processed 
+        interferometer TimeSeries strain data at ANALYSIS_SAMPLE_RATE.
+    """
+    ifos = ['L1', 'V1', 'H1']
+
+    analysis_GW_data = dict(zip(ifos, parallel_map(functools.partial(get_product, band=PROCESSING_PARAMS["bandpass"], whiten=True, crop=EVENT_WINDOW, rate=ANALYSIS_SAMPLE_RATE), ifos, mode=PIPELINE_MODE)))
+
+    return analysis_GW_data
+#--------------------------------------------
+
+#--------------------------------------------
+@shared_store
+@persistent_product
+def load_analysis_PSD_data()-> dict:
+    """
+    Load the PSD of the strain data resampled to ANALYSIS_SAMPLE_RATE.
+
+    Welch estimate with the same parameters as load_PSD_data(), ending at 
+    the Nyquist frequency of the analysis rate.
+
+    Returns
+    -------
+    dict
+        Dictionary with keys ['L1', 'V1', 'H1'] containing power spectral 
+        density FrequencySeries data for each interferometer.
+    """
+    ifos = ['L1', 'V1', 'H1']
+
+    analysis_PSD_data = dict(zip(ifos, parallel_map(functools.partial(get_spectrum, kind="psd", rate=ANALYSIS_SAMPLE_RATE), ifos, mode=PIPELINE_MODE)))
+
+    return analysis_PSD_data
+#--------------------------------------------
+
+#--------------------------------------------
+@st.cache_resource(show_spinner=False)
+def load_bandpass_engine()-> FrequencyBandpassEngine:
+    """
+    Load the frequency-domain bandpass engine used by interactive plots.
+
+    The engine holds the rFFT and whitening response of the unprocessed data 
+    for every interferometer, computed once per server process and shared by 
+    every session. See FrequencyBandpassEngine.view().
+    """
+    return FrequencyBandpassEngine(load_pure_data(), load_ASD_data())
+#--------------------------------------------
+
 #--------------------------------------------
 @st.cache_data
 def load_colours_dict()-> dict[str, str]:
@@ -0,0 +1,316 @@
+"""
+Streaming convergence diagnostics for the MCMC.
+
+StreamingDiagnostics is fed the new steps of the chain at every checkpoint and
+keeps, per walker and parameter, only
+
+- a buffer of at most max_length batch means, whose batch size doubles (by
+  merging neighbours) whenever the buffer fills, for the FFT based integrated
+  autocorrelation time, and
+- the running sums and sums of squares at up to max_updates evenly spaced
+  updates (every other one is dropped when they fill up), for split R-hat,
+
+so an update costs O(new samples) plus one FFT of a fixed size, and the
+memory use does not grow with the chain length. converged() tells the sampler when to stop, see
+tools.run_sampler.
+"""
+import numpy as np
+
+# Stopping targets, see StreamingDiagnostics.converged()
+DEFAULT_TARGETS = {
+    "tau_factor": 50.,  # chain longer than this many autocorrelation times
+    "tau_rtol": 0.01,   # autocorrelation time estimate changed by less than this since the previous update
+    "rhat": 1.01,       # split R-hat below this for every parameter
+    "ess": 1000.,       # effective sample size above this for every parameter
+}
+
+#--------------------------------------------
+def _auto_window(taus: np.ndarray, c: float)-> int:
+    """Sokal's automatic window: the first M with M >= c * tau(M), or the last lag."""
+    m = np.arange(len(taus)) < c * taus
+    return int(np.argmin(m)) if np.any(~m) else len(taus) - 1
+#--------------------------------------------
+
+#--------------------------------------------
+class StreamingDiagnostics:
+    """
+    Incremental autocorrelation time, split R-hat and effective sample size of an ensemble chain.
+
+    Parameters
+    ----------
+    nwalkers, ndim : int
+        Shape of the ensemble.
+    max_length : int, optional
+        Maximum number of batch means kept per walker and parameter
+        (default: 2048). Once the chain is tau_factor autocorrelation times 
+        long, the batch size is still about max_length/tau_factor times 
+        shorter than the autocorrelation time.
+    max_updates : int, optional
+        Maximum number of updates whose running sums are kept for split 
+        R-hat (default: 256). When they fill up every other one is dropped 
+        and only every second update is kept from then on.
+    c : float, optional
+        Window constant of the autocorrelation time estimate (default: 5,
+        as emcee.autocorr.integrated_time).
+    targets : dict, optional
+        Stopping targets, updating DEFAULT_TARGETS.
+
+    Notes
+    -----
+    With a batch size of one this is exactly emcee's estimator: the
+    autocorrelation function of each walker, averaged over walkers, summed up
+    to the automatic window. Once the batch size b is larger than one, the
+    same estimate tau_b on the series of batch means is scaled by 
+    b * Var(batch means) / Var(samples), which is consistent both for times 
+    well above b and below it.
+
+    Split R-hat is computed on the second half of the chain, the first half
+    is treated as warm-up. The split points are rounded to the nearest
+    kept update, at most 1/max_updates of the chain away when updates are
+    regular. The effective sample size is that of the samples left after
+    discarding a burn-in of twice the longest autocorrelation time.
+    """
+
+    def __init__(self, nwalkers: int, ndim: int, max_length: int = 2048, max_updates: int = 256, c: float = 5., targets: dict | None = None):
+        self.nwalkers, self.ndim = nwalkers, ndim
+        self.max_length = max_length - max_length % 2
+        self.max_updates = max(max_updates - max_updates % 2, 4)
+        self.c = c
+        self.targets = dict(DEFAULT_TARGETS, **(targets or {}))
+
+        self.nsteps = 0
+        self._offset = None                                  # mean first sample, subtracted for numerical stability
+        self._buffer = np.empty((self.max_length, nwalkers, ndim))
+        self._filled = 0
+        self._batch = 1
+        self._partial_sum = np.zeros((nwalkers, ndim))
+        self._partial_count = 0
+
+        self._total = np.zeros((nwalkers, ndim))             # running sums of the whole chain
+        self._total_sq = np.zeros((nwalkers, ndim))
+        self._updates = 0
+        self._stride = 1                                     # prefix sums kept at every stride-th update
+        self._kept = 1
+        self._steps = np.zeros(self.max_updates, dtype=int)
+        self._sums = np.zeros((self.max_updates, nwalkers, ndim))
+        self._sumsqs = np.zeros((self.max_updates, nwalkers, ndim))
+        self._previous_tau = None
+        self._tau = None
+
+    def update(self, samples)-> dict:
+        """
+        Add new steps of the chain and return the updated summary().
+
+        Parameters
+        ----------
+        samples : array-like
+            New steps, of shape (n_new, nwalkers, ndim).
+        """
+        x = np.asarray(samples, dtype=float)
+        if len(x) == 0:
+            return self.summary()
+        if self._offset is None:
+            self._offset = x[0].mean(axis=0)   # shared by all walkers, so the spread between them is kept
+        x = x - self._offset
+
+        self.nsteps += len(x)
+        self._total += x.sum(axis=0)
+        self._total_sq += (x**2).sum(axis=0)
+        self._keep_prefix()
+
+        position = 0
+        while position < len(x):
+            if self._partial_count == 0 and len(x) - position >= self._batch:
+                # whole batches go straight into the buffer
+                if self._filled == self.max_length:
+                    self._merge()
+                    continue
+                count = min((len(x) - position) // self._batch, self.max_length - self._filled)
+                block = x[position:position + count * self._batch]
+                self._buffer[self._filled:self._filled + count] = block.reshape(count, self._batch, self.nwalkers, self.ndim).mean(axis=1)
+                self._filled += count
+                position += count * self._batch
+            else:
+                take = min(self._batch - self._partial_count, len(x) - position)
+                self._partial_sum += x[position:position + take].sum(axis=0)
+                self._partial_count += take
+                position += take
+                if self._partial_count == self._batch:
+                    if self._filled == self.max_length:
+                        self._merge()
+                    self._buffer[self._filled] = self._partial_sum / self._batch
+                    self._filled += 1
+                    self._partial_sum[:] = 0
+                    self._partial_count = 0
+
+        self._previous_tau, self._tau = self._tau, self._autocorr_time()
+        return self.summary()
+
+    def _keep_prefix(self):
+        """Store the running sums if this update is on the stride, halving the stored ones when they are full."""
+        self._updates += 1
+        if self._updates % self._stride:
+            return
+        if self._kept == self.max_updates:
+            for array in (self._steps, self._sums, self._sumsqs):
+                array[:self._kept // 2] = array[0:self._kept:2]
+            self._kept //= 2
+            self._stride *= 2
+        self._steps[self._kept] = self.nsteps
+        self._sums[self._kept] = self._total
+        self._sumsqs[self._kept] = self._total_sq
+        self._kept += 1
+
+    def _prefix(self)-> tuple:
+        """Steps, running sums and sums of squares at the kept updates and the latest one."""
+        steps, sums, sumsqs = self._steps[:self._kept], self._sums[:self._kept], self._sumsqs[:self._kept]
+        if steps[-1] == self.nsteps:
+            return steps, sums, sumsqs
+        return (np.append(steps, self.nsteps), np.concatenate([sums, self._total[None]]), 
+                np.concatenate([sumsqs, self._total_sq[None]]))
+
+    def _merge(self):
+        """Halve the buffer by averaging neighbouring batch means, doubling the batch size."""
+        pairs = self._filled // 2
+        merged = (self._buffer[0:2*pairs:2] + self._buffer[1:2*pairs:2]) / 2
+        if self._filled % 2:
+            # the unpaired last batch becomes the start of the next, larger batch
+            self._partial_sum += self._buffer[self._filled - 1] * self._batch
+            self._partial_count += self._batch
+        self._buffer[:pairs] = merged
+        self._filled = pairs
+        self._batch *= 2
+
+    def _autocorr_time(self)-> np.ndarray:
+        """Integrated autocorrelation time per parameter, in steps."""
+        length = self._filled
+        if length < 2:
+            return np.full(self.ndim, np.inf)
+        series = self._buffer[:length]
+        n = 1 << int(np.ceil(np.log2(2 * length)))
+        f = np.fft.rfft(series - series.mean(axis=0), n=n, axis=0)
+        acf = np.fft.irfft(f * np.conj(f), n=n, axis=0)[:length]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            acf = np.nan_to_num(acf / acf[0]).mean(axis=1)  # (length, ndim), averaged over walkers
+        taus = 2.0 * np.cumsum(acf, axis=0) - 1.0
+        # at least one step, the estimate of a very short chain can be below that
+        tau = np.maximum(np.array([taus[_auto_window(taus[:, d], self.c), d] for d in range(self.ndim)]), 1.)
+        if self._batch == 1:
+            return tau
+
+        # batch means estimator: b * tau_b * Var(batch means) / Var(samples), which
+        # tends to b * tau_b for times well above b and to the batch means
+        # variance ratio (the classic estimator) for times below it
+        n = self.nsteps
+        total, total_sq = self._total, self._total_sq
+        sample_var = (total_sq - total**2 / n) / (n - 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.nan_to_num(series.var(axis=0, ddof=1) / sample_var).mean(axis=0)
+        return np.maximum(tau * self._batch * ratio, 1.)
+
+    _STATE = ("nsteps", "_offset", "_filled", "_batch", "_partial_sum", "_partial_count", "_total", "_total_sq",
+              "_updates", "_stride", "_kept", "_previous_tau", "_tau")
+
+    def state(self)-> dict:
+        """
+        Return the fixed-size state of the diagnostics as a dictionary of arrays, for checkpoints.
+
+        Its size depends on max_length, max_updates and the ensemble shape
+        only. from_state() continues exactly where this one stopped.
+        """
+        state = {key: np.asarray(getattr(self, key)) for key in self._STATE if getattr(self, key) is not None}
+        state.update(max_length=self.max_length, max_updates=self.max_updates, c=self.c,
+                     buffer=self._buffer[:self._filled], steps=self._steps[:self._kept],
+                     sums=self._sums[:self._kept], sumsqs=self._sumsqs[:self._kept])
+        return state
+
+    @classmethod
+    def from_state(cls, state, targets: dict | None = None)-> "StreamingDiagnostics":
+        """Rebuild diagnostics from a state() dictionary (or an h5py group holding it)."""
+        shape = np.shape(state["_total"])
+        self = cls(shape[0], shape[1], max_length=int(np.asarray(state["max_length"])), max_updates=int(np.asarray(state["max_updates"])),
+                   c=float(np.asarray(state["c"])), targets=targets)
+        for key in self._STATE:
+            if key in state:
+                value = np.array(state[key])
+                setattr(self, key, value.item() if value.ndim == 0 else value)
+        self._buffer[:self._filled] = state["buffer"]
+        self._steps[:self._kept] = state["steps"]
+        self._sums[:self._kept] = state["sums"]
+        self._sumsqs[:self._kept] = state["sumsqs"]
+        return self
+
+    def split_rhat(self)-> np.ndarray:
+        """
+        Split R-hat per parameter over the second half of the chain (nan until there are enough updates).
+
+        Each walker's second half is split at the kept update nearest to 3/4
+        of the chain. When the two parts differ in length (irregular updates,
+        or split points rounded to kept updates), every part keeps its own
+        mean and variance and the shorter length is used as n in the
+        (n - 1)/n weight of the within-chain variance. This changes R-hat
+        by O(1/n^2) relative to a split into equal parts.
+        """
+        steps, sums, sumsqs = self._prefix()
+        cuts = [int(np.argmin(np.abs(steps - self.nsteps * fraction))) for fraction in (0.5, 0.75)]
+        bounds = [cuts[0], cuts[1], len(steps) - 1]
+        lengths = [steps[bounds[1]] - steps[bounds[0]], steps[bounds[2]] - steps[bounds[1]]]
+        if min(lengths) < 2:
+            return np.full(self.ndim, np.nan)
+
+        means, variances = [], []
+        for (a, b), n in zip([(bounds[0], bounds[1]), (bounds[1], bounds[2])], lengths):
+            total = sums[b] - sums[a]
+            total_sq = sumsqs[b] - sumsqs[a]
+            means.append(total / n)
+            variances.append((total_sq - total**2 / n) / (n - 1))
+        means, variances = np.concatenate(means), np.concatenate(variances)  # (2 * nwalkers, ndim)
+
+        n = min(lengths)
+        within = variances.mean(axis=0)
+        between = n * means.var(axis=0, ddof=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(((n - 1) / n * within + between / n) / within)
+
+    def summary(self)-> dict:
+        """
+        Return the current diagnostics.
+
+        Returns
+        -------
+        dict
+            steps, tau (per parameter, in steps), tau_max, rhat and ess (per
+            parameter), the suggested burn_in (2 tau_max) and thin (tau_min/2),
+            whether each target is met, and whether all are (converged).
+        """
+        tau = self._tau if self._tau is not None else np.full(self.ndim, np.inf)
+        tau_max = float(np.max(tau))
+        finite = np.isfinite(tau_max)
+        burn_in = int(np.ceil(2 * tau_max)) if finite else self.nsteps
+        ess = max(self.nsteps - burn_in, 0) * self.nwalkers / tau
+        rhat = self.split_rhat()
+
+        if self._previous_tau is not None and finite and np.all(np.isfinite(self._previous_tau)):
+            tau_change = float(np.max(np.abs(self._previous_tau - tau) / tau))
+        else:
+            tau_change = np.inf
+
+        met = {"tau_factor": bool(finite and self.nsteps > self.targets["tau_factor"] * tau_max),
+               "tau_rtol": bool(tau_change < self.targets["tau_rtol"]),
+               "rhat": bool(np.all(rhat < self.targets["rhat"])),
+               "ess": bool(np.all(ess > self.targets["ess"]))}
+        return {"steps": self.nsteps,
+                "tau": tau.tolist(),
+                "tau_max": tau_max,
+                "tau_change": tau_change,
+                "rhat": rhat.tolist(),
+                "ess": ess.tolist(),
+                "burn_in": burn_in,
+                "thin": max(1, int(np.min(tau) / 2)) if finite else 1,
+                "targets_met": met,
+                "converged": all(met.values())}
+
+    def converged(self)-> bool:
+        """True once every target in self.targets is met."""
+        return self.summary()["converged"]
+#--------------------------------------------
@@ -0,0 +1,119 @@
+"""
+Offline registry of the gravitational wave events used by the app.
+
+Event GPS times, detectors and local data files are read from the bundled,
+versioned tools/event_registry.json, so page reruns never make a network
+request. gwosc is only used to refresh the registry:
+
+    python -m tools.event_registry --refresh GW190521
+"""
+import argparse
+import functools
+import json
+import os
+
+REGISTRY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "event_registry.json")
+DETECTOR_ORDER = ("L1", "V1", "H1") # order of the pages' detector loops and of the bundled registry
+
+#--------------------------------------------
+@functools.lru_cache(maxsize=None)
+def load_event_registry(path: str = REGISTRY_FILE)-> dict:
+    """
+    Load the event registry file.
+
+    The registry is read once per process and kept in memory, every later
+    lookup is a dictionary access.
+
+    Returns
+    -------
+    dict
+        Dictionary with the registry "version", its "source" and the "events",
+        keyed by event name.
+    """
+    with open(path) as f:
+        return json.load(f)
+#--------------------------------------------
+
+#--------------------------------------------
+def get_event(name: str)-> dict:
+    """Return the registry entry (gps, detectors, data_files) for an event."""
+    events = load_event_registry()["events"]
+    try:
+        return events[name]
+    except KeyError:
+        raise KeyError(f"{name!r} is not in the event registry ({', '.join(sorted(events))}). "
+                       f"Add it with: python -m tools.event_registry --refresh {name}") from None
+#--------------------------------------------
+
+#--------------------------------------------
+def event_gps(name: str)-> float:
+    """
+    Return the GPS time of an event.
+
+    Drop-in, offline replacement for gwosc.datasets.event_gps().
+    """
+    return get_event(name)["gps"]
+#--------------------------------------------
+
+#--------------------------------------------
+def event_detectors(name: str)-> list[str]:
+    """Return the interferometers with data for an event."""
+    return list(get_event(name)["detectors"])
+#--------------------------------------------
+
+#--------------------------------------------
+def event_data_files(name: str)-> dict[str, str]:
+    """Return a dictionary mapping interferometer keys to the local strain data files of an event."""
+    return dict(get_event(name)["data_files"])
+#--------------------------------------------
+
+#--------------------------------------------
+def refresh_event_registry(names, path: str = REGISTRY_FILE)-> dict:
+    """
+    Refresh registry entries from GWOSC and write a new registry version.
+
+    The GPS time and detectors of each event are fetched with gwosc, the local
+    data files of existing entries are kept. gwosc returns the detectors as
+    an unordered set, so detectors already in the entry keep their order and
+    new ones follow in DETECTOR_ORDER. This is the only function in the
+    module that touches the network.
+
+    Parameters
+    ----------
+    names : iterable of str
+        Event names to add or update.
+    path : str, optional
+        Registry file to update (default: the bundled registry).
+
+    Returns
+    -------
+    dict
+        The updated registry.
+    """
+    from gwosc.datasets import event_gps as gwosc_event_gps, event_detectors as gwosc_event_detectors
+
+    registry = json.loads(json.dumps(load_event_registry(path))) # private copy of the cached registry
+    for name in names:
+        entry = registry["events"].setdefault(name, {"data_files": {}})
+        entry["gps"] = float(gwosc_event_gps(name))
+        detectors = set(gwosc_event_detectors(name))
+        known = [ifo for ifo in entry.get("detectors", []) if ifo in detectors]
+        rank = lambda ifo: (DETECTOR_ORDER.index(ifo) if ifo in DETECTOR_ORDER else len(DETECTOR_ORDER), ifo)
+        entry["detectors"] = known + sorted(detectors - set(known), key=rank)
+    registry["version"] += 1
+
+    with open(path, "w") as f:
+        json.dump(registry, f, indent=4)
+        f.write("\n")
+    load_event_registry.cache_clear()
+    return registry
+#--------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or refresh the offline event registry.")
+    parser.add_argument("--refresh", nargs="+", metavar="EVENT", help="events to fetch from GWOSC")
+    args = parser.parse_args()
+
+    if args.refresh:
+        refresh_event_registry(args.refresh)
+    print(json.dumps(load_event_registry(), indent=4))
@@ -0,0 +1,138 @@
+"""
+Frequency domain bandpass and whitening for the interactive strain plots.
+
+The Processing Data page's slider used to run TimeSeries.bandpass() and
+TimeSeries.whiten() over the full 32 s of every detector on each move.
+FrequencyBandpassEngine keeps each detector's spectrum and applies the
+same zero-phase IIR bandpass as a multiplication by its magnitude response,
+then inverse transforms only the plotted window on a coarser time grid.
+"""
+import functools
+
+import numpy as np
+from scipy.signal import get_window, freqz_zpk
+from gwpy.signal import filter_design
+from gwpy.timeseries import TimeSeries
+
+#--------------------------------------------
+@functools.lru_cache(maxsize=64)
+def bandpass_response(low: float, high: float, sample_rate: float, n_freq: int, df: float)-> np.ndarray:
+    """
+    Frequency response of TimeSeries.bandpass(low, high) on the first n_freq rFFT bins.
+
+    TimeSeries.bandpass() designs an IIR filter with
+    gwpy.signal.filter_design.bandpass() and applies it forwards and
+    backwards (filtfilt), so its response is the squared magnitude |H(f)|^2
+    of the filter, real and zero-phase. Cached, the detectors and both
+    views of a slider position share one response.
+    """
+    zeros, poles, gain = filter_design.bandpass(low, high, sample_rate, analog=False, type="iir", output="zpk")
+    _, response = freqz_zpk(zeros, poles, gain, worN=df * np.arange(n_freq), fs=sample_rate)
+    response = np.abs(response)**2
+    response.flags.writeable = False   # shared by every caller of the cache
+    return response
+#--------------------------------------------
+
+#--------------------------------------------
+class FrequencyBandpassEngine:
+    """
+    Interactive bandpass and whitening of strain data in the frequency domain.
+
+    The rFFT of each detector's data and its whitening response are computed
+    once. A bandpass is then a multiplication of the cached spectrum by
+    bandpass_response(), and only the bandwidth and time span that a view 
+    needs are inverse transformed, so moving a slider costs a few 
+    milliseconds instead of re-filtering and re-whitening the full 32 
+    seconds of every detector.
+
+    Parameters
+    ----------
+    strain : dict
+        Dictionary of TimeSeries strain data, keyed by interferometer.
+    asd : dict
+        Dictionary of amplitude spectral density FrequencySeries used for
+        whitening, keyed by interferometer.
+    taper : float, optional
+        Tukey window α applied to the data before the FFT, to keep the edges of
+        the 32 seconds from wrapping around into the view (default: 0.1).
+
+    Notes
+    -----
+    The bandpass is the zero-phase IIR filter of TimeSeries.bandpass(), not
+    an ideal (brick wall) mask, so the traces ring like the page's gwpy 
+    filter. The response is kept up to the Nyquist frequency of the view, 
+    at least twice the upper band edge, where the filter is down by more 
+    than 60 dB. Around the event the views agree with TimeSeries.bandpass() 
+    to better than 1e-3 of the trace for lower band edges above 1 Hz. Below
+    that the filter's impulse response is as long as the 32 s of data and 
+    both results depend on how its ends are treated (a Tukey taper here, 
+    padding in filtfilt), by a few percent at 0.1 Hz and tens of percent at
+    the slider's 0.01 Hz.
+
+    Whitening divides by the ASD directly rather than applying a windowed
+    FIR filter, with the normalisation of TimeSeries.whiten(), so the
+    whitened output is on the same scale.
+    """
+
+    def __init__(self, strain: dict, asd: dict, taper: float = 0.1):
+        self._spectra = {}
+        self._white_spectra = {}
+        self._meta = {}
+
+        for ifo, series in strain.items():
+            values = np.asarray(series.value)
+            n = len(values)
+            dt = series.dt.value
+            freqs = np.fft.rfftfreq(n, dt)
+
+            spectrum = np.fft.rfft((values - values.mean()) * get_window(('tukey', taper), n))
+            # same normalisation as TimeSeries.whiten(), so unit variance for white noise
+            response = np.sqrt(2 * dt) / np.interp(freqs, asd[ifo].frequencies.value, asd[ifo].value)
+
+            self._spectra[ifo] = spectrum
+            self._white_spectra[ifo] = spectrum * response
+            self._meta[ifo] = (n, dt, series.t0.value, series.unit, series.name)
+
+    def view(self, ifo: str, low: float, high: float, start: float, end: float, whiten: bool = False)-> TimeSeries:
+        """
+        Return bandpassed (and optionally whitened) strain data for a time window.
+
+        Parameters
+        ----------
+        ifo : str
+            Interferometer key.
+        low, high : float
+            Bandpass frequency bounds in Hz.
+        start, end : float
+            GPS times of the window to return.
+        whiten : bool, optional
+            Whiten the data after the bandpass (default: False).
+
+        Returns
+        -------
+        TimeSeries
+            The requested window. It is sampled at the original rate divided by
+            the largest power of two that still keeps the Nyquist frequency at
+            least twice the upper band edge.
+        """
+        n, dt, t0, unit, name = self._meta[ifo]
+        spectrum = self._white_spectra[ifo] if whiten else self._spectra[ifo]
+        df = 1. / (n * dt)
+        kmax = min(int(np.floor(high / df)), len(spectrum) - 1)
+
+        # the filtered spectrum has no significant power far above `high`, so
+        # it can be inverse transformed straight onto a coarser time grid
+        decimate = 1
+        while n % (2 * decimate) == 0 and n // (4 * decimate) >= 2 * kmax:
+            decimate *= 2
+        m = n // decimate
+
+        n_freq = m // 2 + 1
+        filtered = spectrum[:n_freq] * bandpass_response(float(low), float(high), 1. / dt, n_freq, df)
+        samples = np.fft.irfft(filtered, n=m) * (m / n)
+
+        new_dt = dt * decimate
+        first = max(int(np.floor((start - t0) / new_dt)), 0)
+        last = min(int(np.ceil((end - t0) / new_dt)) + 1, m)
+        return TimeSeries(samples[first:last], t0=t0 + first * new_dt, dt=new_dt, unit=unit, name=name)
+#--------------------------------------------
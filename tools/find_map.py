@@ -0,0 +1,303 @@
+"""
+Multi-start maximum a posteriori (MAP) search for the GW190521 parameters.
+
+The Statistical Sampling page starts its MCMC from best_fit_parameters, the
+maximum of the posterior. find_map() re-derives it: bounded local
+optimizations of logposterior() from many starting points, run in parallel
+on the persistent process pool of tools.parallel, then merged into distinct
+modes. The best mode is written in the schema of
+MCMC_data/MAP_parameters.parquet, so the Results page and the sampler
+(run_sampler's "start") can read it directly:
+
+    python -m tools.find_map --starts lhs --n-starts 32 --output MCMC_data/MAP_parameters_optimized.parquet
+
+Each worker process builds the likelihood once and keeps its waveform cache
+across the optimizations it runs; steps that only change the extrinsic
+parameters reuse the cached intrinsic waveform.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from tools.likelihood import load_likelihood, SAMPLING_IFOS, TIME_SHIFT_BOUNDS
+from tools.parallel import parallel_map
+from tools.posterior import PARAMETER_NAMES, logposterior, logposterior_batch
+from tools.postprocess import map_table
+
+# Search region. The page's starting bounds, widened to the prior support
+# where the stored MAP lies outside them (mass ratio, distance, time shift).
+# The time shift has no prior bound, its range is the one the marginalized
+# likelihood integrates over.
+SEARCH_BOUNDS = np.array([
+    [80., 200.],               # primary mass
+    [0.5, .97],                # mass ratio
+    [500., 8000.],             # Lum distance
+    TIME_SHIFT_BOUNDS,         # time_shift
+    [0., 2*np.pi],             # phase
+    [0., 2*np.pi],             # right_ascension
+    [-np.pi/2., np.pi/2.],     # declination
+    [0., np.pi],               # inclination
+    [0., 2*np.pi],             # polarization
+])
+PERIODIC = [4, 5, 8]           # phase, right ascension and polarization wrap around at 2 pi
+OPTIMIZER_ROWS = ["optimizer_start", "optimizer_evaluations"]   # rows laplace_table() adds after MAP_ROWS
+
+# "My starting parameters" of the Model Playground page, the event time 03:02:29.427 as a time shift
+PLAYGROUND_PARAMETERS = [160., .72, 2400., .027, .01, 2.2, -1.2, .5, .01]
+
+#--------------------------------------------
+def starting_points(n_starts: int, sampling: str = "lhs", bounds=SEARCH_BOUNDS, seed: int = 42)-> np.ndarray:
+    """
+    Draw starting points inside the bounds.
+
+    Parameters
+    ----------
+    n_starts : int
+        Number of points.
+    sampling : str, optional
+        "lhs" (default) for a Latin hypercube, uniform in every parameter,
+        or "prior" for independent draws from the prior restricted to the
+        bounds (uniform in volume and orientation).
+    bounds : array-like, optional
+        Array of shape (9, 2) (default: SEARCH_BOUNDS).
+    seed : int, optional
+        Random seed (default: 42).
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n_starts, 9).
+    """
+    bounds = np.asarray(bounds, dtype=float)
+    lo, hi = bounds[:, 0], bounds[:, 1]
+    if sampling == "lhs":
+        from scipy.stats import qmc
+        return qmc.scale(qmc.LatinHypercube(d=len(bounds), seed=seed).random(n_starts), lo, hi)
+    if sampling != "prior":
+        raise ValueError(f"Unknown sampling {sampling!r}, expected 'lhs' or 'prior'")
+
+    u = np.random.default_rng(seed).uniform(size=(n_starts, len(bounds)))
+    points = lo + u * (hi - lo)
+    # inverse CDFs of the non uniform priors: distance^2, cos(declination), sin(inclination)
+    points[:, 2] = (lo[2]**3 + u[:, 2] * (hi[2]**3 - lo[2]**3))**(1/3)
+    points[:, 6] = np.arcsin(np.sin(lo[6]) + u[:, 6] * (np.sin(hi[6]) - np.sin(lo[6])))
+    points[:, 7] = np.arccos(np.cos(lo[7]) - u[:, 7] * (np.cos(lo[7]) - np.cos(hi[7])))
+    return points
+#--------------------------------------------
+
+#--------------------------------------------
+def _optimize(job)-> dict:
+    """Worker of find_map(): one bounded local optimization, in unit cube coordinates."""
+    from scipy.optimize import minimize
+
+    index, start, bounds, method, options, likelihood_args = job
+    likelihood = load_likelihood(*likelihood_args)
+    lo, width = bounds[:, 0], bounds[:, 1] - bounds[:, 0]
+    evaluations, best = 0, (-np.inf, None)
+
+    def objective(u):
+        nonlocal evaluations, best
+        evaluations += 1
+        x = lo + np.clip(u, 0., 1.) * width
+        value = logposterior(x, likelihood)
+        if value > best[0]:
+            best = (value, x)
+        return -value if np.isfinite(value) else 1e10
+
+    u0 = np.clip((np.asarray(start, dtype=float) - lo) / width, 0., 1.)
+    start_time = time.perf_counter()
+    result = minimize(objective, u0, method=method, bounds=[(0., 1.)] * len(u0), options=options)
+    # bounded Powell can stop on a point worse than one it evaluated, keep the best
+    lp, params = best if best[1] is not None else (-np.inf, lo + u0 * width)
+    return {"start": index,
+            "params": params,
+            "lp": float(lp),
+            "evaluations": evaluations,
+            "seconds": time.perf_counter() - start_time,
+            "success": bool(result.success)}
+#--------------------------------------------
+
+#--------------------------------------------
+def deduplicate(results: list, bounds=SEARCH_BOUNDS, tol: float = 0.02)-> pd.DataFrame:
+    """
+    Merge optimization results that converged to the same mode.
+
+    Two results are the same mode when they differ by less than tol of the
+    search range in every parameter, with the angles in PERIODIC compared
+    around the circle. Each mode keeps its best result.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per mode, best first: the parameters (PARAMETER_NAMES), lp,
+        the index of the start that found it, the number of starts that
+        converged to it and the evaluations of the best one.
+    """
+    bounds = np.asarray(bounds, dtype=float)
+    width = bounds[:, 1] - bounds[:, 0]
+    modes = []
+    for result in sorted(results, key=lambda r: -r["lp"]):
+        for mode in modes:
+            delta = np.abs(result["params"] - mode["params"]) / width
+            delta[PERIODIC] = np.minimum(delta[PERIODIC], np.abs(2*np.pi / width[PERIODIC] - delta[PERIODIC]))
+            if np.all(delta < tol):
+                mode["count"] += 1
+                break
+        else:
+            modes.append(dict(result, count=1))
+
+    return pd.DataFrame([dict(zip(PARAMETER_NAMES, mode["params"]), lp=mode["lp"], start=mode["start"],
+                              count=mode["count"], evaluations=mode["evaluations"]) for mode in modes])
+#--------------------------------------------
+
+#--------------------------------------------
+def laplace_intervals(params, likelihood=None, bounds=SEARCH_BOUNDS, step: float = 1e-3, mode: str = "process",
+                      max_workers: int | None = None)-> np.ndarray:
+    """
+    One standard deviation of every parameter from the curvature of the log posterior at a mode.
+
+    The Hessian is estimated with central differences of step times the
+    search range, all points evaluated in one logposterior_batch() call,
+    with the angles in PERIODIC wrapped around. Parameters along which the
+    posterior is not curved, or that sit on the edge of the prior, get nan.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (9,).
+    """
+    bounds = np.asarray(bounds, dtype=float)
+    x0 = np.asarray(params, dtype=float)
+    h = step * (bounds[:, 1] - bounds[:, 0])
+    n = len(x0)
+    eye = np.eye(n) * h
+
+    points = [x0]
+    pairs = [(i, j) for i in range(n) for j in range(i, n)]
+    for i, j in pairs:
+        for si, sj in [(1, 1), (1, -1), (-1, 1), (-1, -1)]:
+            points.append(x0 + si * eye[i] + sj * eye[j])
+    points = np.array(points)
+    points[:, PERIODIC] = np.mod(points[:, PERIODIC], 2*np.pi)
+    values = logposterior_batch(points, likelihood=likelihood, mode=mode, max_workers=max_workers)
+
+    hessian = np.empty((n, n))
+    with np.errstate(invalid='ignore'):
+        for k, (i, j) in enumerate(pairs):
+            pp, pm, mp, mm = values[1 + 4*k: 5 + 4*k]
+            hessian[i, j] = hessian[j, i] = (pp - pm - mp + mm) / (4 * h[i] * h[j])
+        eigenvalues = np.linalg.eigvalsh(-hessian) if np.all(np.isfinite(hessian)) else np.array([-1.])
+        if np.all(eigenvalues > 0):
+            return np.sqrt(np.diag(np.linalg.inv(-hessian)))
+        diagonal = np.diag(hessian)
+        return np.where(np.isfinite(diagonal) & (diagonal < 0), np.sqrt(-1 / diagonal), np.nan)
+#--------------------------------------------
+
+#--------------------------------------------
+def laplace_table(params, lp: float, sigma=None, bounds=SEARCH_BOUNDS, start: int = -1, evaluations: int = -1)-> pd.DataFrame:
+    """
+    A mode as tools.postprocess.map_table(), with MAP -/+ one and two sigma within the bounds as intervals.
+
+    The mode is not a sample of a chain, so chain and draw are -1. The
+    index of the optimization's start and its number of posterior
+    evaluations are added as the OPTIMIZER_ROWS.
+    """
+    bounds = np.asarray(bounds, dtype=float)
+    params = np.asarray(params, dtype=float)
+    sigma = np.full(len(params), np.nan) if sigma is None else np.asarray(sigma, dtype=float)
+    intervals = lambda k: [np.clip([p - k*s, p + k*s], lo, hi) for p, s, (lo, hi) in zip(params, sigma, bounds)]
+    table = map_table(params, lp, -1, -1, intervals(1), intervals(2))
+    optimizer = pd.DataFrame({"MAP": [float(start), float(evaluations)], "onestd": [[0., 0.]] * 2, "twostd": [[0., 0.]] * 2},
+                             index=OPTIMIZER_ROWS)
+    return pd.concat([table, optimizer])
+#--------------------------------------------
+
+#--------------------------------------------
+def find_map(n_starts: int = 32, sampling: str = "lhs", extra_starts=(PLAYGROUND_PARAMETERS,), bounds=SEARCH_BOUNDS,
+             seed: int = 42, method: str = "Powell", options: dict | None = None, ifos=SAMPLING_IFOS, f_lower: float = 10.,
+             rate="analysis", mode: str = "process", max_workers: int | None = None, intervals: bool = True)-> tuple:
+    """
+    Find the MAP parameters with many bounded local optimizations.
+
+    Parameters
+    ----------
+    n_starts : int, optional
+        Number of drawn starting points (default: 32).
+    sampling : str, optional
+        How they are drawn, "lhs" or "prior", see starting_points().
+    extra_starts : sequence of array-like, optional
+        Starting points added in front, by default the Model Playground's
+        PLAYGROUND_PARAMETERS.
+    bounds : array-like, optional
+        Search bounds of shape (9, 2) (default: SEARCH_BOUNDS).
+    seed : int, optional
+        Seed of the starting points (default: 42).
+    method : str, optional
+        Bounded scipy.optimize.minimize method (default: "Powell").
+    options : dict, optional
+        Options of the method (default: {"maxfev": 3000, "xtol": 1e-4, "ftol": 1e-6}).
+    ifos, f_lower, rate : optional
+        The likelihood, see load_likelihood().
+    mode : str, optional
+        Pool running the optimizations, see tools.parallel.parallel_map()
+        (default: "process").
+    max_workers : int, optional
+        Number of workers.
+    intervals : bool, optional
+        Estimate the onestd and twostd intervals of the result from the
+        curvature at the MAP, see laplace_intervals() (default: True).
+
+    Returns
+    -------
+    tuple
+        (map_df, modes): the best mode as laplace_table(), with the index of
+        its start and its posterior evaluations, and the deduplicate()d modes.
+    """
+    bounds = np.asarray(bounds, dtype=float)
+    options = {"maxfev": 3000, "xtol": 1e-4, "ftol": 1e-6} if options is None else options
+    starts = np.concatenate([np.reshape(np.asarray(extra_starts, dtype=float), (-1, len(bounds))),
+                             starting_points(n_starts, sampling, bounds, seed)])
+    likelihood_args = (tuple(ifos), float(f_lower), rate)
+
+    jobs = [(index, start, bounds, method, options, likelihood_args) for index, start in enumerate(starts)]
+    results = parallel_map(_optimize, jobs, mode=mode, max_workers=max_workers)
+    modes = deduplicate(results, bounds)
+
+    best = modes.iloc[0]
+    params = best[PARAMETER_NAMES].to_numpy(dtype=float)
+    sigma = laplace_intervals(params, load_likelihood(*likelihood_args), bounds, mode=mode, max_workers=max_workers) if intervals else None
+    return laplace_table(params, best["lp"], sigma, bounds, start=int(best["start"]), evaluations=int(best["evaluations"])), modes
+#--------------------------------------------
+
+#--------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="MCMC_data/MAP_parameters_optimized.parquet", help="parquet file of the MAP")
+    parser.add_argument("--modes", help="also write every mode to this parquet file")
+    parser.add_argument("--starts", choices=["lhs", "prior"], default="lhs", dest="sampling")
+    parser.add_argument("--n-starts", type=int, default=32)
+    parser.add_argument("--no-playground", action="store_true", help="do not also start from the Model Playground parameters")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--maxfev", type=int, default=3000, help="posterior evaluations per optimization")
+    parser.add_argument("--mode", choices=["serial", "thread", "process"], default="process")
+    parser.add_argument("--max-workers", type=int)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    map_df, modes = find_map(args.n_starts, args.sampling, extra_starts=() if args.no_playground else (PLAYGROUND_PARAMETERS,),
+                             seed=args.seed, options={"maxfev": args.maxfev, "xtol": 1e-4, "ftol": 1e-6},
+                             mode=args.mode, max_workers=args.max_workers)
+    map_df.to_parquet(args.output)
+    if args.modes:
+        modes.to_parquet(args.modes)
+
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(modes.head(10).round(4).to_string())
+    print(f"\n{len(modes)} modes from {modes['count'].sum()} starts in {time.perf_counter() - start:.0f} s, "
+          f"MAP log posterior {map_df.loc['lp', 'MAP']:.3f} written to {args.output}")
+#--------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,271 @@
-from gwosc.datasets import event_gps
-from pycbc.waveform import get_td_waveform
-from pycbc.detector import Detector
-from gwpy.timeseries import TimeSeries
-from scipy.signal import get_window
-from astropy.time import Time
-from tools.plotly_templates import *
-from tools.data_caching import *
-
-pure_data = load_pure_data()
-raw_data = load_raw_data()
-bandpass_data = load_bandpass_data()
-whitend_data = load_whitend_data()
-GW_data = load_GW_data()
-
-PSD_data = load_PSD_data()
+"""
+Gravitational wave template generation.
 
+Importing this module is cheap: pycbc, gwpy and the strain data are only 
+loaded the first time a template is generated, and the detector geometry and 
+default time grid are then cached for the rest of the process.
+"""
+import collections
+import functools
+import threading
+import numpy as np
+from tools.event_registry import event_gps
+from tools.parallel import parallel_map
 
 gps = event_gps('GW190521')
 time_center = gps
-datetime_center = Time(time_center, format='gps').utc.datetime # type: ignore
 
 ifos = ['L1', 'V1','H1']
 ########################################################################
 
-# Dictionary of Detector information used by gen_template function (purposefully outside of function as it is constant)
-det={} 
-for ifo in ifos:
-    det[ifo]=Detector(ifo)
+@functools.lru_cache(maxsize=None)
+def detectors()-> dict:
+    """
+    Return a dictionary of pycbc Detector objects used by the template functions.
+
+    Built on first use and then cached, as the detector geometry is constant.
+    """
+    from pycbc.detector import Detector
+    return {ifo: Detector(ifo) for ifo in ['L1', 'V1', 'H1']}
+
+@functools.lru_cache(maxsize=None)
+def default_time_grid()-> dict:
+    """
+    Return the default gps_time, delta_t, duration and start_time for templates.
+
+    These match the H1 strain data cropped around the event at 
+    ANALYSIS_SAMPLE_RATE, i.e. load_analysis_raw_data() (all detectors share 
+    the same dt, duration and start time, I checked this to be true). 
+    Resolved from the data on first use and then cached. Pass delta_t, 
+    duration and start_time explicitly for templates at the native rate.
+    """
+    from tools.data_caching import get_product, EVENT_WINDOW, ANALYSIS_SAMPLE_RATE
+    data = get_product('H1', crop=EVENT_WINDOW, rate=ANALYSIS_SAMPLE_RATE)
+    return {"gps_time": time_center,
+            "delta_t": data.dt.value,
+            "duration": data.duration.value,
+            "start_time": data.x0.value}
+
+def _time_grid(gps_time, delta_t, duration, start_time)-> tuple:
+    """Fill any time grid argument left as None from default_time_grid()."""
+    grid = default_time_grid() if None in (gps_time, delta_t, duration, start_time) else {}
+    return (grid["gps_time"] if gps_time is None else gps_time,
+            grid["delta_t"] if delta_t is None else delta_t,
+            grid["duration"] if duration is None else duration,
+            grid["start_time"] if start_time is None else start_time)
+
+WAVEFORM_CACHE_SIZE = 256   # number of intrinsic waveforms kept in memory
+REFERENCE_DISTANCE = 1.     # Mpc, cached waveforms are generated at this distance and rescaled
+
+MTSUN_SI = 4.925490947641267e-06   # seconds, G*M_sun/c^3
+RINGDOWN_MARGIN = 1.1              # safety factor on the estimated ringdown frequency
+
+def ringdown_frequency(m1, q)-> float:
+    """
+    Estimate the frequency (Hz) of the dominant (2,2,0) ringdown mode of a non-spinning binary.
+
+    SEOBNRv4_opt refuses to generate a waveform whose ringdown frequency is 
+    above the Nyquist frequency, which happens for low total masses at 
+    ANALYSIS_SAMPLE_RATE. Uses the non-spinning final mass and spin fits 
+    and the Berti et al. (2006) fit of the quasi-normal mode frequency.
+    """
+    total_mass = m1 * (1. + q)
+    eta = q / (1. + q)**2
+    final_spin = np.sqrt(12.) * eta - 3.871 * eta**2 + 4.028 * eta**3
+    final_mass = total_mass * (1. - (1. - np.sqrt(8./9.)) * eta - 0.4333 * eta**2 - 0.4392 * eta**3)
+    omega = 1.5251 - 1.1568 * (1. - final_spin)**0.1292
+    return omega / (2. * np.pi * final_mass * MTSUN_SI)
+
+def generation_factor(m1, q, delta_t)-> int:
+    """
+    Return the power of two by which delta_t must be divided for SEOBNRv4_opt to generate the waveform.
+
+    1 unless the ringdown frequency, with RINGDOWN_MARGIN, is above the 
+    Nyquist frequency of delta_t, see ringdown_frequency().
+    """
+    factor = 1
+    while RINGDOWN_MARGIN * ringdown_frequency(m1, q) > .5 * factor / delta_t:
+        factor *= 2
+    return factor
+
+def _decimate(values, factor)-> np.ndarray:
+    """Decimate a windowed waveform by an integer factor with an ideal low-pass in the frequency domain."""
+    n = -(-len(values) // factor)
+    spectrum = np.fft.rfft(values, n=n * factor)[:n // 2 + 1]
+    return np.fft.irfft(spectrum, n=n) / factor
+
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+class WaveformCache:
+    """
+    Thread-safe LRU cache of intrinsic waveforms, keyed on intrinsic_waveform()'s arguments.
+
+    Unlike functools.lru_cache it can be looked up and filled from outside, 
+    so gen_template_many() only sends the misses to its worker pool and 
+    keeps the waveforms generated in worker processes in this process.
+    """
+
+    def __init__(self, maxsize: int = WAVEFORM_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        """The cached waveform of key, marked as recently used, or None."""
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, waveform)-> tuple:
+        """Store a (hp, hc, epoch) waveform, evicting the least recently used, and return it read-only."""
+        hp, hc, epoch = waveform
+        hp.flags.writeable = False
+        hc.flags.writeable = False
+        with self._lock:
+            self._entries[key] = (hp, hc, epoch)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return hp, hc, epoch
+
+    def cache_info(self)-> CacheInfo:
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def cache_clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+WAVEFORM_CACHE = WaveformCache()
+
+def intrinsic_waveform(m1, q, inclination, phase, delta_t, f_lower)-> tuple:
+    """
+    Fetch from WAVEFORM_CACHE (or generate) the windowed SEOBNRv4_opt polarizations.
+
+    Only the intrinsic parameters enter the cache key. The luminosity distance 
+    only scales the amplitude, so the waveform is generated at 
+    REFERENCE_DISTANCE and rescaled by gen_template(). Sky position, 
+    polarization and time shift only affect the detector projection.
+
+    Parameters
+    ----------
+    m1 : float
+        Primary mass (Solar Masses)
+    q : float
+        Mass ratio (m2 = m1 * q)
+    inclination : float
+        Inclination angle (radians)
+    phase : float
+        Coalesence phase (radians)
+    delta_t : float
+        Time step in seconds
+    f_lower : float
+        Lower frequency cutoff in Hz
+
+    Returns
+    -------
+    tuple
+        (hp, hc, epoch): read-only plus and cross polarization arrays at 
+        REFERENCE_DISTANCE, and the start time of the waveform relative to merger.
+
+    Notes
+    -----
+    When the ringdown of the binary is above the Nyquist frequency of delta_t 
+    (low masses at ANALYSIS_SAMPLE_RATE), the waveform is generated at a 
+    power of two higher rate and decimated to delta_t, see generation_factor().
+    """
+    key = (m1, q, inclination, phase, delta_t, f_lower)
+    cached = WAVEFORM_CACHE.get(key)
+    return cached if cached is not None else WAVEFORM_CACHE.put(key, _generate_waveform(key))
+
+def _generate_waveform(key)-> tuple:
+    """Generate the intrinsic_waveform() of key = (m1, q, inclination, phase, delta_t, f_lower), without the cache."""
+    from pycbc.waveform import get_td_waveform
+    from scipy.signal import get_window
+
+    m1, q, inclination, phase, delta_t, f_lower = key
+    factor = generation_factor(m1, q, delta_t)
+    hp, hc = get_td_waveform(approximant="SEOBNRv4_opt",
+                             mass1=m1,
+                             mass2=m1 * q,
+                             distance=REFERENCE_DISTANCE,
+                             inclination=inclination,
+                             coa_phase=phase,
+                             delta_t=delta_t / factor,
+                             f_lower=f_lower) 
+    
+    hp_values = hp.numpy()*get_window(('tukey',1/4),hp.shape[0]) 
+    hc_values = hc.numpy()*get_window(('tukey',1/4),hc.shape[0]) 
+    if factor > 1:
+        hp_values, hc_values = _decimate(hp_values, factor), _decimate(hc_values, factor)
+
+    return hp_values, hc_values, float(hp.start_time)
+
+def waveform_cache_info()-> CacheInfo:
+    """Return the hits, misses, maxsize and current size of the intrinsic waveform cache."""
+    return WAVEFORM_CACHE.cache_info()
+
+FFT_WINDOW = ('tukey', 1./4.)   # window the consumers pass to TimeSeries.average_fft()
+
+@functools.lru_cache(maxsize=WAVEFORM_CACHE_SIZE)
+def intrinsic_spectrum(m1, q, inclination, phase, delta_t, f_lower, n)-> tuple:
+    """
+    Return the rFFT of a cached intrinsic waveform, zero-padded or cut to n samples.
+
+    Parameters
+    ----------
+    m1, q, inclination, phase, delta_t, f_lower : float
+        As for intrinsic_waveform().
+    n : int
+        Number of time samples of the template buffer.
+
+    Returns
+    -------
+    tuple
+        (hp_f, hc_f, epoch): read-only rFFTs of the plus and cross polarizations 
+        at REFERENCE_DISTANCE, and the start time of the waveform relative to merger.
+    """
+    (hp, hc), epoch = _sized_waveform((m1, q, inclination, phase, delta_t, f_lower, n))
+    hp_f, hc_f = np.fft.rfft(hp), np.fft.rfft(hc)
+    hp_f.flags.writeable = False
+    hc_f.flags.writeable = False
+    return hp_f, hc_f, epoch
+
+@functools.lru_cache(maxsize=16)
+def fft_normalisation(n, delta_t, window=FFT_WINDOW)-> np.ndarray:
+    """
+    Return the factors that turn a plain rFFT into TimeSeries.average_fft()*duration/2.
+
+    That is delta_t divided by the mean of the window, with the DC bin halved 
+    as gwpy only doubles the positive frequencies. Cached, read-only.
+    """
+    from scipy.signal import get_window
+
+    norm = np.full(n // 2 + 1, delta_t / np.abs(get_window(window, n)).mean())
+    norm[0] /= 2
+    norm.flags.writeable = False
+    return norm
+
+@functools.lru_cache(maxsize=16)
+def rfft_frequencies(n, delta_t)-> np.ndarray:
+    """Return the (cached, read-only) rFFT frequencies of an n sample buffer."""
+    freqs = np.fft.rfftfreq(n, delta_t)
+    freqs.flags.writeable = False
+    return freqs
 
 def gen_template(param,
-                 gps_time = time_center,
-                 delta_t =  raw_data['H1'].dt.value, # Assuming all detectors have the same dt(I checked this to be true)
-                 duration=  raw_data['H1'].duration.value, # Assuming all detectors have the same duration (I checked this to be true)
-                 start_time=raw_data['H1'].x0.value,# Assuming all detectors have the same start time (I checked this to be true)
-                 f_lower=10.) -> dict:
+                 gps_time = None,
+                 delta_t =  None,
+                 duration=  None,
+                 start_time=None,
+                 f_lower=10.,
+                 domain="time") -> dict:
     """
     Generate gravitational wave templates for multiple interferometers.
     
@@ -48,35 +280,59 @@ def gen_template(param,
     gps_time : float, optional
         GPS time for waveform generation (default: GW190521 event time)
     delta_t : float, optional
-        Time step in seconds (default: from H1 data)
+        Time step in seconds (default: 1/ANALYSIS_SAMPLE_RATE, see default_time_grid())
     duration : float, optional
         Waveform duration in seconds (default: from H1 data)
     start_time : float, optional
         Start time for waveform (default: from H1 data)
     f_lower : float, optional
         Lower frequency cutoff in Hz (default: 10.0)
+    domain : str, optional
+        "time" (default) for TimeSeries templates, or "frequency" for complex 
+        FrequencySeries, see Notes.
         
     Returns
     -------
     dict
         Dictionary with keys ['L1', 'V1', 'H1'] containing TimeSeries 
-        templates for each interferometer.
+        (or FrequencySeries) templates for each interferometer.
+
+    Notes
+    -----
+    With domain="frequency" the waveform is transformed once (and cached 
+    with it) and the antenna patterns, time shift and detector time delays 
+    are applied as phase ramps, so no time domain template is built. The 
+    result is normalised like template.average_fft(window=FFT_WINDOW)*duration/2, 
+    which is what the likelihood and SNR code compares against the data. 
+    The window is only used for that normalisation, it is not applied to 
+    the waveform. That is exact while the whole waveform from f_lower lies 
+    in the flat part of the window, the middle 3/4 of the time grid: on the
+    default 4 s grid, waveforms up to 1.4 s long before the merger, i.e. 
+    (detector frame) chirp masses above about 56 Msun at f_lower = 10 Hz, 
+    such as m1 >= 95 at q = 0.5 or any m1 >= 80 at q >= 0.8. Longer 
+    waveforms reach into the taper, which the time domain templates get 
+    from average_fft() and the frequency domain ones do not; at m1 = 80,
+    q = 0.5 the two differ by 0.5-0.8% in noise weighted norm (a mismatch
+    of 3e-5).
     """
+    from pycbc.types import TimeSeries as PyCBCTimeSeries
+    from gwpy.timeseries import TimeSeries
+
     m1, q, distance, time_shift, phase, right_ascension, declination, inclination, polarization = param
+    gps_time, delta_t, duration, start_time = _time_grid(gps_time, delta_t, duration, start_time)
+    if domain == "frequency":
+        return _gen_template_frequency(param, gps_time, delta_t, duration, start_time, f_lower)
+    if domain != "time":
+        raise ValueError(f"Unknown domain {domain!r}, expected 'time' or 'frequency'")
+
     time = gps_time + time_shift
-    m2 = m1 * q
+    det = detectors()
 
-    hp, hc = get_td_waveform(approximant="SEOBNRv4_opt",
-                             mass1=m1,
-                             mass2=m2,
-                             distance=distance,
-                             inclination=inclination,
-                             coa_phase=phase,
-                             delta_t=delta_t,
-                             f_lower=f_lower) 
-    
-    hp = hp*get_window(('tukey',1/4),hp.shape[0]) 
-    hc = hc*get_window(('tukey',1/4),hc.shape[0]) 
+    # the waveform only depends on the intrinsic parameters, distance is a rescaling
+    hp_values, hc_values, epoch = intrinsic_waveform(float(m1), float(q), float(inclination), float(phase), float(delta_t), float(f_lower))
+    scale = REFERENCE_DISTANCE / distance
+    hp = PyCBCTimeSeries(hp_values * scale, delta_t=delta_t, epoch=epoch)
+    hc = PyCBCTimeSeries(hc_values * scale, delta_t=delta_t, epoch=epoch)
 
     # Resize the signal buffer
     hp.resize(int(duration/delta_t))
@@ -98,4 +354,236 @@ def gen_template(param,
 
     return template
 
+def _gen_template_frequency(param, gps_time, delta_t, duration, start_time, f_lower)-> dict:
+    """Frequency domain branch of gen_template(), the template_spectra() as FrequencySeries."""
+    from gwpy.frequencyseries import FrequencySeries
+
+    spectra = template_spectra(param, gps_time, delta_t, duration, start_time, f_lower)
+    df = 1. / (int(duration/delta_t) * delta_t)
+    return {ifo: FrequencySeries(h_f, f0=0, df=df, unit="s", name=ifo, epoch=start_time) for ifo, h_f in zip(ifos, spectra)}
+
+
+
+SIDEREAL_DAY = 86164.0905   # seconds
+SPEED_OF_LIGHT = 299792458. # m/s
+
+def detector_projections(right_ascension, declination, polarization, time, ifos=ifos)-> tuple:
+    """
+    Compute antenna patterns and time delays for many sky positions at once.
+
+    Vectorized equivalent of Detector.antenna_pattern() and 
+    Detector.time_delay_from_earth_center() over samples and detectors. 
+    Greenwich sidereal time is evaluated once and advanced linearly, which 
+    is exact to well below a microradian over the time shifts used here.
+
+    Parameters
+    ----------
+    right_ascension, declination, polarization : array-like
+        Sky position and polarization angles (radians), shape (N,).
+    time : array-like
+        GPS times of the signal at the Earth's centre, shape (N,).
+    ifos : list of str, optional
+        Interferometers to project onto (default: ['L1', 'V1', 'H1']).
+
+    Returns
+    -------
+    tuple
+        (fp, fc, time_delay), each an array of shape (N, len(ifos)).
+    """
+    right_ascension, declination, polarization, time = np.broadcast_arrays(*(np.atleast_1d(np.asarray(a, dtype=float)) for a in (right_ascension, declination, polarization, time)))
+
+    det = detectors()
+    reference = float(time[0])
+    gmst = det[ifos[0]].gmst_estimate(reference) + 2 * np.pi * (time - reference) / SIDEREAL_DAY
+    gha = gmst - right_ascension
+
+    cosgha, singha = np.cos(gha), np.sin(gha)
+    cosdec, sindec = np.cos(declination), np.sin(declination)
+    cospsi, sinpsi = np.cos(polarization), np.sin(polarization)
+
+    x = np.stack([-cospsi * singha - sinpsi * cosgha * sindec,
+                  -cospsi * cosgha + sinpsi * singha * sindec,
+                   sinpsi * cosdec], axis=-1)
+    y = np.stack([ sinpsi * singha - cospsi * cosgha * sindec,
+                   sinpsi * cosgha + cospsi * singha * sindec,
+                   cospsi * cosdec], axis=-1)
+    ehat = np.stack([cosdec * cosgha, -cosdec * singha, sindec], axis=-1)
+
+    responses = np.stack([det[ifo].response for ifo in ifos])   # (n_ifo, 3, 3)
+    locations = np.stack([det[ifo].location for ifo in ifos])   # (n_ifo, 3)
+
+    dx = np.einsum('dij,nj->ndi', responses, x)
+    dy = np.einsum('dij,nj->ndi', responses, y)
+    fp = np.einsum('ni,ndi->nd', x, dx) - np.einsum('ni,ndi->nd', y, dy)
+    fc = np.einsum('ni,ndi->nd', x, dy) + np.einsum('ni,ndi->nd', y, dx)
+    time_delay = -np.einsum('di,ni->nd', locations, ehat) / SPEED_OF_LIGHT
+
+    return fp, fc, time_delay
+
+def template_spectra(param,
+                     gps_time = None,
+                     delta_t =  None,
+                     duration=  None,
+                     start_time=None,
+                     f_lower=10.,
+                     ifos=ifos,
+                     bins=None) -> np.ndarray:
+    """
+    Frequency domain templates of one parameter set, as a plain complex array.
+
+    The array core of gen_template(..., domain="frequency") for code that 
+    evaluates many templates, like the likelihood: the cached spectrum of 
+    the intrinsic waveform is projected with detector_projections() and 
+    shifted with a phase ramp, without building any gwpy or pycbc objects.
+
+    Parameters
+    ----------
+    param : array-like
+        [m1, q, distance, time_shift, phase, ra, dec, inclination, polarization]
+    gps_time, delta_t, duration, start_time, f_lower : float, optional
+        As for gen_template().
+    ifos : list of str, optional
+        Interferometers to project onto (default: ['L1', 'V1', 'H1']).
+    bins : array-like of int, optional
+        Only project onto these rFFT bins, e.g. the nodes of a relative 
+        binning likelihood (default: all).
+
+    Returns
+    -------
+    numpy.ndarray
+        Complex array of shape (len(ifos), int(duration/delta_t)//2 + 1), 
+        or (len(ifos), len(bins)), normalised like 
+        gen_template(param, domain="frequency")[ifo].value.
+    """
+    m1, q, distance, time_shift, phase, right_ascension, declination, inclination, polarization = param
+    gps_time, delta_t, duration, start_time = _time_grid(gps_time, delta_t, duration, start_time)
+    n = int(duration/delta_t)
+
+    hp_f, hc_f, epoch = intrinsic_spectrum(float(m1), float(q), float(inclination), float(phase), float(delta_t), float(f_lower), n)
+    fp, fc, time_delay = detector_projections(right_ascension, declination, polarization, gps_time + time_shift, ifos)
+    freqs, norm = rfft_frequencies(n, delta_t), fft_normalisation(n, delta_t)
+    if bins is not None:
+        hp_f, hc_f, freqs, norm = hp_f[bins], hc_f[bins], freqs[bins], norm[bins]
+
+    # same shift as gen_template's cyclic_time_shift, with the small terms added last
+    shift = epoch + (gps_time - start_time) + time_shift + time_delay[0]
+    norm = norm * (REFERENCE_DISTANCE / distance)
+    return (fp[0, :, None] * hp_f + fc[0, :, None] * hc_f) * norm * np.exp(-2j * np.pi * freqs * shift[:, None])
+
+def _sized_waveform(job)-> tuple:
+    """Cached polarizations of job = (m1, q, inclination, phase, delta_t, f_lower, n), zero-padded or cut to n samples."""
+    *key, n = job
+    return _fit_waveform(intrinsic_waveform(*key), n)
+
+def _fit_waveform(waveform, n)-> tuple:
+    """(hp, hc, epoch) as an array of shape (2, n), zero-padded or cut, and the epoch."""
+    hp, hc, epoch = waveform
+    polarizations = np.zeros((2, n))
+    length = min(n, len(hp))
+    polarizations[0, :length] = hp[:length]
+    polarizations[1, :length] = hc[:length]
+    return polarizations, epoch
+
+def gen_template_many(params,
+                      gps_time = None,
+                      delta_t =  None,
+                      duration=  None,
+                      start_time=None,
+                      f_lower=10.,
+                      ifos=ifos,
+                      mode="process",
+                      max_workers=None,
+                      chunk_size=64,
+                      domain="time",
+                      bins=None,
+                      worker_counts=None) -> np.ndarray:
+    """
+    Generate gravitational wave templates for many parameter sets at once.
+
+    Batched version of gen_template() for posterior predictive bands, likelihood 
+    sweeps and walker ensembles. Each distinct set of intrinsic parameters is 
+    generated once: the waveform cache of this process is checked first and 
+    only the missing waveforms are spread over a worker pool. The 
+    antenna patterns, time delays, distance scaling and time shifts are then 
+    applied to all samples and detectors with array operations, the shifts 
+    as phase ramps in the frequency domain.
+
+    Parameters
+    ----------
+    params : array-like
+        Array of shape (N, 9), each row 
+        [m1, q, distance, time_shift, phase, ra, dec, inclination, polarization]
+    gps_time, delta_t, duration, start_time, f_lower : float, optional
+        As for gen_template().
+    ifos : list of str, optional
+        Interferometers to project onto (default: ['L1', 'V1', 'H1']).
+    mode : str, optional
+        Worker pool used for waveform generation: "process" (default), "thread" 
+        or "serial", see tools.parallel.parallel_map().
+    max_workers : int, optional
+        Number of workers in the pool.
+    chunk_size : int, optional
+        Number of samples projected at a time, bounds the temporary memory use.
+    domain : str, optional
+        "time" (default) or "frequency", as for gen_template().
+    bins : array-like of int, optional
+        With domain="frequency", only project onto these rFFT bins 
+        (default: all), see template_spectra().
+    worker_counts : collections.Counter, optional
+        Incremented by the number of waveforms each worker generated, see 
+        tools.parallel.parallel_map().
+
+    Returns
+    -------
+    numpy.ndarray
+        Contiguous float64 array of shape (N, len(ifos), int(duration/delta_t)), 
+        in the order of ifos. Row i matches gen_template(params[i])[ifo].value.
+        With domain="frequency", a complex128 array of shape 
+        (N, len(ifos), int(duration/delta_t)//2 + 1) matching 
+        gen_template(params[i], domain="frequency")[ifo].value, or 
+        (N, len(ifos), len(bins)) with bins.
+    """
+    if domain not in ("time", "frequency"):
+        raise ValueError(f"Unknown domain {domain!r}, expected 'time' or 'frequency'")
+    if bins is not None and domain != "frequency":
+        raise ValueError("bins can only be selected with domain='frequency'")
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    gps_time, delta_t, duration, start_time = _time_grid(gps_time, delta_t, duration, start_time)
+    m1, q, distance, time_shift, phase, right_ascension, declination, inclination, polarization = params.T
+    n = int(duration/delta_t)
+
+    # only distinct intrinsic parameters need a waveform
+    intrinsic, inverse = np.unique(params[:, [0, 1, 7, 4]], axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    keys = [(m1_, q_, incl_, phase_, float(delta_t), float(f_lower)) for m1_, q_, incl_, phase_ in intrinsic.tolist()]
+    # the cache lives in this process, only the misses go to the workers
+    found = {key: WAVEFORM_CACHE.get(key) for key in keys}
+    misses = [key for key, waveform in found.items() if waveform is None]
+    for key, waveform in zip(misses, parallel_map(_generate_waveform, misses, mode=mode, max_workers=max_workers, counts=worker_counts)):
+        found[key] = WAVEFORM_CACHE.put(key, waveform)
+    waveforms = [_fit_waveform(found[key], n) for key in keys]
+
+    spectra = np.fft.rfft(np.stack([polarizations for polarizations, _ in waveforms]), axis=-1)  # (n_unique, 2, n_freq)
+    epochs = np.array([epoch for _, epoch in waveforms])[inverse]
+    freqs = rfft_frequencies(n, delta_t)
+
+    time = gps_time + time_shift
+    fp, fc, time_delay = detector_projections(right_ascension, declination, polarization, time, ifos)
+    shift = epochs[:, None] + (gps_time - start_time) + time_shift[:, None] + time_delay  # same shift as gen_template's cyclic_time_shift
+    scale = REFERENCE_DISTANCE / distance
+    if domain == "frequency":
+        spectra = spectra * fft_normalisation(n, delta_t)
+    if bins is not None:
+        spectra, freqs = spectra[..., bins], freqs[bins]
+
+    templates = np.empty((len(params), len(ifos), n if domain == "time" else len(freqs)), 
+                         dtype=float if domain == "time" else complex)
+    for first in range(0, len(params), chunk_size):
+        rows = slice(first, first + chunk_size)
+        hp_f = spectra[inverse[rows], 0] * scale[rows, None]
+        hc_f = spectra[inverse[rows], 1] * scale[rows, None]
+        h_f = fp[rows, :, None] * hp_f[:, None, :] + fc[rows, :, None] * hc_f[:, None, :]
+        h_f *= np.exp(-2j * np.pi * freqs * shift[rows, :, None])
+        templates[rows] = np.fft.irfft(h_f, n=n, axis=-1) if domain == "time" else h_f
 
+    return templates
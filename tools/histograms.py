@@ -0,0 +1,343 @@
+"""
+Precomputed 2D histograms of the posterior samples for the Posterior Visualization page.
+
+The chain is read twice in chunks with tools.postprocess.iter_chain(): once
+for the range of every parameter, once to digitize every column on its
+edges and count all 36 parameter pairs with one bincount each. The counts
+are stored as uint32 grids with the edges and the marginals in
+
+    MCMC_data/posterior_histograms.npz
+
+so the page looks up a pair instead of loading the 774,888 samples:
+
+    python -m tools.histograms --input MCMC_data/mcmc_df_with_log_post.parquet [--bins 50] [--levels 4]
+
+The bins are those of np.histogram2d(x, y, bins=50) on the full chain: equal
+width between the minimum and the maximum of every parameter, the last bin
+closed on the right.
+
+For zooming, HistogramPyramid holds the same counts at 8 times finer bins
+(400 per parameter, MCMC_data/posterior_pyramid.npz) and every coarser level
+down to the 50 bins, each summed from the one below. A zoomed view is a
+slice of the coarsest level that still has about 50 bins across the visible
+range, so its cost depends on the visible bins only.
+"""
+import argparse
+import functools
+import itertools
+import os
+
+import numpy as np
+
+from tools.posterior import PARAMETER_NAMES
+
+HISTOGRAM_FILE = "MCMC_data/posterior_histograms.npz"
+CHAIN_FILE = "MCMC_data/mcmc_df_with_log_post.parquet"
+HISTOGRAM_BINS = 50
+PYRAMID_FILE = "MCMC_data/posterior_pyramid.npz"
+PYRAMID_LEVELS = 4   # resolutions of the pyramid, HISTOGRAM_BINS times 1, 2, 4 and 8
+PAIRS = list(itertools.combinations(range(len(PARAMETER_NAMES)), 2))   # (i, j) with i < j, in the order of the cube
+
+#--------------------------------------------
+def digitize(values: np.ndarray, edges: np.ndarray)-> np.ndarray:
+    """
+    Bin index of every value as np.histogram() counts it, -1 outside the edges.
+
+    Bins are closed on the left, the last one on both sides.
+    """
+    index = np.searchsorted(edges, values, side="right") - 1
+    index[values == edges[-1]] = len(edges) - 2
+    index[(index < 0) | (index >= len(edges) - 1) | ~np.isfinite(values)] = -1
+    return index
+#--------------------------------------------
+
+#--------------------------------------------
+def credible_levels(density: np.ndarray, probabilities=(0.6826894921370859, 0.9544997361036416))-> np.ndarray:
+    """
+    Highest density levels of a binned density.
+
+    Parameters
+    ----------
+    density : numpy.ndarray
+        Counts or density of equal bins, any shape.
+    probabilities : sequence of float, optional
+        Enclosed probabilities (default: the 1 and 2 sigma 68.3% and 95.4%).
+
+    Returns
+    -------
+    numpy.ndarray
+        For every probability, the density above which the bins hold that
+        fraction of the total, as contour levels.
+    """
+    values = np.sort(np.asarray(density, dtype=float).ravel())[::-1]
+    enclosed = np.cumsum(values) / values.sum()
+    index = np.minimum(np.searchsorted(enclosed, probabilities), len(values) - 1)
+    return values[index]
+#--------------------------------------------
+
+#--------------------------------------------
+def bin_labels(edges: np.ndarray, decimals: int)-> np.ndarray:
+    """Hover labels "low - high" of every bin, the edges rounded to decimals."""
+    rounded = np.round(edges, decimals=decimals).astype(str)
+    return np.char.add(np.char.add(rounded[:-1], " - "), rounded[1:])
+#--------------------------------------------
+
+#--------------------------------------------
+class HistogramCube:
+    """
+    Counts of every parameter pair of a chain on fixed bins.
+
+    Parameters
+    ----------
+    edges : numpy.ndarray
+        Bin edges of every parameter, shape (n_params, bins + 1).
+    counts : numpy.ndarray
+        uint32 counts of every pair in PAIRS, shape (n_pairs, bins, bins),
+        the first axis binned on the first parameter of the pair.
+    marginals : numpy.ndarray
+        uint32 counts of every parameter, shape (n_params, bins).
+    names : list, optional
+        Parameter names, in the order of the edges (default: PARAMETER_NAMES).
+    """
+
+    def __init__(self, edges: np.ndarray, counts: np.ndarray, marginals: np.ndarray, names=PARAMETER_NAMES):
+        self.edges = np.asarray(edges, dtype=float)
+        self.counts = np.asarray(counts, dtype=np.uint32)
+        self.marginals = np.asarray(marginals, dtype=np.uint32)
+        self.names = list(names)
+        self._pair_index = {pair: k for k, pair in enumerate(PAIRS)}
+
+    def _index(self, name)-> int:
+        return name if isinstance(name, (int, np.integer)) else self.names.index(name)
+
+    def pair(self, x, y)-> tuple:
+        """
+        Histogram of two parameters, by name or column.
+
+        Returns
+        -------
+        tuple
+            (counts, xedges, yedges) as np.histogram2d(x, y): counts[i, j]
+            is the number of samples in bin i of x and bin j of y.
+        """
+        i, j = self._index(x), self._index(y)
+        if i == j:
+            raise ValueError(f"Pick two different parameters, got {self.names[i]} twice")
+        counts = self.counts[self._pair_index[(min(i, j), max(i, j))]]
+        return (counts if i < j else counts.T), self.edges[i], self.edges[j]
+
+    def marginal(self, x)-> tuple:
+        """Histogram (counts, edges) of one parameter, by name or column."""
+        i = self._index(x)
+        return self.marginals[i], self.edges[i]
+
+    def coarsen(self, factor: int = 2)-> "HistogramCube":
+        """The same counts on bins factor times wider, the number of bins must be a multiple of factor."""
+        bins = self.marginals.shape[1] // factor
+        if bins * factor != self.marginals.shape[1]:
+            raise ValueError(f"{self.marginals.shape[1]} bins can not be merged by {factor}")
+        counts = self.counts.reshape(len(self.counts), bins, factor, bins, factor).sum(axis=(2, 4), dtype=np.uint32)
+        marginals = self.marginals.reshape(len(self.marginals), bins, factor).sum(axis=2, dtype=np.uint32)
+        return HistogramCube(self.edges[:, ::factor], counts, marginals, self.names)
+
+    def save(self, path: str = HISTOGRAM_FILE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, edges=self.edges, counts=self.counts, marginals=self.marginals, names=np.array(self.names))
+
+    @classmethod
+    def load(cls, path: str = HISTOGRAM_FILE)-> "HistogramCube":
+        with np.load(path) as f:
+            return cls(f["edges"], f["counts"], f["marginals"], f["names"].tolist())
+#--------------------------------------------
+
+#--------------------------------------------
+def _window(edges: np.ndarray, span)-> slice:
+    """Bins of edges that overlap span = (low, high), all of them for None."""
+    n = len(edges) - 1
+    if span is None:
+        return slice(0, n)
+    start = int(np.clip(np.searchsorted(edges, span[0], side="right") - 1, 0, n - 1))
+    stop = int(np.clip(np.searchsorted(edges, span[1], side="left"), start + 1, n))
+    return slice(start, stop)
+#--------------------------------------------
+
+#--------------------------------------------
+class HistogramPyramid:
+    """
+    Histogram cubes of the same chain at resolutions halving from a fine base.
+
+    Parameters
+    ----------
+    base : HistogramCube
+        The finest counts.
+    n_levels : int, optional
+        Number of resolutions, the base included (default: PYRAMID_LEVELS).
+
+    Notes
+    -----
+    levels[0] is the coarsest cube and levels[-1] the base. The coarser
+    levels are summed from the base when the pyramid is built or read, only
+    the base is stored.
+    """
+
+    def __init__(self, base: HistogramCube, n_levels: int = PYRAMID_LEVELS):
+        self.levels = [base]
+        for _ in range(n_levels - 1):
+            self.levels.insert(0, self.levels[0].coarsen(2))
+        self.names = base.names
+
+    def level(self, x, y, xrange=None, yrange=None, bins: int = HISTOGRAM_BINS)-> int:
+        """Index of the coarsest level with at least bins bins across the visible range of both parameters."""
+        needed = 1.
+        for column, span in ((self.levels[0]._index(x), xrange), (self.levels[0]._index(y), yrange)):
+            edges = self.levels[0].edges[column]
+            if span is not None and span[1] > span[0]:
+                needed = max(needed, (edges[-1] - edges[0]) / (span[1] - span[0]))
+        sizes = np.array([cube.marginals.shape[1] for cube in self.levels])
+        return int(min(np.searchsorted(sizes, needed * bins * (1 - 1e-9)), len(self.levels) - 1))
+
+    def region(self, x, y, xrange=None, yrange=None, bins: int = HISTOGRAM_BINS)-> tuple:
+        """
+        Counts of two parameters over a visible range, at the resolution of level().
+
+        Parameters
+        ----------
+        x, y : str or int
+            Parameter names or columns.
+        xrange, yrange : tuple, optional
+            (low, high) visible range of each parameter (default: all).
+        bins : int, optional
+            Smallest number of bins wanted across the visible range (default: 50).
+
+        Returns
+        -------
+        tuple
+            (counts, xedges, yedges, xmarginal, ymarginal), counts as
+            HistogramCube.pair() over the bins overlapping the ranges, and
+            the 1D counts of each parameter on the same bins.
+        """
+        cube = self.levels[self.level(x, y, xrange, yrange, bins)]
+        counts, xedges, yedges = cube.pair(x, y)
+        xs, ys = _window(xedges, xrange), _window(yedges, yrange)
+        return (counts[xs, ys], xedges[xs.start:xs.stop + 1], yedges[ys.start:ys.stop + 1],
+                cube.marginal(x)[0][xs], cube.marginal(y)[0][ys])
+
+    def save(self, path: str = PYRAMID_FILE):
+        self.levels[-1].save(path)
+
+    @classmethod
+    def load(cls, path: str = PYRAMID_FILE, n_levels: int = PYRAMID_LEVELS)-> "HistogramPyramid":
+        return cls(HistogramCube.load(path), n_levels)
+#--------------------------------------------
+
+#--------------------------------------------
+def _count_pair(job)-> np.ndarray:
+    """Flat counts of one pair (i, j) from the bin indices of every column, -1 outside the edges."""
+    index, i, j, bins = job
+    inside = (index[:, i] >= 0) & (index[:, j] >= 0)
+    return np.bincount(index[inside, i] * bins + index[inside, j], minlength=bins * bins)
+#--------------------------------------------
+
+#--------------------------------------------
+def build_histogram_cube(path: str = CHAIN_FILE, bins: int = HISTOGRAM_BINS, mode: str | None = None, max_workers: int | None = None,
+                         **kwargs)-> HistogramCube:
+    """
+    Count all parameter pairs of a chain in two streaming passes.
+
+    Every chunk of the chain is digitized once, then the pairs are counted
+    from the shared bin indices in parallel.
+
+    Parameters
+    ----------
+    path : str
+        The chain, see tools.postprocess.iter_chain().
+    bins : int, optional
+        Number of bins of every parameter (default: 50).
+    mode, max_workers : optional
+        Pool counting the pairs, see tools.parallel.parallel_map(). The
+        default thread pool shares the bin indices without copies.
+    **kwargs
+        Passed on to iter_chain(), e.g. burn_in, thin and chunk_steps.
+    """
+    from tools.postprocess import iter_chain
+    from tools.parallel import parallel_map
+
+    n = len(PARAMETER_NAMES)
+    low, high = np.full(n, np.inf), np.full(n, -np.inf)
+    for params, *_ in iter_chain(path, **kwargs):
+        low = np.fmin(low, np.nanmin(params, axis=0, initial=np.inf))
+        high = np.fmax(high, np.nanmax(params, axis=0, initial=-np.inf))
+    if not np.all(np.isfinite(low)):
+        raise ValueError(f"No samples in {path}")
+    # as np.histogram, an empty range is widened by one half on both sides
+    empty = low == high
+    low[empty], high[empty] = low[empty] - .5, high[empty] + .5
+    edges = np.linspace(low, high, bins + 1, axis=1)
+
+    counts = np.zeros((len(PAIRS), bins, bins), dtype=np.uint32)
+    marginals = np.zeros((n, bins), dtype=np.uint32)
+    for params, *_ in iter_chain(path, **kwargs):
+        index = np.stack([digitize(column, column_edges) for column, column_edges in zip(params.T, edges)], axis=1)
+        for i in range(n):
+            inside = index[:, i] >= 0
+            marginals[i] += np.bincount(index[inside, i], minlength=bins).astype(np.uint32)
+        pair_counts = parallel_map(_count_pair, [(index, i, j, bins) for i, j in PAIRS], mode=mode, max_workers=max_workers)
+        for k, flat in enumerate(pair_counts):
+            counts[k] += flat.astype(np.uint32).reshape(bins, bins)
+    return HistogramCube(edges, counts, marginals)
+#--------------------------------------------
+
+#--------------------------------------------
+@functools.lru_cache(maxsize=None)
+def load_histogram_cube(path: str = HISTOGRAM_FILE, chain: str = CHAIN_FILE)-> HistogramCube:
+    """
+    Read the histogram cube once per process.
+
+    If it is missing it is built from the memory-mapped samples of
+    tools.samples (converted from the parquet chain the first time) and
+    written.
+    """
+    if not os.path.exists(path):
+        from tools.samples import load_posterior_samples
+        build_histogram_cube(load_posterior_samples(chain=chain).path).save(path)
+    return HistogramCube.load(path)
+#--------------------------------------------
+
+#--------------------------------------------
+@functools.lru_cache(maxsize=None)
+def load_histogram_pyramid(path: str = PYRAMID_FILE, chain: str = CHAIN_FILE, n_levels: int = PYRAMID_LEVELS)-> HistogramPyramid:
+    """Read the histogram pyramid once per process, building and writing its base as load_histogram_cube() if it is missing."""
+    if not os.path.exists(path):
+        from tools.samples import load_posterior_samples
+        base = build_histogram_cube(load_posterior_samples(chain=chain).path, bins=HISTOGRAM_BINS * 2**(n_levels - 1))
+        HistogramPyramid(base, n_levels).save(path)
+    return HistogramPyramid.load(path, n_levels)
+#--------------------------------------------
+
+#--------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default=CHAIN_FILE, help="checkpoint file of tools.run_sampler or parquet chain")
+    parser.add_argument("--name", default="mcmc", help="group of the run in a checkpoint file")
+    parser.add_argument("--burn-in", type=int, dest="burn_in")
+    parser.add_argument("--thin", type=int)
+    parser.add_argument("--bins", type=int, default=HISTOGRAM_BINS)
+    parser.add_argument("--output", default=HISTOGRAM_FILE)
+    parser.add_argument("--levels", type=int, default=PYRAMID_LEVELS, help="resolutions of the pyramid, 0 to skip it")
+    parser.add_argument("--pyramid", default=PYRAMID_FILE, help="pyramid output")
+    args = parser.parse_args()
+
+    chain = dict(name=args.name, burn_in=args.burn_in, thin=args.thin)
+    cube = build_histogram_cube(args.input, bins=args.bins, **chain)
+    cube.save(args.output)
+    print(f"{int(cube.marginals[0].sum())} samples, {len(PAIRS)} pairs of {args.bins}x{args.bins} bins, "
+          f"written {args.output} ({os.path.getsize(args.output) / 1024:.0f} kB)")
+    if args.levels > 0:
+        base_bins = args.bins * 2**(args.levels - 1)
+        HistogramPyramid(build_histogram_cube(args.input, bins=base_bins, **chain), args.levels).save(args.pyramid)
+        print(f"pyramid of {args.levels} levels up to {base_bins}x{base_bins} bins, "
+              f"written {args.pyramid} ({os.path.getsize(args.pyramid) / 2**20:.1f} MB)")
+#--------------------------------------------
+
+if __name__ == "__main__":
+    main()
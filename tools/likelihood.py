@@ -0,0 +1,476 @@
+"""
+Frequency domain Gaussian likelihood for the parameter estimation.
+
+The shipped version of the log likelihood shown on the Statistical Sampling
+page. Everything that does not depend on the parameters (the data spectrum,
+the inverse PSD weights and df) is computed once, as plain contiguous arrays,
+and the inner products of every detector are evaluated in one vectorized
+kernel. Templates come straight from template_spectra(), the array core of 
+gen_template(..., domain="frequency").
+
+MarginalizedLikelihood wraps it to integrate the coalescence phase, the
+luminosity distance and the time shift out analytically, so the sampler only
+explores the remaining parameters; they are drawn back per sample in
+post-processing.
+"""
+import functools
+import numpy as np
+from tools.gen_template_function import template_spectra, gen_template_many
+
+SAMPLING_IFOS = ('L1', 'H1') # Virgo was excluded from the MCMC sampling, see the Statistical Sampling page
+MARGINALIZABLE = {"distance": 2, "time": 3, "phase": 4}   # column of each parameter that can be marginalized over
+DISTANCE_BOUNDS = (100., 10000.)   # Mpc, range of the distance prior when it is marginalized over
+TIME_SHIFT_BOUNDS = (0., .05)      # s, range of the time shift prior when it is marginalized over, covers the posterior (MAP at 0.011 s)
+
+#--------------------------------------------
+class FrequencyDomainLikelihood:
+    """
+    Gaussian log likelihood of strain data given a template, in the frequency domain.
+
+    Implements, summed over detectors,
+
+        log L = <s|h> - <h|h>/2,    <a|b> = 4 df Re sum_{f >= f_lower} a(f) b*(f) / S(f)
+
+    with the same normalisation as the page's reference loglikelihood(). The
+    data is masked below f_lower and pre-multiplied by 4 df / S(f) at
+    construction, so an evaluation is two weighted sums over one
+    (n_ifo, n_freq) array and no gwpy series or astropy units are built.
+
+    Parameters
+    ----------
+    data_f : dict
+        Dictionary of data FrequencySeries keyed by interferometer, normalised
+        like TimeSeries.average_fft(window=('tukey', 1/4))*duration/2.
+    psd : dict
+        Dictionary of PSD FrequencySeries keyed by interferometer, interpolated
+        onto the data frequencies.
+    time_grid : dict
+        The delta_t, duration and start_time of the data, passed on to
+        template_spectra() so templates share the data's frequencies.
+    ifos : sequence of str, optional
+        Interferometers to include (default: SAMPLING_IFOS).
+    f_lower : float, optional
+        Lower frequency cutoff in Hz, of the inner products and of the
+        templates (default: 10.0).
+    """
+
+    def __init__(self, data_f: dict, psd: dict, time_grid: dict, ifos=SAMPLING_IFOS, f_lower: float = 10.):
+        self.ifos = list(ifos)
+        self.f_lower = float(f_lower)
+        self.time_grid = dict(time_grid)
+
+        freqs = data_f[self.ifos[0]].frequencies.value
+        self.df = freqs[1] - freqs[0]
+        self.kmin = int(np.searchsorted(freqs, self.f_lower))
+        self.frequencies = np.ascontiguousarray(freqs[self.kmin:])
+
+        psd_values = np.stack([np.interp(self.frequencies, psd[ifo].frequencies.value, psd[ifo].value) for ifo in self.ifos])
+        data_values = np.stack([data_f[ifo].value[self.kmin:] for ifo in self.ifos])
+
+        self.weights = np.ascontiguousarray(4 * self.df / psd_values)               # (n_ifo, n_freq), real
+        self.weighted_data = np.ascontiguousarray(data_values * self.weights)       # (n_ifo, n_freq), complex
+        self.data_norm = np.real(np.sum(data_values * data_values.conj() * self.weights, axis=-1)) # <s|s> per detector
+
+    def inner_products(self, h_f: np.ndarray)-> tuple:
+        """
+        Evaluate <h|h> and the complex <s|h> for every detector.
+
+        Parameters
+        ----------
+        h_f : numpy.ndarray
+            Complex templates of shape (..., n_ifo, n_freq) on the full rFFT
+            frequencies of the data (the bins below f_lower are skipped), in
+            the order of self.ifos.
+
+        Returns
+        -------
+        tuple
+            (hh, sh): real <h|h> and complex sum 4 df s h*/S, each of shape
+            (..., n_ifo). <s|h> is the real part of sh.
+        """
+        h_f = h_f[..., self.kmin:]
+        hh = np.einsum('...df,df->...d', h_f.real**2 + h_f.imag**2, self.weights)
+        sh = np.einsum('...df,df->...d', h_f.conj(), self.weighted_data)
+        return hh, sh
+
+    def loglikelihood_from_templates(self, h_f: np.ndarray)-> np.ndarray:
+        """Log likelihood of templates of shape (..., n_ifo, n_freq), summed over detectors."""
+        hh, sh = self.inner_products(h_f)
+        return np.sum(sh.real - hh / 2, axis=-1)
+
+    def template(self, param)-> np.ndarray:
+        """Frequency domain template of one parameter set, as an (n_ifo, n_freq) array."""
+        return template_spectra(param, f_lower=self.f_lower, ifos=self.ifos, **self.time_grid)
+
+    def templates(self, params, **kwargs)-> np.ndarray:
+        """Frequency domain templates of many parameter sets, an (N, n_ifo, n_freq) array, see gen_template_many()."""
+        return gen_template_many(params, f_lower=self.f_lower, ifos=self.ifos, domain="frequency", **self.time_grid, **kwargs)
+
+    def __call__(self, param)-> float:
+        """
+        Return the log likelihood of one parameter set.
+
+        Parameters
+        ----------
+        param : array-like
+            [m1, q, distance, time_shift, phase, ra, dec, inclination, polarization]
+
+        Returns
+        -------
+        float
+            The log likelihood, or -inf if it is not finite.
+        """
+        logl = float(self.loglikelihood_from_templates(self.template(param)))
+        return logl if np.isfinite(logl) else -np.inf
+#--------------------------------------------
+
+#--------------------------------------------
+@functools.lru_cache(maxsize=None)
+def load_likelihood(ifos=SAMPLING_IFOS, f_lower: float = 10., rate="analysis")-> FrequencyDomainLikelihood:
+    """
+    Build the likelihood of the GW190521 data, as set up on the Statistical Sampling page.
+
+    The data is bandpassed, cropped to the 4 seconds around the event and
+    Fourier transformed with the Tukey window; the PSD is the Welch PSD of
+    the full 32 seconds. Built once per process and then cached.
+
+    Parameters
+    ----------
+    ifos : tuple of str, optional
+        Interferometers to include (default: SAMPLING_IFOS).
+    f_lower : float, optional
+        Lower frequency cutoff in Hz (default: 10.0).
+    rate : float, str or None, optional
+        Sample rate of the data and templates: "analysis" (default) for
+        ANALYSIS_SAMPLE_RATE, None for the native rate, or a rate in Hz.
+
+    Returns
+    -------
+    FrequencyDomainLikelihood
+        The likelihood, callable on a parameter list.
+    """
+    from tools.data_caching import get_product, get_spectrum, PROCESSING_PARAMS, EVENT_WINDOW, ANALYSIS_SAMPLE_RATE
+
+    rate = ANALYSIS_SAMPLE_RATE if rate == "analysis" else rate
+    data_f, psd = {}, {}
+    for ifo in ifos:
+        data = get_product(ifo, band=PROCESSING_PARAMS["bandpass"], crop=EVENT_WINDOW, rate=rate)
+        data_f[ifo] = data.average_fft(window=('tukey', 1./4.)) * data.duration.value / 2
+        psd[ifo] = get_spectrum(ifo, "psd", rate=rate)
+
+    time_grid = {"delta_t": data.dt.value, "duration": data.duration.value, "start_time": data.x0.value}
+    return FrequencyDomainLikelihood(data_f, psd, time_grid, ifos=ifos, f_lower=f_lower)
+#--------------------------------------------
+
+#--------------------------------------------
+def _log_i0(x):
+    """log I0(x) of the modified Bessel function, without overflow for large x."""
+    from scipy.special import i0e
+    return np.log(i0e(x)) + np.abs(x)
+#--------------------------------------------
+
+#--------------------------------------------
+class MarginalizedLikelihood:
+    """
+    Gaussian log likelihood marginalized over any of the coalescence phase, luminosity distance and time shift.
+
+    The templates only depend on the phase through an overall factor 
+    exp(2i phase) (SEOBNRv4_opt has only the dominant (2, 2) mode) and on the 
+    distance through a factor 1/distance. With z = sum over detectors of the 
+    complex <s|h> and hh = <h|h> of a template at phase 0, the phase marginal
+    of a uniform phase prior is 
+
+        log L = log I0(|z|) - hh/2
+
+    For the distance, z and hh are evaluated once at the reference distance
+    D_ref = distance_bounds[1], so that at a distance D they are z u and 
+    hh u^2 with u = D_ref / D, and
+
+        log L = log int p(D) exp(Re(z) u - hh u^2 / 2) dD
+
+    (with I0(|z| u) in place of exp(Re(z) u) when the phase is marginalized 
+    as well), over the volume prior p(D) ~ D^2 on distance_bounds. The 
+    integral is a function of two numbers only; it is tabulated at 
+    construction on a grid of rho = sqrt(hh) and x = z / rho, the optimal 
+    and the normalised matched filter SNR at D_ref, and read off a bicubic 
+    spline. Points outside the table are integrated directly.
+
+    A time shift t multiplies every detector's template by exp(-2i pi f t),
+    so z for all shifts on a regular grid is one inverse FFT of
+    sum_d s_d h_d* 4 df / S_d, oversampled by zero padding; hh does not 
+    depend on t. The marginals above are then evaluated at every grid time 
+    inside time_bounds and averaged over the uniform time prior 
+    (time_mode="marginalize") or maximized over (time_mode="maximize").
+    The cost of the transform is set by the padded length, not by how many 
+    shifts are resolved.
+
+    Parameters
+    ----------
+    likelihood : FrequencyDomainLikelihood
+        The likelihood to marginalize.
+    marginalize : sequence of str, optional
+        Parameters to marginalize over, any of MARGINALIZABLE (default: both).
+    distance_bounds : tuple of float, optional
+        Range of the distance prior in Mpc (default: DISTANCE_BOUNDS).
+    n_distance : int, optional
+        Number of log spaced distances of the quadrature (default: 1000).
+    table_shape : tuple of int, optional
+        Number of rho and x grid points of the table (default: (200, 400)).
+    max_rho : float, optional
+        Largest optimal SNR at D_ref in the table (default: 20).
+    time_bounds : tuple of float, optional
+        Range of the time shift prior in s (default: TIME_SHIFT_BOUNDS).
+    time_mode : str, optional
+        "marginalize" (default) or "maximize" over the time shift.
+    time_oversample : int, optional
+        Zero padding factor of the inverse FFT, the time resolution is the
+        data's sample spacing divided by this (default: 4).
+
+    Notes
+    -----
+    The sampled parameters are the columns of the full parameter list that
+    are not marginalized, in the same order; e.g. with both marginalized
+
+        [m1, q, time_shift, ra, dec, inclination, polarization]
+
+    The prior terms of the marginalized parameters are part of the marginal
+    likelihood, see tools.posterior.logposterior_batch(). The phase factor 
+    holds to about 1e-3 in the band, the remainder comes from the Tukey 
+    window of the time domain waveform. The antenna patterns and time delays
+    are evaluated once at time_bounds[0]; the Earth turns by 3.6e-6 rad 
+    across the 50 ms of TIME_SHIFT_BOUNDS.
+    """
+
+    def __init__(self, likelihood: FrequencyDomainLikelihood, marginalize=("phase", "distance"), distance_bounds=DISTANCE_BOUNDS,
+                 n_distance: int = 1000, table_shape=(200, 400), max_rho: float = 20., time_bounds=TIME_SHIFT_BOUNDS,
+                 time_mode: str = "marginalize", time_oversample: int = 4):
+        unknown = set(marginalize) - set(MARGINALIZABLE)
+        if unknown:
+            raise ValueError(f"Cannot marginalize over {sorted(unknown)}, only over {sorted(MARGINALIZABLE)}")
+        self.likelihood = likelihood
+        self.phase = "phase" in marginalize
+        self.distance = "distance" in marginalize
+        self.time = "time" in marginalize
+        if time_mode not in ("marginalize", "maximize"):
+            raise ValueError(f"time_mode must be 'marginalize' or 'maximize', not {time_mode!r}")
+        self.time_mode = time_mode
+        self.marginalized = sorted(MARGINALIZABLE[name] for name in marginalize)
+        self.sampled = [i for i in range(9) if i not in self.marginalized]
+
+        self.distance_bounds = tuple(float(d) for d in distance_bounds)
+        self.reference_distance = self.distance_bounds[1]
+        if self.distance:
+            # log spaced nodes, each weighted by its share of the D^2 prior
+            edges = np.geomspace(*self.distance_bounds, n_distance + 1)
+            self.distances = np.sqrt(edges[1:] * edges[:-1])
+            weights = np.diff(edges**3)
+            self.log_weights = np.log(weights / weights.sum())
+            self.u = self.reference_distance / self.distances
+
+            # x is bounded by sqrt(<s|s>) (Cauchy-Schwarz)
+            max_x = np.sqrt(np.sum(likelihood.data_norm))
+            # dense near rho = 0, where the peak of the integrand crosses the lower distance bound
+            self.rho_grid = max_rho * np.linspace(0., 1., table_shape[0])**3
+            self.x_grid = np.linspace(0. if self.phase else -max_x, max_x, table_shape[1])
+            rho, x = np.meshgrid(self.rho_grid, self.x_grid, indexing="ij")
+            table = self.distance_marginal_exact((rho * x).ravel(), (rho**2).ravel()).reshape(rho.shape)
+
+            from scipy.interpolate import RectBivariateSpline
+            self.table = RectBivariateSpline(self.rho_grid, self.x_grid, table)
+
+        self.time_bounds = tuple(float(t) for t in time_bounds)
+        if self.time:
+            n_freq = likelihood.kmin + len(likelihood.frequencies)
+            self.n_fft = 2 * (n_freq - 1) * int(time_oversample)
+            self.time_step = 1. / (self.n_fft * likelihood.df)
+            self.n_times = int(np.floor((self.time_bounds[1] - self.time_bounds[0]) / self.time_step)) + 1
+            self.times = self.time_bounds[0] + self.time_step * np.arange(self.n_times)
+
+    def _conditional(self, a: np.ndarray, b: np.ndarray)-> np.ndarray:
+        """Unnormalised log posterior of the distance nodes, shape (N, n_distance), for a = z or |z| and b = hh at D_ref."""
+        signal = _log_i0(a[:, None] * self.u) if self.phase else a[:, None] * self.u
+        return self.log_weights + signal - b[:, None] * self.u**2 / 2
+
+    def distance_marginal_exact(self, a, b, chunk_size: int = 4096)-> np.ndarray:
+        """
+        Distance marginal by direct quadrature.
+
+        Parameters
+        ----------
+        a : array-like
+            |<s|h>| if the phase is marginalized too, else Re<s|h>, at D_ref.
+        b : array-like
+            <h|h> at D_ref.
+
+        Returns
+        -------
+        numpy.ndarray
+            The log of the marginal likelihood, shape of a.
+        """
+        from scipy.special import logsumexp
+        a, b = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(b, dtype=float))
+        a_flat, b_flat = a.ravel(), b.ravel()
+        out = np.empty(len(a_flat))
+        for start in range(0, len(a_flat), chunk_size):
+            part = slice(start, start + chunk_size)
+            out[part] = logsumexp(self._conditional(a_flat[part], b_flat[part]), axis=1)
+        return out.reshape(a.shape)
+
+    def distance_marginal(self, a, b)-> np.ndarray:
+        """Distance marginal from the lookup table, see distance_marginal_exact()."""
+        a, b = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(b, dtype=float))
+        rho = np.sqrt(np.maximum(b, 0.))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = np.where(rho > 0, a / rho, 0.)
+        inside = (rho <= self.rho_grid[-1]) & (x >= self.x_grid[0]) & (x <= self.x_grid[-1])
+        out = np.empty(a.shape)
+        out[inside] = self.table.ev(rho[inside], x[inside])
+        if not inside.all():
+            out[~inside] = self.distance_marginal_exact(a[~inside], b[~inside])
+        return out
+
+    def expand(self, params)-> np.ndarray:
+        """Full (N, 9) parameter sets of sampled ones, at phase 0, the reference distance and the first time."""
+        params = np.atleast_2d(np.asarray(params, dtype=float))
+        full = np.zeros((len(params), 9))
+        full[:, self.sampled] = params
+        if self.distance:
+            full[:, MARGINALIZABLE["distance"]] = self.reference_distance
+        if self.time:
+            full[:, MARGINALIZABLE["time"]] = self.time_bounds[0]
+        return full
+
+    def _statistics(self, h_f: np.ndarray)-> tuple:
+        """
+        Detector summed <h|h>, shape (...,), and complex <s|h>, shape (...,) or
+        (..., n_times) at every time of self.times when the time is marginalized.
+        """
+        if not self.time:
+            hh, sh = self.likelihood.inner_products(h_f)
+            return hh.sum(axis=-1), sh.sum(axis=-1)
+        kmin = self.likelihood.kmin
+        h_f = h_f[..., kmin:]
+        hh = np.einsum('...df,df->...', h_f.real**2 + h_f.imag**2, self.likelihood.weights)
+        integrand = np.einsum('...df,df->...f', h_f.conj(), self.likelihood.weighted_data)
+        # bins below f_lower are zero, z(t_j) = sum_k integrand_k exp(2i pi k j / n_fft)
+        padded = np.zeros(integrand.shape[:-1] + (self.n_fft,), dtype=complex)
+        padded[..., kmin:kmin + integrand.shape[-1]] = integrand
+        z = np.fft.ifft(padded, axis=-1)[..., :self.n_times] * self.n_fft
+        return hh, z
+
+    def _loglikelihood_per_time(self, hh: np.ndarray, z: np.ndarray)-> np.ndarray:
+        """Log likelihood marginalized over phase and distance, broadcasting hh against z."""
+        hh = hh[..., None] if z.ndim > np.ndim(hh) else hh
+        a = np.abs(z) if self.phase else z.real
+        if self.distance:
+            return self.distance_marginal(a, hh)
+        return (_log_i0(a) if self.phase else a) - hh / 2
+
+    def loglikelihood_from_templates(self, h_f: np.ndarray)-> np.ndarray:
+        """Marginal log likelihood of templates of expand()ed parameters, shape (..., n_ifo, n_freq)."""
+        logl = self._loglikelihood_per_time(*self._statistics(h_f))
+        if not self.time:
+            return logl
+        if self.time_mode == "maximize":
+            return logl.max(axis=-1)
+        from scipy.special import logsumexp
+        return logsumexp(logl, axis=-1) - np.log(self.n_times)
+
+    def templates(self, params, **kwargs)-> np.ndarray:
+        """Templates of many sampled parameter sets, see FrequencyDomainLikelihood.templates()."""
+        return self.likelihood.templates(self.expand(params), **kwargs)
+
+    def __call__(self, param)-> float:
+        """Return the marginal log likelihood of one sampled parameter set, or -inf if it is not finite."""
+        logl = float(self.loglikelihood_from_templates(self.likelihood.template(self.expand(param)[0])))
+        return logl if np.isfinite(logl) else -np.inf
+
+    def reconstruct(self, params, seed=None, chunk_size: int = 256, **kwargs)-> np.ndarray:
+        """
+        Draw the marginalized parameters of every sample from their conditional posterior.
+
+        The time shift is drawn first from its marginal on the FFT grid
+        (uniformly within a grid step; the best time with 
+        time_mode="maximize"), then the distance from its tabulated 
+        conditional (uniformly in log distance within a node), and then the
+        phase from the von Mises distribution of 2 phase, with either of the
+        two phases that give the same template. Together the samples are 
+        draws from the full posterior.
+
+        Parameters
+        ----------
+        params : array-like
+            Sampled parameters, shape (N, len(self.sampled)).
+        seed : int or numpy.random.Generator, optional
+            Seed of the draws.
+        chunk_size : int, optional
+            Number of samples whose templates are held in memory at once
+            (default: 256).
+        **kwargs
+            Passed on to templates(), e.g. mode and max_workers.
+
+        Returns
+        -------
+        numpy.ndarray
+            Full parameter sets, shape (N, 9).
+        """
+        rng = np.random.default_rng(seed)
+        params = np.atleast_2d(np.asarray(params, dtype=float))
+        return np.concatenate([self._draw(params[start:start + chunk_size], rng, **kwargs)
+                               for start in range(0, len(params), chunk_size)])
+
+    def _draw(self, params: np.ndarray, rng: np.random.Generator, **kwargs)-> np.ndarray:
+        """reconstruct() of one chunk of samples."""
+        full = self.expand(params)
+        hh, z = self._statistics(self.templates(params, **kwargs))
+
+        if self.time:
+            logl = self._loglikelihood_per_time(hh, z)
+            if self.time_mode == "maximize":
+                times, jitter = np.argmax(logl, axis=1), 0.
+            else:
+                cdf = np.cumsum(np.exp(logl - logl.max(axis=1, keepdims=True)), axis=1)
+                times = np.minimum((cdf < rng.uniform(size=(len(cdf), 1)) * cdf[:, -1:]).sum(axis=1), self.n_times - 1)
+                jitter = rng.uniform(-.5, .5, len(times)) * self.time_step
+            full[:, MARGINALIZABLE["time"]] = np.clip(self.times[times] + jitter, *self.time_bounds)
+            # distance and phase are drawn at the grid time, which is within half a step of the jittered one
+            z = z[np.arange(len(z)), times]
+
+        if self.distance:
+            logp = self._conditional(np.abs(z) if self.phase else z.real, hh)
+            cdf = np.cumsum(np.exp(logp - logp.max(axis=1, keepdims=True)), axis=1)
+            nodes = np.minimum((cdf < rng.uniform(size=(len(cdf), 1)) * cdf[:, -1:]).sum(axis=1), len(self.distances) - 1)
+            step = np.log(self.distances[1] / self.distances[0])
+            full[:, MARGINALIZABLE["distance"]] = self.distances[nodes] * np.exp(step * (rng.uniform(size=len(nodes)) - .5))
+            z = z * self.reference_distance / full[:, MARGINALIZABLE["distance"]]
+
+        if self.phase:
+            two_phase = rng.vonmises(np.angle(z), np.abs(z))
+            full[:, MARGINALIZABLE["phase"]] = np.mod(two_phase / 2 + np.pi * rng.integers(0, 2, len(z)), 2 * np.pi)
+        return full
+#--------------------------------------------
+
+#--------------------------------------------
+@functools.lru_cache(maxsize=None)
+def load_marginalized_likelihood(marginalize=("phase", "distance"), distance_bounds=DISTANCE_BOUNDS, ifos=SAMPLING_IFOS,
+                                 f_lower: float = 10., rate="analysis", time_bounds=TIME_SHIFT_BOUNDS,
+                                 time_mode: str = "marginalize")-> MarginalizedLikelihood:
+    """
+    Build the marginalized likelihood of the GW190521 data once per process, see load_likelihood().
+
+    Parameters
+    ----------
+    marginalize : tuple of str, optional
+        Parameters to marginalize over (default: ("phase", "distance")).
+    distance_bounds : tuple of float, optional
+        Range of the distance prior in Mpc (default: DISTANCE_BOUNDS).
+    ifos, f_lower, rate : optional
+        As for load_likelihood().
+    time_bounds : tuple of float, optional
+        Range of the time shift prior in s (default: TIME_SHIFT_BOUNDS).
+    time_mode : str, optional
+        "marginalize" (default) or "maximize" over the time shift.
+    """
+    return MarginalizedLikelihood(load_likelihood(ifos, f_lower, rate), marginalize, distance_bounds=distance_bounds,
+                                  time_bounds=time_bounds, time_mode=time_mode)
+#--------------------------------------------
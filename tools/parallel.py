@@ -0,0 +1,96 @@
+import functools
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+# How per-detector (and other embarrassingly parallel) work is executed:
+#   "serial"  - a plain loop in the calling thread
+#   "thread"  - a thread pool, good for NumPy/SciPy filters and FFTs that release the GIL
+#   "process" - a process pool, for pure Python work that holds the GIL
+PARALLEL_MODE = os.environ.get("GW_PARALLEL_MODE", "thread")
+MAX_WORKERS = int(os.environ["GW_MAX_WORKERS"]) if os.environ.get("GW_MAX_WORKERS") else None
+
+#--------------------------------------------
+@functools.lru_cache(maxsize=None)
+def get_executor(mode: str, max_workers: int | None = None) -> Executor:
+    """
+    Return a persistent executor for the given mode.
+
+    Executors are created on first use and kept for the lifetime of the process,
+    so the cost of starting worker processes is only paid once.
+
+    Parameters
+    ----------
+    mode : str
+        "thread" or "process".
+    max_workers : int, optional
+        Number of workers (default: the executor's own default, based on the CPU count).
+
+    Returns
+    -------
+    concurrent.futures.Executor
+        The shared ThreadPoolExecutor or ProcessPoolExecutor.
+    """
+    if mode == "thread":
+        return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gw-worker")
+    if mode == "process":
+        return ProcessPoolExecutor(max_workers=max_workers)
+    raise ValueError(f"Unknown parallel mode {mode!r}, expected 'serial', 'thread' or 'process'")
+#--------------------------------------------
+
+#--------------------------------------------
+def worker_name() -> str:
+    """Name of the worker running the caller: "pid <pid>" in a worker process, else the thread name."""
+    if threading.current_thread() is threading.main_thread():
+        return f"pid {os.getpid()}"
+    return threading.current_thread().name
+#--------------------------------------------
+
+#--------------------------------------------
+def _named_call(func, item) -> tuple:
+    """Worker of parallel_map() with counts: the result together with the worker that computed it."""
+    return worker_name(), func(item)
+#--------------------------------------------
+
+#--------------------------------------------
+def parallel_map(func, items, mode: str | None = None, max_workers: int | None = None, counts=None) -> list:
+    """
+    Apply func to every item, in parallel according to the configured mode.
+
+    Parameters
+    ----------
+    func : callable
+        Function of one argument. For mode="process" it (and its results) must be
+        picklable, i.e. a module level function or a functools.partial of one.
+    items : iterable
+        Arguments to map func over.
+    mode : str, optional
+        "serial", "thread" or "process" (default: PARALLEL_MODE, set from the
+        GW_PARALLEL_MODE environment variable).
+    max_workers : int, optional
+        Number of workers (default: MAX_WORKERS, set from GW_MAX_WORKERS).
+    counts : collections.Counter, optional
+        If given, incremented by one per item under the worker_name() of 
+        the worker that ran it.
+
+    Returns
+    -------
+    list
+        Results in the same order as items.
+    """
+    items = list(items)
+    mode = PARALLEL_MODE if mode is None else mode
+    max_workers = MAX_WORKERS if max_workers is None else max_workers
+
+    if counts is None:
+        if mode == "serial" or len(items) <= 1:
+            return [func(item) for item in items]
+        return list(get_executor(mode, max_workers).map(func, items))
+
+    if mode == "serial" or len(items) <= 1:
+        named = [_named_call(func, item) for item in items]
+    else:
+        named = list(get_executor(mode, max_workers).map(functools.partial(_named_call, func), items))
+    counts.update(name for name, _ in named)
+    return [result for _, result in named]
+#--------------------------------------------
@@ -0,0 +1,135 @@
+"""
+Log prior and log posterior for the parameter estimation.
+
+The shipped versions of logprior() and logposterior() shown on the Statistical
+Sampling page, plus batched versions that evaluate a whole walker ensemble at
+once, for emcee's vectorize=True:
+
+    sampler = emcee.EnsembleSampler(nwalkers, ndim, logposterior_batch, vectorize=True, moves=moves)
+
+With a MarginalizedLikelihood as the likelihood, the parameter sets are the
+sampled parameters only (7 with phase and distance marginalized).
+"""
+import numpy as np
+from tools.likelihood import load_likelihood, MarginalizedLikelihood
+
+PARAMETER_NAMES = ["Mass", "Ratio", "Distance", "TimeShift", "Phase", "RA", "Dec", "Incl", "Pol"]
+MAP_ROWS = PARAMETER_NAMES + ["lp", "chain", "draw"]   # index of MCMC_data/MAP_parameters.parquet
+
+#--------------------------------------------
+def logprior_batch(params)-> np.ndarray:
+    """
+    Evaluate the log prior of many parameter sets at once.
+
+    Same checks and the same non uniform prior (uniform in volume and
+    orientation) as the page's logprior(), on whole columns.
+
+    Parameters
+    ----------
+    params : array-like
+        Array of shape (N, 9), each row
+        [m1, q, distance, time_shift, phase, ra, dec, inclination, polarization]
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (N,) with the log prior, -inf outside the prior support.
+    """
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    m1, q, distance, time_shift, phase, ra, dec, inclination, polarization = params.T
+
+    valid = (m1 > 0) & (q >= 0.05) & (q <= .97) & (distance >= 0)
+    for angle in [ra, phase, polarization]:
+        valid &= (angle >= 0) & (angle <= 2*np.pi)
+    valid &= (inclination >= 0) & (inclination <= np.pi)
+    valid &= (dec >= -np.pi/2) & (dec <= np.pi/2)
+
+    logp = np.full(len(params), -np.inf)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logp[valid] = np.log(np.cos(dec[valid])) + 2*np.log(distance[valid]) + np.log(np.sin(inclination[valid]))
+    return logp
+#--------------------------------------------
+
+#--------------------------------------------
+def logprior(param)-> float:
+    """Log prior of one parameter set, see logprior_batch()."""
+    return float(logprior_batch([param])[0])
+#--------------------------------------------
+
+#--------------------------------------------
+def _sampled_logprior(params, likelihood)-> np.ndarray:
+    """
+    Log prior of the sampled parameters of a likelihood.
+
+    For a MarginalizedLikelihood the marginalized parameters are set to
+    valid values by its expand() and their prior terms are removed, they are
+    part of the marginal likelihood.
+    """
+    if not isinstance(likelihood, MarginalizedLikelihood):
+        return logprior_batch(params)
+    logp = logprior_batch(likelihood.expand(params))
+    if likelihood.distance:
+        logp -= 2*np.log(likelihood.reference_distance)
+    return logp
+#--------------------------------------------
+
+#--------------------------------------------
+def logposterior(param, likelihood=None)-> float:
+    """
+    Log posterior of one parameter set, as the page's logposterior().
+
+    The likelihood is only evaluated inside the prior support. likelihood
+    defaults to load_likelihood().
+    """
+    likelihood = load_likelihood() if likelihood is None else likelihood
+    logpost = float(_sampled_logprior([param], likelihood)[0])
+    if np.isfinite(logpost):
+        logpost += likelihood(param)
+    return logpost
+#--------------------------------------------
+
+#--------------------------------------------
+def logposterior_batch(params, likelihood=None, mode: str = "process", max_workers: int | None = None, worker_counts=None)-> np.ndarray:
+    """
+    Evaluate the log posterior of a whole walker ensemble at once.
+
+    The prior is checked on all walkers together, and only walkers inside the
+    prior support get a template. The distinct waveforms are generated by
+    gen_template_many() on a persistent worker pool, so the only data crossing
+    process boundaries are the parameters and the waveform arrays, and the
+    projection and inner products of every walker and detector are single
+    vectorized operations in the calling process.
+
+    Parameters
+    ----------
+    params : array-like
+        Array of shape (n_walkers, 9), each row
+        [m1, q, distance, time_shift, phase, ra, dec, inclination, polarization],
+        or of shape (n_walkers, len(likelihood.sampled)) for a
+        MarginalizedLikelihood.
+    likelihood : FrequencyDomainLikelihood or MarginalizedLikelihood, optional
+        The likelihood to use (default: load_likelihood()).
+    mode : str, optional
+        Worker pool used for the waveforms: "process" (default), "thread" or
+        "serial", see tools.parallel.parallel_map().
+    max_workers : int, optional
+        Number of workers in the pool.
+    worker_counts : collections.Counter, optional
+        Incremented by the number of waveforms each worker generated.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n_walkers,) with the log posterior, -inf outside the
+        prior support or where the likelihood is not finite.
+    """
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    likelihood = load_likelihood() if likelihood is None else likelihood
+
+    logpost = _sampled_logprior(params, likelihood)
+    inside = np.isfinite(logpost)
+    if inside.any():
+        logl = likelihood.loglikelihood_from_templates(likelihood.templates(params[inside], mode=mode, max_workers=max_workers, worker_counts=worker_counts))
+        logpost[inside] += np.where(np.isfinite(logl), logl, -np.inf)
+    return logpost
+#--------------------------------------------
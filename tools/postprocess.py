@@ -0,0 +1,321 @@
+"""
+Chain post-processing: from a raw MCMC chain to the Results page artifacts.
+
+The chain is read in chunks of steps, with the burn-in discarded and the
+steps thinned on read, so its length is not limited by memory. Every chunk
+updates one QuantileSketch per parameter and the running maximum of the log
+posterior; the chain itself is never held as a whole. The result is written
+as
+
+- MCMC_data/MAP_parameters.parquet: MAP, onestd (16-84%) and twostd
+  (2.5-97.5%) intervals, in the schema of the stored file, and
+- MCMC_data/MAP_results.json: the same numbers rounded and typeset for the
+  Results page, which only reads it.
+
+    python -m tools.postprocess --input MCMC_save_data.h5 [--burn-in 35426] [--thin 2]
+    python -m tools.postprocess --from-map MCMC_data/MAP_parameters.parquet   # only format the results
+
+The input is a checkpoint file of tools.run_sampler (burn-in and thinning
+default to the ones of its stored diagnostics; marginalized parameters are
+drawn back chunk by chunk), or a parquet chain with the parameters, lp,
+chain and draw as columns.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from tools.posterior import PARAMETER_NAMES, MAP_ROWS
+
+ONE_SIGMA = (0.15865525393145707, 0.8413447460685429)
+TWO_SIGMA = (0.022750131948179195, 0.9772498680518208)
+
+# Display of every parameter on the Results page: row, title, symbol, help and decimals
+RESULTS_FORMAT = [
+    ("Mass",      "Mass",            "M_1",       "Primary Mass",                    1),
+    ("Ratio",     "Ratio",           "q",         "Mass Ratio",                      2),
+    ("Distance",  "Distance",        "D_L",       "Luminosity Distance",             0),
+    ("TimeShift", "Time Shift",      "TimeShift", "Time from event_gps('GW190521')", 5),
+    ("Phase",     "Phase",           r"\phi_c",   "Coalesence Phase",                2),
+    ("RA",        "Right Ascension", r"\alpha",   "Right Ascension",                 4),
+    ("Dec",       "Declination",     r"\delta",   "Declination",                     3),
+    ("Incl",      "Inclination",     "i",         "Inclination",                     2),
+    ("Pol",       "Polarization",    "P",         "Polarization",                    3),
+]
+RESULTS_FILE = "MCMC_data/MAP_results.json"
+
+#--------------------------------------------
+class QuantileSketch:
+    """
+    Streaming quantiles of one parameter from a fixed size histogram.
+
+    The histogram covers the values seen so far with n_bins equal bins.
+    When a new value falls outside, the range is doubled towards it and
+    neighbouring bins are merged, so the bins only ever get coarser and no
+    count is lost. A quantile is exact up to one bin width, at most 2/n_bins
+    of the range of the samples.
+
+    Parameters
+    ----------
+    n_bins : int, optional
+        Number of bins, a power of two (default: 2**14).
+    """
+
+    def __init__(self, n_bins: int = 2**14):
+        self.n_bins = n_bins
+        self.counts = np.zeros(n_bins, dtype=np.int64)
+        self.lo = None
+        self.width = None
+        self.total = 0
+
+    def _grow(self, low: float, high: float):
+        """Double the range until it covers [low, high]."""
+        half = self.n_bins // 2
+        while low < self.lo or high >= self.lo + self.n_bins * self.width:
+            merged = self.counts.reshape(half, 2).sum(axis=1)
+            self.counts[:] = 0
+            if low < self.lo:
+                # extend downwards: the old range becomes the upper half
+                self.counts[half:] = merged
+                self.lo -= self.n_bins * self.width
+            else:
+                self.counts[:half] = merged
+            self.width *= 2
+
+    def update(self, values):
+        """Add values, non finite ones are ignored."""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        low, high = values.min(), values.max()
+        if self.lo is None:
+            span = high - low if high > low else max(abs(low), 1.) * 1e-6
+            self.lo, self.width = low, span * (1 + 1e-9) / self.n_bins
+        self._grow(low, high)
+        index = np.minimum(((values - self.lo) / self.width).astype(np.int64), self.n_bins - 1)
+        self.counts += np.bincount(index, minlength=self.n_bins)
+        self.total += len(values)
+
+    def quantile(self, q)-> np.ndarray:
+        """Quantiles q in [0, 1], interpolated linearly within a bin."""
+        q = np.atleast_1d(np.asarray(q, dtype=float))
+        if self.total == 0:
+            return np.full(q.shape, np.nan)
+        cdf = np.cumsum(self.counts)
+        target = q * self.total
+        # the first bin whose cumulative count reaches the target, the first non empty one for q = 0
+        k = np.where(target > 0, np.searchsorted(cdf, target, side="left"), np.searchsorted(cdf, 0, side="right"))
+        k = np.minimum(k, self.n_bins - 1)
+        below = np.where(k > 0, cdf[np.maximum(k - 1, 0)], 0)
+        fraction = np.clip((target - below) / np.maximum(self.counts[k], 1), 0., 1.)
+        return self.lo + self.width * (k + fraction)
+#--------------------------------------------
+
+#--------------------------------------------
+def iter_chain(path: str, name: str = "mcmc", burn_in: int | None = None, thin: int | None = None, chunk_steps: int = 4096,
+               seed: int = 0):
+    """
+    Read a chain in chunks, with burn-in and thinning applied.
+
+    Parameters
+    ----------
+    path : str
+        A tools.run_sampler checkpoint file (.h5, .hdf5), a parquet file
+        with the PARAMETER_NAMES, lp, chain and draw columns, or the same
+        as an Arrow file of tools.samples (.arrow, .feather).
+    name : str, optional
+        Group of the run in a checkpoint file (default: "mcmc").
+    burn_in, thin : int, optional
+        Steps discarded at the start and thinning of the steps. For a
+        checkpoint file they default to the burn_in and thin of the stored
+        diagnostics, otherwise to 0 and 1.
+    chunk_steps : int, optional
+        Number of steps read at a time from a checkpoint file, a parquet
+        chain is read in batches of 64 times as many rows (default: 4096).
+    seed : int, optional
+        Seed of the reconstruction of marginalized parameters.
+
+    Yields
+    ------
+    tuple
+        (params, lp, chain, draw): arrays of shape (n, 9), (n,), (n,), (n,),
+        with chain the walker and draw the step of every sample.
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        burn_in, thin = burn_in or 0, thin or 1
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_steps * 64, columns=PARAMETER_NAMES + ["lp", "chain", "draw"]):
+            frame = batch.to_pandas()
+            keep = (frame["draw"] >= burn_in) & ((frame["draw"] - burn_in) % thin == 0)
+            frame = frame[keep]
+            yield (frame[PARAMETER_NAMES].to_numpy(dtype=float), frame["lp"].to_numpy(dtype=float),
+                   frame["chain"].to_numpy(), frame["draw"].to_numpy())
+        return
+    if path.endswith((".arrow", ".feather")):
+        from tools.samples import PosteriorSamples
+        burn_in, thin = burn_in or 0, thin or 1
+        for batch in PosteriorSamples(path).iter_batches(PARAMETER_NAMES + ["lp", "chain", "draw"], draws=(burn_in, None)):
+            frame = batch.to_pandas()
+            frame = frame[(frame["draw"] - burn_in) % thin == 0]
+            yield (frame[PARAMETER_NAMES].to_numpy(dtype=float), frame["lp"].to_numpy(dtype=float),
+                   frame["chain"].to_numpy(), frame["draw"].to_numpy())
+        return
+
+    import h5py
+    from tools.run_sampler import stored_config, load_run_likelihood
+
+    config = stored_config(path, name) or {}
+    with h5py.File(path, "r") as f:
+        group = f[name]
+        if "diagnostics" in group.attrs:
+            diagnostics = json.loads(group.attrs["diagnostics"])
+            burn_in = diagnostics["burn_in"] if burn_in is None else burn_in
+            thin = diagnostics["thin"] if thin is None else thin
+        burn_in, thin = burn_in or 0, thin or 1
+        iteration = int(group.attrs["iteration"])
+        likelihood = load_run_likelihood(config) if config.get("marginalize") else None
+        rng = np.random.default_rng(seed)
+
+        for start in range(burn_in, iteration, chunk_steps * thin):
+            stop = min(start + chunk_steps * thin, iteration)
+            chain = group["chain"][start:stop:thin]            # (steps, walkers, ndim)
+            lp = group["log_prob"][start:stop:thin]
+            steps, walkers = lp.shape
+            params = chain.reshape(steps * walkers, -1)
+            if likelihood is not None:
+                params = likelihood.reconstruct(params, seed=rng)
+            yield (params, lp.ravel(), np.tile(np.arange(walkers), steps),
+                   np.repeat(np.arange(start, stop, thin), walkers))
+#--------------------------------------------
+
+#--------------------------------------------
+def map_table(params, lp: float, chain: int, draw: int, onestd, twostd)-> pd.DataFrame:
+    """
+    Return a MAP in the schema of MAP_parameters.parquet.
+
+    The MAP column holds the parameters, lp, chain and draw; onestd and
+    twostd the [low, high] interval of every parameter, and [0, 0] for lp,
+    chain and draw as in the stored file.
+    """
+    return pd.DataFrame({"MAP": [float(p) for p in params] + [float(lp), float(chain), float(draw)],
+                         "onestd": [[float(lo), float(hi)] for lo, hi in onestd] + [[0., 0.]] * 3,
+                         "twostd": [[float(lo), float(hi)] for lo, hi in twostd] + [[0., 0.]] * 3}, index=MAP_ROWS)
+#--------------------------------------------
+
+#--------------------------------------------
+def summarize_chain(path: str, **kwargs)-> pd.DataFrame:
+    """
+    MAP sample and credible intervals of a chain, streamed with iter_chain().
+
+    The MAP is the sample with the highest log posterior; the intervals are
+    the central 68.3% and 95.4% intervals of the QuantileSketch of every
+    parameter.
+
+    Parameters
+    ----------
+    path : str
+        The chain, see iter_chain().
+    **kwargs
+        Passed on to iter_chain(), e.g. burn_in, thin and chunk_steps.
+
+    Returns
+    -------
+    pandas.DataFrame
+        See map_table().
+    """
+    sketches = [QuantileSketch() for _ in PARAMETER_NAMES]
+    best = (-np.inf, None, 0, 0)
+    for params, lp, chain, draw in iter_chain(path, **kwargs):
+        for sketch, column in zip(sketches, params.T):
+            sketch.update(column)
+        if len(lp) and np.nanmax(lp) > best[0]:
+            i = int(np.nanargmax(lp))
+            best = (lp[i], params[i].copy(), chain[i], draw[i])
+    if best[1] is None:
+        raise ValueError(f"No samples left in {path} after burn-in and thinning")
+
+    quantiles = np.array([sketch.quantile(ONE_SIGMA + TWO_SIGMA) for sketch in sketches])
+    return map_table(best[1], best[0], best[2], best[3], quantiles[:, :2], quantiles[:, 2:])
+#--------------------------------------------
+
+#--------------------------------------------
+def _format(value: float, decimals: int)-> str:
+    """A value as shown on the Results page, distances truncated to whole Mpc."""
+    return str(int(value)) if decimals == 0 else f"{value:.{decimals}f}"
+#--------------------------------------------
+
+#--------------------------------------------
+def format_results(map_df: pd.DataFrame)-> dict:
+    """
+    Round and typeset a MAP table for the Results page.
+
+    Returns
+    -------
+    dict
+        "parameters": for every row of RESULTS_FORMAT its title, help, the
+        formatted MAP and intervals and the LaTeX line; "map_params": the 9
+        rounded MAP values the page builds its template from; "lp", "chain"
+        and "draw" of the MAP sample.
+    """
+    parameters = {}
+    for row, title, symbol, help_text, decimals in RESULTS_FORMAT:
+        value = float(map_df.loc[row, "MAP"])
+        one, two = [[_format(v, decimals) for v in map_df.loc[row, column]] for column in ("onestd", "twostd")]
+        shown = _format(value, decimals)
+        parameters[title] = {"help": help_text, "MAP": shown, "onestd": one, "twostd": two,
+                             "latex": rf"{symbol}={shown}^{{{two[1]}}}_{{{two[0]}}} \;"}
+    return {"parameters": parameters,
+            "map_params": [float(np.round(map_df.loc[row, "MAP"], decimals)) for row, _, _, _, decimals in RESULTS_FORMAT],
+            "lp": float(map_df.loc["lp", "MAP"]),
+            "chain": int(map_df.loc["chain", "MAP"]),
+            "draw": int(map_df.loc["draw", "MAP"])}
+#--------------------------------------------
+
+#--------------------------------------------
+def write_results(map_df: pd.DataFrame, parquet: str | None = "MCMC_data/MAP_parameters.parquet", results: str = RESULTS_FILE):
+    """Write the MAP table (unless parquet is None) and its formatted results artifact."""
+    if parquet is not None:
+        map_df.to_parquet(parquet)
+    os.makedirs(os.path.dirname(results) or ".", exist_ok=True)
+    with open(results, "w") as f:
+        json.dump(format_results(map_df), f, indent=1)
+#--------------------------------------------
+
+#--------------------------------------------
+def load_results(results: str = RESULTS_FILE, parquet: str = "MCMC_data/MAP_parameters.parquet")-> dict:
+    """Read the formatted results artifact, formatting the MAP table instead if it has not been written."""
+    if os.path.exists(results):
+        with open(results) as f:
+            return json.load(f)
+    return format_results(pd.read_parquet(parquet))
+#--------------------------------------------
+
+#--------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="checkpoint file of tools.run_sampler or parquet chain")
+    source.add_argument("--from-map", help="existing MAP parquet, only write the results artifact")
+    parser.add_argument("--name", default="mcmc", help="group of the run in a checkpoint file")
+    parser.add_argument("--burn-in", type=int, dest="burn_in")
+    parser.add_argument("--thin", type=int)
+    parser.add_argument("--chunk-steps", type=int, default=4096, dest="chunk_steps")
+    parser.add_argument("--output", default="MCMC_data/MAP_parameters.parquet", help="MAP parquet written from --input")
+    parser.add_argument("--results", default=RESULTS_FILE, help="formatted results artifact")
+    args = parser.parse_args()
+
+    if args.from_map:
+        map_df, parquet = pd.read_parquet(args.from_map), None
+    else:
+        map_df = summarize_chain(args.input, name=args.name, burn_in=args.burn_in, thin=args.thin, chunk_steps=args.chunk_steps)
+        parquet = args.output
+    write_results(map_df, parquet, args.results)
+    print(map_df.to_string())
+    print(f"\nwritten {', '.join(path for path in (parquet, args.results) if path)}")
+#--------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Relative binning (heterodyned) likelihood around the MAP waveform.
+
+Near the peak of the posterior every template is a smooth modulation of a
+fiducial template h0, here the one of the stored MAP parameters: the ratio
+h(f)/h0(f) changes little across bins whose edges are chosen from a bound on
+the phase difference (Zackay, Dai & Venumadhav 2018). With summary data of
+the data and h0 precomputed per bin, the inner products only need templates
+at the bin edges, a few dozen frequencies instead of every rFFT bin:
+
+    likelihood = load_relative_binning_likelihood()
+    likelihood(param)                               # same call as FrequencyDomainLikelihood
+    logposterior_batch(params, likelihood=likelihood)
+
+The intrinsic waveforms still come from the time domain SEOBNRv4_opt model
+and the cached FFT of intrinsic_spectrum(); the projection, time shift and
+inner products are evaluated at the nodes only, so varying the extrinsic
+parameters of a sample (resampling, reweighting, interactive sliders) costs
+tens of microseconds per sample, see benchmarks/relative_binning.py.
+"""
+import functools
+import numpy as np
+from tools.gen_template_function import template_spectra, gen_template_many
+from tools.likelihood import FrequencyDomainLikelihood, load_likelihood, SAMPLING_IFOS
+
+PHASE_POWERS = np.array([-5/3, -2/3, 1., 5/3, 7/3])   # post-Newtonian powers of f of the phase bound
+
+#--------------------------------------------
+def bin_edges(frequencies, epsilon: float = 0.5, chi: float = 1.)-> np.ndarray:
+    """
+    Choose relative binning bin edges on a frequency grid.
+
+    The phase difference between any two templates near the fiducial is
+    bounded by
+
+        dpsi(f) = 2 pi chi sum_i sign(g_i) (f / f_i)^g_i
+
+    with g_i in PHASE_POWERS and f_i the lowest frequency for negative and
+    the highest for positive powers. The edges split the range of dpsi into
+    steps of at most epsilon.
+
+    Parameters
+    ----------
+    frequencies : array-like
+        Increasing frequencies, from f_lower.
+    epsilon : float, optional
+        Largest phase bound change across a bin in radians (default: 0.5).
+    chi : float, optional
+        Overall scale of the bound (default: 1).
+
+    Returns
+    -------
+    numpy.ndarray
+        Indices into frequencies of the bin edges, including the first and
+        the last frequency.
+    """
+    f = np.asarray(frequencies, dtype=float)
+    f_ref = np.where(PHASE_POWERS < 0, f[0], f[-1])
+    dpsi = 2 * np.pi * chi * np.sum(np.sign(PHASE_POWERS) * (f[:, None] / f_ref)**PHASE_POWERS, axis=1)
+    levels = np.linspace(dpsi[0], dpsi[-1], int(np.ceil((dpsi[-1] - dpsi[0]) / epsilon)) + 1)
+    return np.unique(np.r_[0, np.searchsorted(dpsi, levels[1:-1]), len(f) - 1])
+#--------------------------------------------
+
+#--------------------------------------------
+class RelativeBinningLikelihood:
+    """
+    Gaussian log likelihood with relative binning around a fiducial template.
+
+    Within bin b, between the nodes f_b and f_b+1, the ratio r = h/h0 is
+    interpolated linearly, r(f) = r_b (1 - x) + r_b+1 x, x = (f - f_b)/(f_b+1 - f_b).
+    Then, per detector,
+
+        <s|h> = sum_b A0_b conj(r_b) + A1_b conj(r_b+1)
+        <h|h> = sum_b B00_b |r_b|^2 + 2 B01_b Re(r_b conj(r_b+1)) + B11_b |r_b+1|^2
+
+    where A0 = sum 4df s h0* (1 - x)/S, A1 = sum 4df s h0* x/S, and B00, B01,
+    B11 the sums of 4df |h0|^2/S times (1 - x)^2, x (1 - x) and x^2 over the
+    bin, all computed once from the full resolution data.
+
+    Parameters
+    ----------
+    likelihood : FrequencyDomainLikelihood
+        The full resolution likelihood, for its data, weights and time grid.
+    fiducial : array-like
+        Parameters of the fiducial template,
+        [m1, q, distance, time_shift, phase, ra, dec, inclination, polarization]
+    epsilon, chi : float, optional
+        Binning accuracy, see bin_edges().
+    power_tol : float, optional
+        The bins cover the band holding all but this fraction of <h0|h0>,
+        one more bin reaches up to the highest frequency (default: 1e-6).
+
+    Notes
+    -----
+    Has the interface of FrequencyDomainLikelihood (inner_products(),
+    loglikelihood_from_templates(), template(), templates(), __call__()),
+    with templates given at self.nodes only, so it can be used by
+    tools.posterior and wrapped by MarginalizedLikelihood for the phase and
+    distance. The approximation holds near the fiducial; far from it the
+    ratio is no longer smooth and the error grows.
+    """
+
+    def __init__(self, likelihood: FrequencyDomainLikelihood, fiducial, epsilon: float = 0.5, chi: float = 1., power_tol: float = 1e-6):
+        self.ifos = likelihood.ifos
+        self.f_lower = likelihood.f_lower
+        self.time_grid = likelihood.time_grid
+        self.data_norm = likelihood.data_norm
+        self.fiducial = np.array(fiducial, dtype=float)
+
+        h0 = template_spectra(self.fiducial, f_lower=self.f_lower, ifos=self.ifos, **self.time_grid)[:, likelihood.kmin:]
+        hh0 = likelihood.weights * (h0.real**2 + h0.imag**2)
+
+        # above the band of the signal the ratio is noise, there the phase bound would only add nodes
+        power = np.cumsum(hh0.sum(axis=0))
+        top = min(int(np.searchsorted(power, (1 - power_tol) * power[-1])) + 1, len(power) - 1)
+        edges = bin_edges(likelihood.frequencies[:top + 1], epsilon, chi)
+        if edges[-1] < len(power) - 1:
+            edges = np.r_[edges, len(power) - 1]
+        self.nodes = likelihood.kmin + edges                     # rFFT bins of the bin edges
+        self.frequencies = likelihood.frequencies[edges]
+        self.h0 = np.ascontiguousarray(h0[:, edges])
+
+        # bin of every frequency and its position x within the bin, the last node closes the last bin
+        n_bins = len(edges) - 1
+        index = np.arange(len(likelihood.frequencies))
+        b = np.minimum(np.searchsorted(edges, index, side="right") - 1, n_bins - 1)
+        x = (likelihood.frequencies - self.frequencies[b]) / (self.frequencies[b + 1] - self.frequencies[b])
+
+        sh0 = likelihood.weighted_data * h0.conj()
+        bin_sum = lambda values: np.stack([np.bincount(b, weights=row, minlength=n_bins) for row in values])
+        self.a0 = bin_sum(sh0.real * (1 - x)) + 1j * bin_sum(sh0.imag * (1 - x))   # (n_ifo, n_bins)
+        self.a1 = bin_sum(sh0.real * x) + 1j * bin_sum(sh0.imag * x)
+        self.b00 = bin_sum(hh0 * (1 - x)**2)
+        self.b01 = bin_sum(hh0 * x * (1 - x))
+        self.b11 = bin_sum(hh0 * x**2)
+
+    def ratios(self, h_nodes: np.ndarray)-> np.ndarray:
+        """h/h0 at the nodes, zero where the fiducial vanishes."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.h0 != 0, h_nodes / self.h0, 0.)
+
+    def inner_products(self, h_nodes: np.ndarray)-> tuple:
+        """
+        Evaluate <h|h> and the complex <s|h> for every detector.
+
+        Parameters
+        ----------
+        h_nodes : numpy.ndarray
+            Complex templates of shape (..., n_ifo, n_nodes) at self.nodes.
+
+        Returns
+        -------
+        tuple
+            (hh, sh), each of shape (..., n_ifo), as
+            FrequencyDomainLikelihood.inner_products().
+        """
+        r = self.ratios(h_nodes)
+        left, right = r[..., :-1], r[..., 1:]
+        sh = np.sum(self.a0 * left.conj() + self.a1 * right.conj(), axis=-1)
+        hh = np.sum(self.b00 * (left.real**2 + left.imag**2) + 2 * self.b01 * np.real(left * right.conj())
+                    + self.b11 * (right.real**2 + right.imag**2), axis=-1)
+        return hh, sh
+
+    def loglikelihood_from_templates(self, h_nodes: np.ndarray)-> np.ndarray:
+        """Log likelihood of templates of shape (..., n_ifo, n_nodes), summed over detectors."""
+        hh, sh = self.inner_products(h_nodes)
+        return np.sum(sh.real - hh / 2, axis=-1)
+
+    def template(self, param)-> np.ndarray:
+        """Template of one parameter set at the nodes, an (n_ifo, n_nodes) array."""
+        return template_spectra(param, f_lower=self.f_lower, ifos=self.ifos, bins=self.nodes, **self.time_grid)
+
+    def templates(self, params, **kwargs)-> np.ndarray:
+        """Templates of many parameter sets at the nodes, an (N, n_ifo, n_nodes) array, see gen_template_many()."""
+        return gen_template_many(params, f_lower=self.f_lower, ifos=self.ifos, domain="frequency", bins=self.nodes,
+                                 **self.time_grid, **kwargs)
+
+    def __call__(self, param)-> float:
+        """Return the log likelihood of one parameter set, or -inf if it is not finite."""
+        logl = float(self.loglikelihood_from_templates(self.template(param)))
+        return logl if np.isfinite(logl) else -np.inf
+#--------------------------------------------
+
+#--------------------------------------------
+@functools.lru_cache(maxsize=None)
+def load_relative_binning_likelihood(fiducial: str | tuple = "MCMC_data/MAP_parameters.parquet", epsilon: float = 0.5,
+                                     ifos=SAMPLING_IFOS, f_lower: float = 10., rate="analysis")-> RelativeBinningLikelihood:
+    """
+    Build the relative binning likelihood of the GW190521 data once per process.
+
+    Parameters
+    ----------
+    fiducial : str or tuple, optional
+        Parquet file with a "MAP" column (default: the stored MAP
+        parameters), or the 9 fiducial parameters.
+    epsilon : float, optional
+        Binning accuracy, see bin_edges() (default: 0.5).
+    ifos, f_lower, rate : optional
+        As for load_likelihood().
+    """
+    if isinstance(fiducial, str):
+        import pandas as pd
+        fiducial = pd.read_parquet(fiducial)["MAP"].iloc[:9].to_numpy()
+    return RelativeBinningLikelihood(load_likelihood(ifos, f_lower, rate), fiducial, epsilon=epsilon)
+#--------------------------------------------
@@ -0,0 +1,439 @@
+"""
+Resumable MCMC runner for the GW190521 parameter estimation.
+
+The run described on the Statistical Sampling page (24 walkers, a 0.8/0.2
+StretchMove/DEMove mix, seed 42, L1 and H1 only) as an entry point:
+
+    python -m tools.run_sampler --output MCMC_save_data.h5 --nsteps 100000
+
+The chain is checkpointed to a chunked, compressed HDF5 file every
+checkpoint_every steps, together with the sampler's random state. Running the
+same command again after a crash or preemption resumes from the last
+checkpoint and produces exactly the chain an uninterrupted run would have.
+
+At every checkpoint the autocorrelation times, split R-hat and effective
+sample sizes are updated from the new steps (tools.diagnostics), stored with
+the run, and the run stops early once the targets are met.
+
+With "marginalize": ["phase", "distance"] the sampler runs on the 7 remaining
+parameters with the marginalized likelihood (tools.likelihood), and
+reconstruct_chain() draws the phase and distance of every sample afterwards;
+adding "time" integrates the time shift out as well, with one FFT per sample:
+
+    python -m tools.run_sampler --marginalize phase distance [time]
+"""
+import argparse
+import collections
+import json
+import os
+import time
+
+import h5py
+import numpy as np
+import emcee
+from emcee.backends import HDFBackend
+
+from tools.likelihood import load_likelihood, load_marginalized_likelihood, MARGINALIZABLE, DISTANCE_BOUNDS, TIME_SHIFT_BOUNDS
+from tools.posterior import logposterior_batch
+from tools.diagnostics import StreamingDiagnostics, DEFAULT_TARGETS
+
+# Every setting of a run. The ones that change the chain are stored in the
+# checkpoint file and reused on resume, see RUNTIME_KEYS for the others.
+DEFAULT_CONFIG = {
+    "param_bounds": [              # bounds of the starting positions
+        [80., 200.],               # primary mass
+        [0.5, .95],                # mass ratio
+        [500., 5000.],             # Lum distance
+        [.02, .04],                # time_shift
+        [0., 2*np.pi],             # phase
+        [0., 2*np.pi],             # right_ascension
+        [-np.pi/2., np.pi/2.],     # declination
+        [0., np.pi],               # inclination
+        [0., 2*np.pi],             # polarization
+    ],
+    "start": "MCMC_data/MAP_parameters.parquet", # parquet with a "MAP" column, or a list of 9 values
+    "jitter": 1e-2,                # relative scatter of the walkers around the start
+    "nwalkers": 24,
+    "nsteps": 100000,              # total number of steps, including any already in the file
+    "seed": 42,
+    "moves": [["StretchMove", {"a": 2.0}, 0.8], ["DEMove", {}, 0.2]],
+    "ifos": ["L1", "H1"],
+    "f_lower": 10.,
+    "rate": "analysis",            # sample rate of data and templates, see load_likelihood()
+    "checkpoint_every": 100,       # steps between checkpoints
+    "chunk_steps": 256,            # steps per HDF5 chunk
+    "compression": "gzip",
+    "compression_level": 4,
+    "mode": "process",             # worker pool for the waveforms, see tools.parallel
+    "max_workers": None,
+    "auto_stop": True,             # stop before nsteps once the convergence targets are met
+    "targets": DEFAULT_TARGETS,    # see tools.diagnostics
+    "marginalize": [],             # parameters integrated out of the likelihood, any of "phase", "distance"
+    "distance_bounds": list(DISTANCE_BOUNDS), # Mpc, distance prior range when the distance is marginalized
+    "time_bounds": list(TIME_SHIFT_BOUNDS),   # s, time shift prior range when the time is marginalized
+    "time_mode": "marginalize",    # or "maximize" over the time shift
+}
+RUNTIME_KEYS = ("nsteps", "checkpoint_every", "mode", "max_workers", "auto_stop", "targets")
+
+#--------------------------------------------
+class CheckpointBackend(HDFBackend):
+    """
+    emcee HDF5 backend that writes the chain in chunks, at checkpoints.
+
+    Steps are kept in memory and written in one block by flush(): the chain
+    and log probability rows, the acceptance counts and the random state of
+    the last step, with the iteration counter updated last. A run killed
+    between checkpoints therefore leaves a consistent file ending at the
+    previous checkpoint. The datasets are chunked along the steps and
+    compressed.
+
+    Parameters
+    ----------
+    filename : str
+        HDF5 file of the checkpoints.
+    name : str, optional
+        Group of the run inside the file (default: "mcmc").
+    checkpoint_every : int, optional
+        Flush automatically once this many steps are pending (default: 100).
+    chunk_steps : int, optional
+        Number of steps per HDF5 chunk (default: 256).
+    compression, compression_opts : optional
+        h5py compression filter and its level (default: "gzip", 4).
+    """
+
+    def __init__(self, filename, name="mcmc", checkpoint_every=100, chunk_steps=256, compression="gzip", compression_opts=4):
+        super().__init__(filename, name=name, compression=compression, compression_opts=compression_opts)
+        self.checkpoint_every = int(checkpoint_every)
+        self.chunk_steps = int(chunk_steps)
+        self._pending = []
+
+    def reset(self, nwalkers, ndim):
+        """Clear the run and create empty chunked datasets for it."""
+        self._pending = []
+        with self.open("a") as f:
+            if self.name in f:
+                del f[self.name]
+            g = f.create_group(self.name)
+            g.attrs["version"] = emcee.__version__
+            g.attrs["nwalkers"] = nwalkers
+            g.attrs["ndim"] = ndim
+            g.attrs["has_blobs"] = False
+            g.attrs["iteration"] = 0
+            options = {"compression": self.compression, "compression_opts": self.compression_opts}
+            g.create_dataset("accepted", data=np.zeros(nwalkers))
+            g.create_dataset("chain", (0, nwalkers, ndim), maxshape=(None, nwalkers, ndim), dtype=self.dtype,
+                             chunks=(self.chunk_steps, nwalkers, ndim), **options)
+            g.create_dataset("log_prob", (0, nwalkers), maxshape=(None, nwalkers), dtype=self.dtype,
+                             chunks=(self.chunk_steps, nwalkers), **options)
+
+    def save_step(self, state, accepted):
+        """Queue a step, flushing once checkpoint_every steps are pending."""
+        self._pending.append((np.array(state.coords), np.array(state.log_prob), np.array(accepted), state.random_state))
+        if len(self._pending) >= self.checkpoint_every:
+            self.flush()
+
+    def flush(self):
+        """Write the pending steps to the file as one checkpoint."""
+        if not self._pending:
+            return
+        coords, log_prob, accepted, _ = zip(*self._pending)
+        random_state = self._pending[-1][3]
+        with self.open("a") as f:
+            g = f[self.name]
+            iteration = g.attrs["iteration"]
+            end = iteration + len(coords)
+            g["chain"].resize(end, axis=0)
+            g["log_prob"].resize(end, axis=0)
+            g["chain"][iteration:end] = np.stack(coords)
+            g["log_prob"][iteration:end] = np.stack(log_prob)
+            g["accepted"][:] += np.sum(accepted, axis=0)
+            for i, v in enumerate(random_state):
+                g.attrs[f"random_state_{i}"] = v
+            g.attrs["iteration"] = end
+            f.flush()
+        self._pending = []
+#--------------------------------------------
+
+#--------------------------------------------
+class CountingPosterior:
+    """logposterior_batch() for emcee vectorize=True, counting its evaluations and the waveforms of every worker."""
+
+    def __init__(self, likelihood, mode=None, max_workers=None):
+        self.likelihood = likelihood
+        self.mode = mode
+        self.max_workers = max_workers
+        self.calls = 0          # walker evaluations
+        self.likelihoods = 0    # of which inside the prior, i.e. with a likelihood evaluation
+        self.waveforms = collections.Counter()   # waveforms generated, by tools.parallel.worker_name()
+
+    def __call__(self, params):
+        logpost = logposterior_batch(params, likelihood=self.likelihood, mode=self.mode, max_workers=self.max_workers,
+                                     worker_counts=self.waveforms)
+        self.calls += len(logpost)
+        self.likelihoods += int(np.sum(logpost > -np.inf))
+        return logpost
+#--------------------------------------------
+
+#--------------------------------------------
+def load_config(path: str | None = None, **overrides)-> dict:
+    """Return DEFAULT_CONFIG updated with a JSON config file and then with any non-None overrides."""
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    if path is not None:
+        with open(path) as f:
+            config.update(json.load(f))
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    return config
+#--------------------------------------------
+
+#--------------------------------------------
+def sampled_parameters(config: dict)-> list:
+    """Columns of the full parameter list that the sampler explores, all but the marginalized ones."""
+    marginalized = [MARGINALIZABLE[name] for name in config.get("marginalize", [])]
+    return [i for i in range(len(config["param_bounds"])) if i not in marginalized]
+#--------------------------------------------
+
+#--------------------------------------------
+def load_run_likelihood(config: dict):
+    """
+    The likelihood of a run, marginalized if config["marginalize"] is set.
+
+    A marginalized time shift is integrated over config["time_bounds"],
+    which covers the posterior; the time shift row of param_bounds only
+    bounds the walker starts, the prior has no time shift bound.
+    """
+    ifos, f_lower = tuple(config["ifos"]), float(config["f_lower"])
+    if config.get("marginalize"):
+        time_bounds = tuple(float(t) for t in config.get("time_bounds", TIME_SHIFT_BOUNDS))
+        return load_marginalized_likelihood(tuple(config["marginalize"]), tuple(config["distance_bounds"]), ifos, f_lower, config["rate"],
+                                            time_bounds, config.get("time_mode", "marginalize"))
+    return load_likelihood(ifos, f_lower, config["rate"])
+#--------------------------------------------
+
+#--------------------------------------------
+def starting_positions(config: dict)-> np.ndarray:
+    """
+    Scatter the walkers around the start parameters, as the page's random_in_bounds().
+
+    The start is first moved inside the bounds, as the MAP parameters of the
+    original run lie outside some of them. Uses the legacy global seed, like
+    the page, which also seeds the sampler. Only the sampled parameters are
+    returned, see sampled_parameters().
+    """
+    start = config["start"]
+    if isinstance(start, str):
+        import pandas as pd
+        start = pd.read_parquet(start)["MAP"].iloc[:9].to_numpy()
+    sampled = sampled_parameters(config)
+    start = np.asarray(start, dtype=float)[sampled]
+    bounds = np.array(config["param_bounds"], dtype=float)[sampled]
+    margin = 1e-3 * (bounds[:, 1] - bounds[:, 0])
+    opt = np.clip(start, bounds[:, 0] + margin, bounds[:, 1] - margin)
+
+    np.random.seed(config["seed"])
+    scale = config["jitter"] * np.maximum(np.abs(opt), .1)
+    p0 = []
+    while len(p0) < config["nwalkers"]:
+        trial = opt + np.random.randn(len(opt)) * scale
+        if np.all((bounds[:, 0] <= trial) & (trial <= bounds[:, 1])):
+            p0.append(trial)
+    return np.array(p0)
+#--------------------------------------------
+
+#--------------------------------------------
+def stored_config(filename: str, name: str = "mcmc")-> dict | None:
+    """Return the config stored with a run in a checkpoint file, or None if there is none."""
+    if not os.path.exists(filename):
+        return None
+    with h5py.File(filename, "r") as f:
+        if name not in f or "config" not in f[name].attrs:
+            return None
+        return json.loads(f[name].attrs["config"])
+#--------------------------------------------
+
+#--------------------------------------------
+def save_diagnostics(filename: str, name: str, diagnostics: StreamingDiagnostics):
+    """Store the diagnostics summary as an attribute of the run, and their state as its "diagnostics_state" group."""
+    with h5py.File(filename, "a") as f:
+        g = f[name]
+        g.attrs["diagnostics"] = json.dumps(diagnostics.summary())
+        if "diagnostics_state" in g:
+            del g["diagnostics_state"]
+        state = g.create_group("diagnostics_state")
+        for key, value in diagnostics.state().items():
+            state.create_dataset(key, data=value)
+#--------------------------------------------
+
+#--------------------------------------------
+def load_diagnostics(filename: str, name: str, config: dict)-> StreamingDiagnostics:
+    """The diagnostics stored with a run by save_diagnostics(), or new ones if there are none."""
+    if os.path.exists(filename):
+        with h5py.File(filename, "r") as f:
+            if name in f and "diagnostics_state" in f[name]:
+                group = f[name]["diagnostics_state"]
+                return StreamingDiagnostics.from_state({key: group[key][()] for key in group}, targets=config["targets"])
+    return StreamingDiagnostics(config["nwalkers"], len(sampled_parameters(config)), targets=config["targets"])
+#--------------------------------------------
+
+#--------------------------------------------
+def run_sampler(output: str, config: dict, name: str = "mcmc", callback=None)-> emcee.EnsembleSampler:
+    """
+    Run, or resume, the MCMC with checkpoints.
+
+    Parameters
+    ----------
+    output : str
+        HDF5 checkpoint file. If it already holds the run, the run resumes
+        from its last checkpoint with the stored config, only the
+        RUNTIME_KEYS of config (e.g. nsteps) are taken from the argument.
+    config : dict
+        Run configuration, see DEFAULT_CONFIG.
+    name : str, optional
+        Group of the run inside the file (default: "mcmc").
+    callback : callable, optional
+        Called as callback(sampler, report) after every checkpoint, where
+        report is the dictionary that was printed. Returning True stops the
+        run after that checkpoint.
+
+    Notes
+    -----
+    Every report has the total likelihood evaluations per second, and the 
+    waveforms generated per second by each worker of the pool (keyed by 
+    process id or thread name). The workers only generate the waveforms; 
+    the likelihood of the whole ensemble is one vectorized evaluation in 
+    the calling process, so there is no per-worker likelihood rate. For 
+    the same reason the acceptance is reported per walker, walkers are not 
+    tied to workers.
+
+    With config["auto_stop"], the StreamingDiagnostics summary is added to 
+    every report and stored as the "diagnostics" attribute of the run, and 
+    the run stops at the first checkpoint where config["targets"] are met. 
+    The fixed-size diagnostics state is stored with every checkpoint, so a 
+    resumed run continues from it and only reads the steps after it.
+
+    Returns
+    -------
+    emcee.EnsembleSampler
+        The sampler, with every step flushed to the file.
+    """
+    previous = stored_config(output, name)
+    if previous is not None:
+        config = dict(previous, **{key: config[key] for key in RUNTIME_KEYS})
+
+    ndim = len(sampled_parameters(config))
+    backend = CheckpointBackend(output, name=name, checkpoint_every=config["checkpoint_every"], chunk_steps=config["chunk_steps"],
+                                compression=config["compression"], compression_opts=config["compression_level"])
+    if previous is None:
+        backend.reset(config["nwalkers"], ndim)
+        with h5py.File(output, "a") as f:
+            f[name].attrs["config"] = json.dumps(config)
+    # also for a stored run killed before its first checkpoint
+    p0 = starting_positions(config) if backend.iteration == 0 else None   # seeds the global generator the sampler starts from
+
+    likelihood = load_run_likelihood(config)
+    posterior = CountingPosterior(likelihood, mode=config["mode"], max_workers=config["max_workers"])
+    moves = [(getattr(emcee.moves, move)(**kwargs), weight) for move, kwargs, weight in config["moves"]]
+    sampler = emcee.EnsembleSampler(config["nwalkers"], ndim, posterior, moves=moves, backend=backend, vectorize=True)
+
+    diagnostics = load_diagnostics(output, name, config) if config["auto_stop"] else None
+    initial = p0
+    if backend.iteration > 0:
+        print(f"resuming {output} at step {backend.iteration} of {config['nsteps']}")
+
+    while backend.iteration < config["nsteps"]:
+        steps = min(config["checkpoint_every"], config["nsteps"] - backend.iteration)
+        accepted, calls, likelihoods, waveforms = backend.accepted, posterior.calls, posterior.likelihoods, posterior.waveforms.copy()
+        start = time.perf_counter()
+
+        sampler.run_mcmc(initial, steps)
+        backend.flush()
+        initial = None
+
+        seconds = time.perf_counter() - start
+        acceptance = (backend.accepted - accepted) / steps
+        report = {"step": int(backend.iteration),
+                  "evals_per_second": (posterior.calls - calls) / seconds,
+                  "likelihood_evals_per_second": (posterior.likelihoods - likelihoods) / seconds,
+                  "waveforms_per_second_per_worker": {worker: count / seconds for worker, count in (posterior.waveforms - waveforms).items()},
+                  "acceptance": float(acceptance.mean()),
+                  "acceptance_per_walker": acceptance.round(3).tolist()}
+        print(f"step {report['step']:>7}/{config['nsteps']}: {report['likelihood_evals_per_second']:7.1f} likelihood evals/s "
+              f"(total, {config['mode']} pool), "
+              f"acceptance {report['acceptance']:.2f} (walkers {acceptance.min():.2f}-{acceptance.max():.2f})", flush=True)
+        if report["waveforms_per_second_per_worker"]:
+            print("    waveforms/s per worker: " + ", ".join(f"{worker} {rate:.1f}" for worker, rate in
+                                                          sorted(report["waveforms_per_second_per_worker"].items())), flush=True)
+
+        if diagnostics is not None:
+            summary = report["diagnostics"] = diagnostics.update(backend.get_chain(discard=diagnostics.nsteps))
+            save_diagnostics(output, name, diagnostics)
+            rhat = np.array(summary["rhat"])
+            max_rhat = rhat.max() if np.all(np.isfinite(rhat)) else np.nan
+            print(f"    tau_max {summary['tau_max']:.1f} ({summary['steps']/summary['tau_max']:.1f} tau), max R-hat {max_rhat:.4f}, "
+                  f"min ESS {min(summary['ess']):.0f}, burn-in {summary['burn_in']}, thin {summary['thin']}, "
+                  f"targets met: {', '.join(key for key, met in summary['targets_met'].items() if met) or 'none'}", flush=True)
+        if callback is not None and callback(sampler, report):
+            break
+        if diagnostics is not None and report["diagnostics"]["converged"]:
+            print(f"converged after {backend.iteration} steps")
+            break
+
+    return sampler
+#--------------------------------------------
+
+#--------------------------------------------
+def reconstruct_chain(output: str, name: str = "mcmc", discard: int = 0, thin: int = 1, seed: int = 0, **kwargs)-> np.ndarray:
+    """
+    Read a chain back with all 9 parameters.
+
+    For a run with a marginalized likelihood, the marginalized parameters of
+    every sample are drawn from their conditional posterior, see
+    MarginalizedLikelihood.reconstruct(); this costs one template per sample.
+
+    Parameters
+    ----------
+    output : str
+        HDF5 checkpoint file of the run.
+    name : str, optional
+        Group of the run inside the file (default: "mcmc").
+    discard, thin : int, optional
+        Burn-in and thinning, as emcee's get_chain().
+    seed : int, optional
+        Seed of the draws (default: 0).
+    **kwargs
+        Passed on to the templates, e.g. mode and max_workers.
+
+    Returns
+    -------
+    numpy.ndarray
+        Samples of shape (steps, nwalkers, 9).
+    """
+    config = stored_config(output, name)
+    chain = HDFBackend(output, name=name, read_only=True).get_chain(discard=discard, thin=thin)
+    if not config or not config.get("marginalize"):
+        return chain
+    samples = load_run_likelihood(config).reconstruct(chain.reshape(-1, chain.shape[-1]), seed=seed, **kwargs)
+    return samples.reshape(chain.shape[:2] + (samples.shape[-1],))
+#--------------------------------------------
+
+#--------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="MCMC_save_data.h5", help="HDF5 checkpoint file, resumed if it exists")
+    parser.add_argument("--config", help="JSON file overriding DEFAULT_CONFIG")
+    parser.add_argument("--nsteps", type=int)
+    parser.add_argument("--nwalkers", type=int)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--ifos", nargs="+")
+    parser.add_argument("--checkpoint-every", type=int, dest="checkpoint_every")
+    parser.add_argument("--mode", choices=["serial", "thread", "process"])
+    parser.add_argument("--max-workers", type=int, dest="max_workers")
+    parser.add_argument("--marginalize", nargs="*", choices=sorted(MARGINALIZABLE), help="parameters to integrate out of the likelihood")
+    parser.add_argument("--no-auto-stop", action="store_false", dest="auto_stop", default=None, help="always run the full nsteps")
+    args = parser.parse_args()
+
+    overrides = {key: value for key, value in vars(args).items() if key not in ("output", "config")}
+    run_sampler(args.output, load_config(args.config, **overrides))
+#--------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Memory-mapped access to the posterior samples.
+
+The chain is converted once from parquet to an Arrow IPC (feather v2) file,
+uncompressed and sorted by draw, then chain, in record batches of a fixed
+number of rows. The smallest and largest chain and draw of every batch are
+kept in the schema metadata. Reading the file maps it into memory, so
+
+- only the requested columns are touched, straight from the page cache and
+  without copies for whole batches,
+- batches whose chain or draw range misses the requested one are skipped
+  before they are read, and
+- one PosteriorSamples can be shared by every session of the app (it holds
+  no per-read state), so the memory use does not grow with the sessions:
+
+    samples = load_posterior_samples()
+    samples.read(["Mass", "Ratio"], draws=(35426, None))     # pandas.DataFrame
+    for batch in samples.iter_batches(["RA", "Dec"], chains=[0, 1]):
+        ...
+
+    python -m tools.samples --input MCMC_data/mcmc_df_with_log_post.parquet
+"""
+import argparse
+import functools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from tools.posterior import PARAMETER_NAMES
+
+SAMPLES_FILE = "MCMC_data/mcmc_samples.arrow"
+CHAIN_FILE = "MCMC_data/mcmc_df_with_log_post.parquet"
+SAMPLE_COLUMNS = PARAMETER_NAMES + ["lp", "chain", "draw"]
+BATCH_ROWS = 2**16   # rows per record batch, the granularity of the chain/draw pushdown
+
+#--------------------------------------------
+def convert_chain(path: str = CHAIN_FILE, output: str = SAMPLES_FILE, batch_rows: int = BATCH_ROWS)-> str:
+    """
+    Write a parquet chain as a memory-mappable Arrow IPC file.
+
+    Parameters
+    ----------
+    path : str
+        Parquet chain with the SAMPLE_COLUMNS.
+    output : str
+        The Arrow file (default: SAMPLES_FILE).
+    batch_rows : int, optional
+        Rows per record batch (default: 2**16).
+
+    Returns
+    -------
+    str
+        output, written through a temporary file so readers never see a partial file.
+    """
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path, columns=SAMPLE_COLUMNS)
+    table = table.sort_by([("draw", "ascending"), ("chain", "ascending")]).combine_chunks()
+    batches = table.to_batches(max_chunksize=batch_rows)
+    ranges = [[pc.min(b["chain"]).as_py(), pc.max(b["chain"]).as_py(), pc.min(b["draw"]).as_py(), pc.max(b["draw"]).as_py()]
+              for b in batches]
+    schema = table.schema.with_metadata({"batch_ranges": json.dumps(ranges)})
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    temporary = f"{output}.{os.getpid()}.tmp"
+    with pa.OSFile(temporary, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    os.replace(temporary, output)
+    return output
+#--------------------------------------------
+
+#--------------------------------------------
+def _range_mask(ranges: np.ndarray, low: int, high: int | None)-> np.ndarray:
+    """Batches whose [min, max] overlaps [low, high), high None for no upper limit."""
+    overlap = ranges[:, 1] >= low
+    return overlap if high is None else overlap & (ranges[:, 0] < high)
+#--------------------------------------------
+
+#--------------------------------------------
+class PosteriorSamples:
+    """
+    Column-projected, memory-mapped reader of an Arrow sample file.
+
+    Parameters
+    ----------
+    path : str
+        Arrow IPC file written by convert_chain() (default: SAMPLES_FILE).
+
+    Notes
+    -----
+    chains is a collection of walkers, draws a (start, stop) range of steps
+    with stop None for no limit. Both are first matched against the stored
+    range of every batch, then applied row by row in the batches that
+    remain.
+    """
+
+    def __init__(self, path: str = SAMPLES_FILE):
+        self.path = path
+        self._reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+        self.schema = self._reader.schema
+        self.columns = self.schema.names
+        metadata = self.schema.metadata or {}
+        ranges = json.loads(metadata.get(b"batch_ranges", b"[]"))
+        if len(ranges) != self._reader.num_record_batches:
+            # not written by convert_chain(), read the chain and draw columns once for the ranges
+            ranges = []
+            for k in range(self._reader.num_record_batches):
+                batch = self._reader.get_batch(k).select(["chain", "draw"])
+                ranges.append([pc.min(batch["chain"]).as_py(), pc.max(batch["chain"]).as_py(),
+                               pc.min(batch["draw"]).as_py(), pc.max(batch["draw"]).as_py()])
+        self.batch_ranges = np.array(ranges, dtype=np.int64).reshape(-1, 4)
+        self.n_rows = sum(self._reader.get_batch(k).num_rows for k in range(self._reader.num_record_batches))
+
+    def __len__(self)-> int:
+        return self.n_rows
+
+    def _batches(self, chains=None, draws=None)-> np.ndarray:
+        """Indices of the record batches that can hold the requested chains and draws."""
+        keep = np.ones(len(self.batch_ranges), dtype=bool)
+        if chains is not None:
+            chains = np.asarray(chains)
+            keep &= _range_mask(self.batch_ranges[:, :2], chains.min(), chains.max() + 1) if len(chains) else False
+        if draws is not None:
+            keep &= _range_mask(self.batch_ranges[:, 2:], draws[0] or 0, draws[1])
+        return np.flatnonzero(keep)
+
+    def iter_batches(self, columns=None, chains=None, draws=None):
+        """
+        Yield the rows of the requested chains and draws, batch by batch.
+
+        Parameters
+        ----------
+        columns : list, optional
+            Columns to read (default: all).
+        chains : array-like, optional
+            Walkers to keep (default: all).
+        draws : tuple, optional
+            (start, stop) range of steps to keep, either may be None (default: all).
+
+        Yields
+        ------
+        pyarrow.RecordBatch
+            The requested columns, zero-copy views of the file where no row is filtered out.
+        """
+        columns = self.columns if columns is None else list(columns)
+        for k in self._batches(chains, draws):
+            batch = self._reader.get_batch(int(k))
+            chain_range, draw_range = self.batch_ranges[k, :2], self.batch_ranges[k, 2:]
+            mask = None
+            if chains is not None and not (chain_range[0] == chain_range[1] and chain_range[0] in chains):
+                mask = pc.is_in(batch["chain"], value_set=pa.array(np.asarray(chains), type=batch.schema.field("chain").type))
+            if draws is not None:
+                start, stop = draws[0] or 0, draws[1]
+                if draw_range[0] < start:
+                    mask = pc.greater_equal(batch["draw"], start) if mask is None else pc.and_(mask, pc.greater_equal(batch["draw"], start))
+                if stop is not None and draw_range[1] >= stop:
+                    mask = pc.less(batch["draw"], stop) if mask is None else pc.and_(mask, pc.less(batch["draw"], stop))
+            batch = batch.select(columns)
+            yield batch if mask is None else batch.filter(mask)
+
+    def read_table(self, columns=None, chains=None, draws=None)-> pa.Table:
+        """The requested columns, chains and draws as one pyarrow.Table, see iter_batches()."""
+        columns = self.columns if columns is None else list(columns)
+        batches = list(self.iter_batches(columns, chains, draws))
+        return pa.Table.from_batches(batches, schema=self.schema.empty_table().select(columns).schema)
+
+    def read(self, columns=None, chains=None, draws=None)-> pd.DataFrame:
+        """The requested columns, chains and draws as a pandas.DataFrame, see iter_batches()."""
+        return self.read_table(columns, chains, draws).to_pandas()
+
+    def read_numpy(self, columns=PARAMETER_NAMES, chains=None, draws=None)-> np.ndarray:
+        """The requested columns as a float (n_rows, n_columns) array, see iter_batches()."""
+        table = self.read_table(columns, chains, draws)
+        return np.column_stack([table[name].to_numpy() for name in table.column_names]).astype(float, copy=False)
+#--------------------------------------------
+
+#--------------------------------------------
+@functools.lru_cache(maxsize=None)
+def load_posterior_samples(path: str = SAMPLES_FILE, chain: str = CHAIN_FILE)-> PosteriorSamples:
+    """Open the sample file once per process, converting it from the parquet chain if it is missing."""
+    if not os.path.exists(path):
+        convert_chain(chain, path)
+    return PosteriorSamples(path)
+#--------------------------------------------
+
+#--------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default=CHAIN_FILE, help="parquet chain")
+    parser.add_argument("--output", default=SAMPLES_FILE)
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, dest="batch_rows")
+    args = parser.parse_args()
+
+    samples = PosteriorSamples(convert_chain(args.input, args.output, args.batch_rows))
+    print(f"{len(samples)} samples in {len(samples.batch_ranges)} batches, "
+          f"written {args.output} ({os.path.getsize(args.output) / 2**20:.0f} MB)")
+#--------------------------------------------
+
+if __name__ == "__main__":
+    main()